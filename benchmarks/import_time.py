@@ -0,0 +1,23 @@
+"""
+Import-time benchmark for nbs_bl.
+
+Prints the slowest imports of a module, with nbs_bl installed::
+
+    python benchmarks/import_time.py nbs_bl.plans
+"""
+
+import sys
+from nbs_bl.profiling import import_times
+
+
+def main():
+    module = sys.argv[1] if len(sys.argv) > 1 else "nbs_bl.plans"
+    times = import_times(module)
+    print(f"import {module}: {times.get(module, 0) / 1e6:.3f} s")
+    slowest = sorted(times.items(), key=lambda t: t[1], reverse=True)[:20]
+    for name, cumulative in slowest:
+        print(f"{cumulative / 1e6:8.3f} s  {name}")
+
+
+if __name__ == "__main__":
+    main()
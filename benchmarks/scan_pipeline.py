@@ -0,0 +1,56 @@
+"""
+Message throughput benchmark for the scan pipeline.
+
+Measures messages/second through nbs_scan, with and without a RunEngine,
+with nbs_bl installed::
+
+    python benchmarks/scan_pipeline.py 2000
+"""
+
+import contextlib
+import io
+import sys
+import time
+from bluesky import RunEngine
+from ophyd.sim import SynAxis, SynGauss
+
+
+def drive(plan, reading):
+    """Iterate a plan without a RunEngine, and return the number of messages."""
+    n = 0
+    reply = None
+    while True:
+        try:
+            msg = plan.send(reply)
+        except StopIteration:
+            return n
+        n += 1
+        reply = reading if msg.command == "read" else None
+
+
+def main():
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with contextlib.redirect_stdout(io.StringIO()):
+        from nbs_bl.plans.scans import nbs_scan
+
+    motor = SynAxis(name="motor")
+    det = SynGauss("det", motor, "motor", 0, 1)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        n = drive(nbs_scan(motor, 0, 1, num, extra_dets=[det]), det.read())
+        elapsed = time.perf_counter() - start
+    print(f"plan only: {n} messages, {n / elapsed:.0f} messages/s")
+
+    RE = RunEngine({}, context_managers=[])
+    count = [0]
+    RE.msg_hook = lambda msg: count.__setitem__(0, count[0] + 1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        RE(nbs_scan(motor, 0, 1, num, extra_dets=[det]))
+        elapsed = time.perf_counter() - start
+    print(f"RunEngine: {count[0]} messages, {count[0] / elapsed:.0f} messages/s")
+
+
+if __name__ == "__main__":
+    main()
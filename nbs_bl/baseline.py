@@ -0,0 +1,685 @@
+"""
+Baseline readings that are served from monitored subscriptions.
+
+A full baseline is read with ``trigger_and_read`` at the start and at the end
+of every run, which costs a round trip per signal. In monitor mode, each
+baseline device is replaced in the baseline stream by a
+:class:`MonitoredReadable`, which subscribes once to the signals of the
+device, and answers ``read`` from the latest values and timestamps that
+the subscriptions delivered. Signals that could not be subscribed to, have
+not delivered a value yet, or are disconnected, are read explicitly.
+
+Monitored devices are not triggered, so monitor mode is meant for devices
+whose readings update on their own, such as motors, gauges and PVs of the
+accelerator.
+"""
+
+import threading
+import numpy as np
+from bluesky import Msg
+from bluesky.plan_stubs import create, declare_stream, read, save, trigger_and_read
+from bluesky.utils import short_uid
+from bluesky.preprocessors import (
+    SupplementalData,
+    plan_mutator,
+    set_run_key_wrapper,
+    monitor_during_wrapper,
+    fly_during_wrapper,
+)
+from .lazy import LazyDevice, resolve_lazy
+
+
+def _device_signals(device):
+    """Map the names of all signals of a device to the signals."""
+    if hasattr(device, "walk_signals"):
+        walks = device.walk_signals(include_lazy=False)
+        return {walk.item.name: walk.item for walk in walks}
+    return {device.name: device}
+
+
+class _SignalCache:
+    """
+    Latest readings of a set of data keys, kept up to date by subscriptions.
+
+    Parameters
+    ----------
+    keys : iterable of str
+        Data keys to cache
+    signals : dict
+        Signals of the device, by name
+    """
+
+    def __init__(self, keys, signals):
+        self.keys = list(keys)
+        self.signals = {}
+        self.unmonitored = []
+        # Unmonitored keys that can be read from their own signal
+        self._read_signals = {}
+        self._readings = {}
+        self._subscriptions = []
+        for key in self.keys:
+            signal = signals.get(key, None)
+            if signal is None:
+                self.unmonitored.append(key)
+                continue
+            if not hasattr(signal, "subscribe"):
+                self.unmonitored.append(key)
+                self._read_signals[key] = signal
+                continue
+            try:
+                cid = signal.subscribe(
+                    self._make_callback(key), event_type=signal.SUB_VALUE, run=True
+                )
+            except Exception as e:
+                print(f"Could not monitor {key}, it will be read explicitly: {e}")
+                self.unmonitored.append(key)
+                self._read_signals[key] = signal
+                continue
+            self.signals[key] = signal
+            self._subscriptions.append((signal, cid))
+
+    def _make_callback(self, key):
+        def callback(*args, value=None, timestamp=None, **kwargs):
+            self._readings[key] = {"value": value, "timestamp": timestamp}
+
+        return callback
+
+    def stale_keys(self):
+        """Monitored keys without a value, or whose signal is disconnected."""
+        return [
+            key
+            for key, signal in self.signals.items()
+            if key not in self._readings or not getattr(signal, "connected", True)
+        ]
+
+    def read(self, read_device):
+        """
+        Get the cached readings, reading stale and unmonitored keys explicitly.
+
+        Parameters
+        ----------
+        read_device : callable
+            Reads the whole device, only used if some keys have no signal
+
+        Returns
+        -------
+        dict
+            Readings of all keys, in the order of the device description
+        """
+        fresh = {}
+        if len(self._read_signals) < len(self.unmonitored):
+            fresh.update(read_device())
+        else:
+            for signal in self._read_signals.values():
+                fresh.update(signal.read())
+        for key in self.stale_keys():
+            fresh.update(self.signals[key].read())
+        readings = {}
+        for key in self.keys:
+            if key in fresh:
+                readings[key] = fresh[key]
+            else:
+                readings[key] = dict(self._readings[key])
+        return readings
+
+    def clear(self):
+        """Remove all subscriptions."""
+        for signal, cid in self._subscriptions:
+            try:
+                signal.unsubscribe(cid)
+            except Exception as e:
+                print(f"Could not unsubscribe from {signal.name}: {e}")
+        self._subscriptions = []
+        self.signals = {}
+        self._readings = {}
+
+
+class MonitoredReadable:
+    """
+    Readable stand-in for a baseline device, read from monitored values.
+
+    Subscriptions are made when the stand-in is created, and are kept
+    until :meth:`clear` is called, so that they are reused by every run.
+
+    Parameters
+    ----------
+    device : ophyd.Device or ophyd.Signal
+        The baseline device
+    """
+
+    def __init__(self, device):
+        self.device = resolve_lazy(device)
+        self.name = self.device.name
+        self.parent = None
+        signals = _device_signals(self.device)
+        self._description = self.device.describe()
+        self._data = _SignalCache(self._description, signals)
+        if hasattr(self.device, "describe_configuration"):
+            self._config_description = self.device.describe_configuration()
+            self._config = _SignalCache(self._config_description, signals)
+        else:
+            self._config_description = {}
+            self._config = None
+
+    @property
+    def unmonitored(self):
+        """Data keys that are read explicitly, because they have no signal"""
+        return list(self._data.unmonitored)
+
+    def describe(self):
+        return dict(self._description)
+
+    def read(self):
+        return self._data.read(self.device.read)
+
+    def describe_configuration(self):
+        return dict(self._config_description)
+
+    def read_configuration(self):
+        if self._config is None:
+            return {}
+        return self._config.read(self.device.read_configuration)
+
+    def clear(self):
+        """Remove all subscriptions of this stand-in."""
+        self._data.clear()
+        if self._config is not None:
+            self._config.clear()
+
+    def __repr__(self):
+        return f"MonitoredReadable({self.device!r})"
+
+
+# Stand-ins by id of their device, kept for the whole session
+_monitored = {}
+_monitored_lock = threading.Lock()
+
+
+def get_monitored_readable(device):
+    """
+    Get the monitored stand-in for a device, creating it on first use.
+
+    Parameters
+    ----------
+    device : ophyd.Device or ophyd.Signal
+
+    Returns
+    -------
+    MonitoredReadable
+    """
+    device = resolve_lazy(device)
+    with _monitored_lock:
+        monitored = _monitored.get(id(device), None)
+        if monitored is None or monitored.device is not device:
+            monitored = MonitoredReadable(device)
+            _monitored[id(device)] = monitored
+    return monitored
+
+
+def release_monitored(device):
+    """
+    Remove the subscriptions of a device and of all its subdevices.
+
+    Parameters
+    ----------
+    device : ophyd.Device or ophyd.Signal
+    """
+    if isinstance(device, LazyDevice):
+        if not device.materialized:
+            return
+        device = device.materialize()
+    with _monitored_lock:
+        for key, monitored in list(_monitored.items()):
+            obj = monitored.device
+            while obj is not None and obj is not device:
+                obj = getattr(obj, "parent", None)
+            if obj is device:
+                monitored.clear()
+                del _monitored[key]
+
+
+class _BaselineSnapshot:
+    """
+    Readable that records readings which were already taken from a device.
+
+    Parameters
+    ----------
+    device : object
+        The device, or its monitored stand-in, that the readings came from
+    keys : collection of str, optional
+        Only record these data keys
+    """
+
+    def __init__(self, device, keys=None):
+        self.device = device
+        self.name = device.name
+        self.parent = None
+        description = device.describe()
+        if keys is not None:
+            description = {k: v for k, v in description.items() if k in keys}
+        self._description = description
+        self.readings = {}
+
+    def describe(self):
+        return dict(self._description)
+
+    def read(self):
+        return {key: self.readings[key] for key in self._description}
+
+    def describe_configuration(self):
+        if hasattr(self.device, "describe_configuration"):
+            return self.device.describe_configuration()
+        return {}
+
+    def read_configuration(self):
+        if hasattr(self.device, "read_configuration"):
+            return self.device.read_configuration()
+        return {}
+
+
+class BaselineReference:
+    """
+    Values of the last full baseline recorded in a stream.
+
+    Parameters
+    ----------
+    uid : str
+        uid of the run that recorded the full baseline
+    readings : dict
+        The last readings of that run's baseline stream
+    snapshots : list, optional
+        The readables that recorded the stream, so that a later repetition
+        of a "single_run" repeat records the same stream
+    """
+
+    def __init__(self, uid, readings, snapshots=None):
+        self.uid = uid
+        self.snapshots = snapshots
+        self.values = {key: reading["value"] for key, reading in readings.items()}
+
+    def changed_keys(self, readings, tolerances=None):
+        """
+        Get the data keys whose values differ from the reference.
+
+        Parameters
+        ----------
+        readings : dict
+            Readings with the same data keys as the reference
+        tolerances : dict, optional
+            Largest difference of a numeric value that is not a change, by
+            data key. Keys that are not given must be equal
+
+        Returns
+        -------
+        list of str
+        """
+        tolerances = tolerances or {}
+        return [
+            key
+            for key, reading in readings.items()
+            if not _same_value(
+                reading["value"], self.values[key], tolerances.get(key, 0)
+            )
+        ]
+
+
+def _same_value(a, b, tolerance=0):
+    if tolerance:
+        try:
+            return bool(np.all(np.abs(np.subtract(a, b)) <= tolerance))
+        except (TypeError, ValueError):
+            pass
+    try:
+        return bool(a == b)
+    except ValueError:
+        return np.array_equal(a, b)
+
+
+# Last full baseline of each stream name, for change-only recording. The
+# references only live in this process, so after a restart, or after
+# reset_baseline_reference, the first run records a full baseline again.
+_references = {}
+
+
+def reset_baseline_reference(name=None):
+    """
+    Make the next change-only baseline record all values again.
+
+    Parameters
+    ----------
+    name : str, optional
+        Baseline stream to reset. If None, reset all streams
+    """
+    if name is None:
+        _references.clear()
+    else:
+        _references.pop(name, None)
+
+
+def get_baseline_reference(name):
+    """
+    Get the last full baseline recorded in a stream.
+
+    Parameters
+    ----------
+    name : str
+        Baseline stream name
+
+    Returns
+    -------
+    BaselineReference or None
+    """
+    return _references.get(name, None)
+
+
+def _read_baseline(devices):
+    """Trigger and read devices without recording an event."""
+    group = short_uid("baseline_trigger")
+    for obj in devices:
+        if hasattr(obj, "trigger"):
+            yield Msg("trigger", obj, group=group)
+    yield Msg("wait", None, group=group)
+    readings = {}
+    for obj in devices:
+        readings[obj] = yield Msg("read", obj)
+    return readings
+
+
+def _record_snapshots(snapshots, readings, name):
+    """Record one event of readings that were taken before."""
+    yield from create(name)
+    for snapshot in snapshots:
+        snapshot.readings = readings[snapshot.device]
+        yield from read(snapshot)
+    yield from save()
+
+
+def _merge_readings(readings):
+    merged = {}
+    for reading in readings.values():
+        merged.update(reading)
+    return merged
+
+
+def _key_tolerances(devices, tolerances):
+    """Tolerance of each data key, given by data key or by device name."""
+    key_tolerances = {}
+    for device in devices:
+        for key in device.describe():
+            tolerance = tolerances.get(key, tolerances.get(device.name, None))
+            if tolerance is not None:
+                key_tolerances[key] = tolerance
+    return key_tolerances
+
+
+def _change_only_baseline_wrapper(plan, get_devices, name, tolerances=None):
+    """
+    Record only the baseline values that differ from the last full baseline.
+
+    A run records a full baseline if no full baseline was recorded in this
+    stream by this process yet, if the data keys of the baseline changed, or
+    if more than half of the values changed. Otherwise, the readings at open
+    and at close are held back until the run closes, and then both are
+    recorded with only the data keys whose value differs from the full
+    baseline at either point. If nothing changed, the run has no baseline
+    stream. Numeric values that differ by no more than their tolerance, e.g.
+    noisy readbacks, are not changes.
+
+    The start document of every run gets ``baseline_references[name]``,
+    which is None for a run with a full baseline, and otherwise the uid of
+    the run whose last baseline event holds the full baseline. The full
+    baseline is only remembered in memory, so the first run after a restart
+    always records a full baseline, and never references an earlier run.
+
+    Parameters
+    ----------
+    plan : iterable or iterator
+        The plan to record a baseline for
+    get_devices : callable
+        Returns the devices to read, called as each run opens
+    name : str
+        Name of the baseline stream
+    tolerances : dict, optional
+        Tolerance of numeric values, by data key or by device name
+    """
+    tolerances = tolerances or {}
+    # State of each open run, by run key
+    runs = {}
+
+    def open_head(msg, devices):
+        all_keys = [key for device in devices for key in device.describe()]
+        key_tolerances = _key_tolerances(devices, tolerances)
+        readings = yield from _read_baseline(devices)
+        merged = _merge_readings(readings)
+        reference = _references.get(name, None)
+        full = reference is None or set(reference.values) != set(all_keys)
+        if not full:
+            changed = reference.changed_keys(merged, key_tolerances)
+            full = len(changed) > len(all_keys) / 2
+        references = dict(msg.kwargs.get("baseline_references", {}))
+        references[name] = None if full else reference.uid
+        kwargs = dict(msg.kwargs, baseline_references=references)
+        uid = yield msg._replace(kwargs=kwargs)
+        snapshots = [_BaselineSnapshot(device) for device in devices]
+        if reference is not None and reference.uid == uid:
+            # A later repetition of a "single_run" repeat continues a full run
+            full = True
+            snapshots = reference.snapshots
+        runs[msg.run] = {
+            "uid": uid,
+            "devices": devices,
+            "tolerances": key_tolerances,
+            "full": full,
+            "reference": reference,
+            "open": readings,
+            "snapshots": snapshots,
+        }
+
+    def open_tail(msg):
+        run = runs[msg.run]
+        if run["full"]:
+            yield from declare_stream(*run["snapshots"], name=name)
+            yield from _record_snapshots(run["snapshots"], run["open"], name)
+
+    def close_head(msg):
+        run = runs.pop(msg.run)
+        devices, key_tolerances = run["devices"], run["tolerances"]
+        readings = yield from _read_baseline(devices)
+        if run["full"]:
+            yield from _record_snapshots(run["snapshots"], readings, name)
+            _references[name] = BaselineReference(
+                run["uid"], _merge_readings(readings), run["snapshots"]
+            )
+        else:
+            reference = run["reference"]
+            changed = set(
+                reference.changed_keys(_merge_readings(run["open"]), key_tolerances)
+            )
+            changed.update(
+                reference.changed_keys(_merge_readings(readings), key_tolerances)
+            )
+            snapshots = [_BaselineSnapshot(device, changed) for device in devices]
+            snapshots = [s for s in snapshots if s.describe()]
+            if snapshots:
+                yield from declare_stream(*snapshots, name=name)
+                yield from _record_snapshots(snapshots, run["open"], name)
+                yield from _record_snapshots(snapshots, readings, name)
+        return (yield msg)
+
+    def insert_baseline(msg):
+        if msg.command == "open_run":
+            if name in msg.kwargs.get("baseline_references", {}):
+                # Already inserted by open_head
+                return None, None
+            devices = [resolve_lazy(device) for device in get_devices()]
+            if not devices:
+                return None, None
+            head, tail = open_head(msg, devices), open_tail(msg)
+        elif msg.command == "close_run" and msg.run in runs:
+            head, tail = close_head(msg), None
+        else:
+            return None, None
+        if msg.run is not None:
+            head = set_run_key_wrapper(head, msg.run)
+            if tail is not None:
+                tail = set_run_key_wrapper(tail, msg.run)
+        return head, tail
+
+    return (yield from plan_mutator(plan, insert_baseline))
+
+
+def baseline_wrapper(
+    plan,
+    devices,
+    name="baseline",
+    monitor=False,
+    change_only=False,
+    tolerances=None,
+):
+    """
+    Preprocessor that records a baseline of all `devices` after `open_run`
+
+    The readings are designated for a separate event stream named 'baseline' by
+    default.
+
+    Parameters
+    ----------
+    plan : iterable or iterator
+        a generator, list, or similar containing `Msg` objects
+    devices : collection
+        collection of Devices to read, taken as each run opens, so that
+        devices added to the collection later are recorded by later runs.
+        If None, the plan passes through unchanged.
+    name : string, optional
+        name for event stream; by default, 'baseline'
+    monitor : bool, optional
+        If True, record the monitored values of the devices instead of
+        triggering and reading them, see :class:`MonitoredReadable`
+    change_only : bool, optional
+        If True, only record the values that differ from the last full
+        baseline, and reference that run in the start document, see
+        :func:`_change_only_baseline_wrapper`
+    tolerances : dict, optional
+        With change_only, the largest difference of a numeric value that is
+        not recorded as a change, by data key or by device name
+
+    Yields
+    ------
+    msg : Msg
+        messages from plan, with 'set' messages inserted
+    """
+    if devices is None:
+        # no-op
+        return (yield from plan)
+
+    def get_devices():
+        if monitor:
+            return [get_monitored_readable(device) for device in devices]
+        return list(devices)
+
+    if change_only:
+        return (
+            yield from _change_only_baseline_wrapper(
+                plan, get_devices, name, tolerances
+            )
+        )
+
+    # Devices of each open run, by run key
+    runs = {}
+
+    def head(devices):
+        yield from declare_stream(*devices, name=name)
+        yield from trigger_and_read(devices, name=name)
+
+    def tail(devices):
+        yield from trigger_and_read(devices, name=name)
+
+    def insert_baseline(msg):
+        if msg.command == "open_run":
+            current = get_devices()
+            if not current:
+                return None, None
+            runs[msg.run] = current
+            if msg.run is not None:
+                return None, set_run_key_wrapper(head(current), msg.run)
+            else:
+                return None, head(current)
+
+        elif msg.command == "close_run" and msg.run in runs:
+            current = runs.pop(msg.run)
+            if msg.run is not None:
+                return set_run_key_wrapper(tail(current), msg.run), None
+            else:
+                return tail(current), None
+
+        return None, None
+
+    return (yield from plan_mutator(plan, insert_baseline))
+
+
+class BaselineSupplementalData(SupplementalData):
+    """
+    SupplementalData with options for how the baseline is recorded.
+
+    Parameters
+    ----------
+    baseline : list, optional
+        Devices to read at the beginning and end of each run
+    monitors : list, optional
+        Signals to monitor during each run
+    flyers : list, optional
+        Flyers to kick off and collect during each run
+    monitor_baseline : bool, optional
+        If True, record the baseline from monitored values, see
+        :func:`baseline_wrapper`
+    change_only_baseline : bool, optional
+        If True, only record the baseline values that changed since the last
+        full baseline, see :func:`baseline_wrapper`
+    baseline_tolerances : dict, optional
+        Tolerances of the change-only baseline, by data key or by device
+        name, see :func:`baseline_wrapper`
+    """
+
+    def __init__(
+        self,
+        *,
+        baseline=None,
+        monitors=None,
+        flyers=None,
+        monitor_baseline=False,
+        change_only_baseline=False,
+        baseline_tolerances=None,
+    ):
+        super().__init__(baseline=baseline, monitors=monitors, flyers=flyers)
+        self.monitor_baseline = monitor_baseline
+        self.change_only_baseline = change_only_baseline
+        self.baseline_tolerances = dict(baseline_tolerances or {})
+
+    def __setstate__(self, state):
+        (
+            *state,
+            self.monitor_baseline,
+            self.change_only_baseline,
+            self.baseline_tolerances,
+        ) = state
+        super().__setstate__(state)
+
+    def __getstate__(self):
+        return (
+            *super().__getstate__(),
+            self.monitor_baseline,
+            self.change_only_baseline,
+            self.baseline_tolerances,
+        )
+
+    def __call__(self, plan):
+        plan = fly_during_wrapper(plan, self.flyers)
+        plan = monitor_during_wrapper(plan, self.monitors)
+        plan = baseline_wrapper(
+            plan,
+            self.baseline,
+            monitor=self.monitor_baseline,
+            change_only=self.change_only_baseline,
+            tolerances=self.baseline_tolerances,
+        )
+        return (yield from plan)
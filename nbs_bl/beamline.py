@@ -1,9 +1,29 @@
-from bluesky.preprocessors import SupplementalData
 from .queueserver import GLOBAL_USER_STATUS
 from .status import StatusDict
-from .hw import HardwareGroup, DetectorGroup, loadFromConfig
-from nbs_core.autoload import instantiateOphyd, _find_deferred_devices, getMaxLoadPass
+from .hw import (
+    HardwareGroup,
+    DetectorGroup,
+    loadDeviceWave,
+    instantiateDevicesParallel,
+    waitForConnections,
+    reportLoadFailures,
+    groupDevices,
+)
+from .device_graph import DeviceGraph
+from .lazy import LazyDevice, resolve_lazy
+from .baseline import BaselineSupplementalData, release_monitored
+from .printing import warning_msg, boxed_text
+from .profiling import GLOBAL_STARTUP_PROFILE
+from .config_cache import (
+    has_compiled_config,
+    load_compiled_config,
+    save_compiled_config,
+)
+from nbs_core.autoload import instantiateOphyd
 from os.path import join, exists
+from importlib import import_module
+import atexit
+import threading
 import IPython
 
 try:
@@ -17,6 +37,30 @@ _default_settings = {
     "beamline_filename": "beamline.toml",
 }
 
+_default_device_loading = {
+    "parallel": True,
+    "max_workers": 16,
+    "connection_timeout": 10,
+    "lazy": False,
+}
+
+_default_setup = {
+    "concurrent_moves": False,
+    "move_order": [["energy"], ["polarization"]],
+    "skip_unchanged": False,
+    "tolerances": {},
+}
+
+_default_baseline = {
+    "monitor": False,
+    "change_only": False,
+    "tolerances": {},
+}
+
+_default_run_engine = {
+    "call_workers": 0,
+}
+
 
 class BeamlineModel:
     default_groups = [
@@ -56,13 +100,15 @@ class BeamlineModel:
         "redis",
         "RE",
         "md",
+        "load_failures",
+        "device_graph",
     ]
 
     def __init__(self, *args, **kwargs):
         """
         Creates an empty BeamlineModel, need to load_devices after init
         """
-        self.supplemental_data = SupplementalData()
+        self.supplemental_data = BaselineSupplementalData()
         self.md = {}
         self.RE = None
         self.settings = StatusDict()
@@ -80,6 +126,25 @@ class BeamlineModel:
         self._deferred_config = {}
         self._deferred_devices = set()
 
+        # Devices that failed to instantiate or connect, with the error raised
+        self.load_failures = {}
+        self.device_graph = None
+
+        # Placeholders for devices that are instantiated on first use
+        self._lazy_devices = {}
+
+        # Resolved dotted device names, see get_device
+        self._device_cache = {}
+
+        # Serializes on-demand loading of deferred devices
+        self._deferred_lock = threading.RLock()
+
+        # Deferred devices that were instantiated and connected in the
+        # background, but not registered yet, see preconnect_deferred_devices
+        self._preconnected = {}
+        self._preconnect_ns = {}
+        self._preconnect_lock = threading.Lock()
+
         # Initialize empty dictionaries for each default group
         for group in self.default_groups:
             if not hasattr(self, group):
@@ -89,7 +154,7 @@ class BeamlineModel:
             if not hasattr(self, role):
                 setattr(self, role, None)
 
-    def load_settings(self, settings_file):
+    def load_settings(self, settings_file, config=None):
         """
         Load settings from a TOML file.
 
@@ -97,21 +162,106 @@ class BeamlineModel:
         ----------
         settings_file : str
             The path to the settings file.
+        config : dict, optional
+            Already parsed contents of the settings file
+
+        Returns
+        -------
+        dict
+            The parsed contents of the settings file
         """
         settings_dict = {}
         settings_dict.update(_default_settings)
 
-        if not exists(settings_file):
+        if config is not None:
+            pass
+        elif not exists(settings_file):
             print("No settings found, using defaults")
             config = {}
         else:
-            with open(settings_file, "rb") as f:
-                config = tomllib.load(f)
+            with GLOBAL_STARTUP_PROFILE.phase("parse_toml"):
+                with open(settings_file, "rb") as f:
+                    config = tomllib.load(f)
         settings_dict.update(config.get("settings", {}))
         self.settings.update(settings_dict)
         print(f"Loading Settings {self.settings}")
+        return config
+
+    def get_device_loading_settings(self):
+        """
+        Get the device loading settings, filled in with defaults.
+
+        Returns
+        -------
+        dict
+            The [settings.device_loading] table from beamline.toml, with
+            defaults for any missing keys
+        """
+        loading = dict(_default_device_loading)
+        loading.update(self.settings.get("device_loading", {}))
+        return loading
+
+    def get_setup_settings(self):
+        """
+        Get the scan setup settings, filled in with defaults.
+
+        Returns
+        -------
+        dict
+            The [settings.setup] table from beamline.toml, with defaults for
+            any missing keys
+        """
+        setup = dict(_default_setup)
+        setup.update(self.settings.get("setup", {}))
+        return setup
+
+    def get_baseline_settings(self):
+        """
+        Get the baseline settings, filled in with defaults.
+
+        Returns
+        -------
+        dict
+            The [settings.baseline] table from beamline.toml, with defaults
+            for any missing keys
+        """
+        baseline = dict(_default_baseline)
+        baseline.update(self.settings.get("baseline", {}))
+        return baseline
+
+    def get_run_engine_settings(self):
+        """
+        Get the RunEngine settings, filled in with defaults.
+
+        Returns
+        -------
+        dict
+            The [settings.run_engine] table from beamline.toml, with defaults
+            for any missing keys
+        """
+        run_engine = dict(_default_run_engine)
+        run_engine.update(self.settings.get("run_engine", {}))
+        return run_engine
 
-    def load_configuration(self, startup_dir):
+    def get_configuration_files(self, startup_dir):
+        """
+        Get the paths of the beamline and device configuration files.
+
+        Parameters
+        ----------
+        startup_dir : str
+            Directory containing configuration files
+
+        Returns
+        -------
+        tuple
+            (beamline_file, device_file)
+        """
+        beamline_file = join(startup_dir, self.settings["beamline_filename"])
+        object_file = join(startup_dir, self.settings["device_filename"])
+        return beamline_file, object_file
+
+    def load_configuration(self, startup_dir, beamline_config=None, object_config=None):
         """
         Load and merge configuration files.
 
@@ -119,33 +269,40 @@ class BeamlineModel:
         ----------
         startup_dir : str
             Directory containing configuration files
+        beamline_config : dict, optional
+            Already parsed beamline configuration
+        object_config : dict, optional
+            Already parsed device configuration
 
         Returns
         -------
         dict
             Device configuration dictionary
         """
-        object_file = join(startup_dir, self.settings["device_filename"])
-        beamline_file = join(startup_dir, self.settings["beamline_filename"])
+        beamline_file, object_file = self.get_configuration_files(startup_dir)
 
-        with open(beamline_file, "rb") as f:
-            beamline_config = tomllib.load(f)
+        with GLOBAL_STARTUP_PROFILE.phase("parse_toml"):
+            if beamline_config is None:
+                with open(beamline_file, "rb") as f:
+                    beamline_config = tomllib.load(f)
 
-        with open(object_file, "rb") as f:
-            object_config = tomllib.load(f)
+            if object_config is None:
+                with open(object_file, "rb") as f:
+                    object_config = tomllib.load(f)
 
         # Store merged configuration
         self.config.update(beamline_config)
         self.config["devices"] = object_config
 
         # Handle Redis settings
-        self.load_redis()
-        self.load_md()
-        tmp_settings = GLOBAL_USER_STATUS.request_status_dict(
-            "SETTINGS", use_redis=True
-        )
-        tmp_settings.update(self.settings)
-        self.settings = tmp_settings
+        with GLOBAL_STARTUP_PROFILE.phase("redis"):
+            self.load_redis()
+            self.load_md()
+            tmp_settings = GLOBAL_USER_STATUS.request_status_dict(
+                "SETTINGS", use_redis=True
+            )
+            tmp_settings.update(self.settings)
+            self.settings = tmp_settings
         print(f"Settings from Redis: {self.settings}")
 
         return object_config
@@ -161,16 +318,74 @@ class BeamlineModel:
         ns : dict, optional
             Namespace for loading devices
         """
-        # Phase 1: Load settings
         settings_file = join(startup_dir, "beamline.toml")
-        self.load_settings(settings_file)
-        self.settings["startup_dir"] = startup_dir
+
+        # Phase 1: Load settings. A cache entry only exists if they enable the
+        # cache, and then holds them already parsed
+        compiled = None
+        if has_compiled_config(settings_file):
+            with GLOBAL_STARTUP_PROFILE.phase("config_cache"):
+                compiled = load_compiled_config(settings_file)
+        with GLOBAL_STARTUP_PROFILE.phase("settings"):
+            settings_config = self.load_settings(
+                settings_file,
+                compiled["settings_config"] if compiled is not None else None,
+            )
+            self.settings["startup_dir"] = startup_dir
+            GLOBAL_STARTUP_PROFILE.enabled = self.settings.get("profiling", {}).get(
+                "startup", False
+            )
+            baseline_settings = self.get_baseline_settings()
+            self.supplemental_data.monitor_baseline = baseline_settings["monitor"]
+            self.supplemental_data.change_only_baseline = baseline_settings[
+                "change_only"
+            ]
+            self.supplemental_data.baseline_tolerances = baseline_settings[
+                "tolerances"
+            ]
+
+        if compiled is not None:
+            print("Using compiled configuration from cache")
+            beamline_config = compiled["beamline_config"]
+            object_config = compiled["device_config"]
+        else:
+            beamline_config = object_config = None
 
         # Phase 2: Load and merge configurations
-        object_config = self.load_configuration(startup_dir)
+        beamline_file, object_file = self.get_configuration_files(startup_dir)
+        if beamline_config is None and beamline_file == settings_file:
+            beamline_config = settings_config
+        with GLOBAL_STARTUP_PROFILE.phase("configuration"):
+            object_config = self.load_configuration(
+                startup_dir, beamline_config, object_config
+            )
 
-        # Phase 3: Load and register devices
-        self.load_devices(object_config, ns)
+        # Phase 3: Analyze device dependencies once. A cached graph shares
+        # its device entries with object_config, like a freshly built one
+        with GLOBAL_STARTUP_PROFILE.phase("device_graph"):
+            if compiled is not None:
+                self.device_graph = compiled["device_graph"]
+            else:
+                self.device_graph = DeviceGraph(object_config)
+                if self.settings.get("config_cache", True):
+                    if beamline_file == settings_file:
+                        beamline_config = None
+                    elif beamline_config is None:
+                        beamline_config = {
+                            k: v for k, v in self.config.items() if k != "devices"
+                        }
+                    save_compiled_config(
+                        settings_file,
+                        [settings_file, beamline_file, object_file],
+                        settings_config=settings_config,
+                        beamline_config=beamline_config,
+                        device_config=object_config,
+                        device_graph=self.device_graph,
+                    )
+
+        # Phase 4: Load and register devices
+        with GLOBAL_STARTUP_PROFILE.phase("devices"):
+            self.load_devices(object_config, ns, graph=self.device_graph)
 
     def register_devices(self, devices, groups, roles):
         """
@@ -222,19 +437,23 @@ class BeamlineModel:
             Dictionary mapping role names to device names
         """
         if "primary_sampleholder" in roles:
-            self._setup_sampleholder(
-                self.primary_sampleholder,
-                "GLOBAL_SAMPLES",
-                "GLOBAL_SELECTED",
-                is_primary=True,
-            )
+            with GLOBAL_STARTUP_PROFILE.item("special_devices", "primary_sampleholder"):
+                self._setup_sampleholder(
+                    self.primary_sampleholder,
+                    "GLOBAL_SAMPLES",
+                    "GLOBAL_SELECTED",
+                    is_primary=True,
+                )
         if "reference_sampleholder" in roles:
-            self._setup_sampleholder(
-                self.reference_sampleholder,
-                "REFERENCE_SAMPLES",
-                "REFERENCE_SELECTED",
-                is_primary=False,
-            )
+            with GLOBAL_STARTUP_PROFILE.item(
+                "special_devices", "reference_sampleholder"
+            ):
+                self._setup_sampleholder(
+                    self.reference_sampleholder,
+                    "REFERENCE_SAMPLES",
+                    "REFERENCE_SELECTED",
+                    is_primary=False,
+                )
 
     def _setup_sampleholder(self, holder, samples_key, current_key, is_primary=False):
         """
@@ -272,41 +491,275 @@ class BeamlineModel:
         except Exception as e:
             print(f"Error reloading sample frames for primary sampleholder: {e}")
 
-    def load_devices(self, config, ns=None, load_pass=None):
+    def load_devices(
+        self, config, ns=None, graph=None, lazy=None, keys=None, include_deferred=False
+    ):
         """
         Load and register devices from configuration.
 
+        Devices are scheduled in waves from the dependency graph of the
+        configuration. All devices in a wave are instantiated concurrently, and
+        registered before the next wave starts, so that factories may look up
+        their dependencies on the beamline.
+
         Parameters
         ----------
         config : dict
             Device configuration dictionary
         ns : dict, optional
             Namespace for loading devices
+        graph : DeviceGraph, optional
+            Pre-computed dependency graph of config. If None, config is analyzed here.
+        lazy : bool, optional
+            If True, register LazyDevice placeholders that are only instantiated
+            on first use, unless a device sets ``_lazy = false``. If None, use
+            the ``lazy`` device loading setting.
+        keys : iterable of str, optional
+            Only load these devices of config. Their dependencies outside of
+            keys must already be loaded. Defaults to all devices.
+        include_deferred : bool, optional
+            If True, also load the deferred devices among keys
         """
-        if load_pass is None:
-            max_load_pass = getMaxLoadPass(config)
-            for pass_num in range(1, max_load_pass + 1):
-                self.load_devices(config, ns, load_pass=pass_num)
-        # Find deferred devices for tracking
-        _, _, deferred_config = _find_deferred_devices(config)
-
-        # Load non-deferred devices
-        devices, groups, roles = loadFromConfig(
-            config, instantiateOphyd, alias=True, namespace=ns, load_pass=load_pass
-        )
+        if graph is None:
+            graph = DeviceGraph(config)
+        if keys is None:
+            keys = graph.config.keys()
+        keys = set(keys)
+        deferred = set() if include_deferred else graph.deferred & keys
 
         # Update deferred device tracking
+        deferred_config = {k: graph.config[k] for k in deferred}
         if deferred_config:
             self._deferred_config.update(deferred_config)
             self._deferred_devices.update(deferred_config.keys())
-        # Remove loaded devices from deferred tracking
-        for device_name in devices:
-            self._deferred_config.pop(device_name, None)
-            self._deferred_devices.discard(device_name)
 
-        # Register devices and handle special cases
-        self.register_devices(devices, groups, roles)
-        self.handle_special_devices(roles)
+        loading = self.get_device_loading_settings()
+        max_workers = loading["max_workers"] if loading["parallel"] else 1
+        if lazy is None:
+            lazy = loading["lazy"]
+        loaded = {}
+        failures = {}
+        for key, missing in graph.missing.items():
+            if key in keys and key not in deferred:
+                failures[key] = KeyError(f"Unknown dependencies {sorted(missing)}")
+
+        def instantiate(device_key, info, **kwargs):
+            with self._preconnect_lock:
+                device = self._preconnected.pop(device_key, None)
+            if device is not None:
+                return device
+            with GLOBAL_STARTUP_PROFILE.item("devices", device_key):
+                return instantiateOphyd(device_key, info, **kwargs)
+
+        waves = graph.waves(
+            [key for key in graph.config if key in keys and key not in deferred]
+        )
+        # Import device classes up front, so that worker threads do not
+        # contend for the import lock. Errors are reported per device later.
+        with GLOBAL_STARTUP_PROFILE.phase("imports"):
+            keys = [key for wave in waves for key in wave]
+            import_failures = {}
+            for module_name in graph.target_modules(keys):
+                try:
+                    with GLOBAL_STARTUP_PROFILE.item("device_modules", module_name):
+                        import_module(module_name)
+                except Exception as e:
+                    import_failures[module_name] = e
+            reportLoadFailures(import_failures, title="Device module import failures")
+
+        for wave_num, wave in enumerate(waves, start=1):
+            ready = []
+            lazy_keys = []
+            for key in wave:
+                if key in failures:
+                    continue
+                unloaded = [dep for dep in graph.requires[key] if dep not in self.devices]
+                if unloaded:
+                    failures[key] = RuntimeError(
+                        f"Dependencies {sorted(unloaded)} were not loaded"
+                    )
+                elif self._is_lazy(config[key], lazy):
+                    lazy_keys.append(key)
+                else:
+                    ready.append(key)
+            with GLOBAL_STARTUP_PROFILE.phase(f"wave_{wave_num}"):
+                devices, groups, roles, wave_failures = loadDeviceWave(
+                    config,
+                    ready,
+                    instantiate,
+                    namespace=ns,
+                    available=self.devices,
+                    max_workers=max_workers,
+                )
+            failures.update(wave_failures)
+            loaded.update(devices)
+
+            # Remove loaded devices from deferred tracking
+            for device_name in devices:
+                self._deferred_config.pop(device_name, None)
+                self._deferred_devices.discard(device_name)
+                self.load_failures.pop(device_name, None)
+
+            # Register devices and handle special cases
+            with GLOBAL_STARTUP_PROFILE.phase(f"register_{wave_num}"):
+                self.register_devices(devices, groups, roles)
+                self.handle_special_devices(roles)
+                if lazy_keys:
+                    lazy_devices = self._make_lazy_devices(config, lazy_keys, graph, ns)
+                    for device_name in lazy_devices:
+                        self._deferred_config.pop(device_name, None)
+                        self._deferred_devices.discard(device_name)
+                        self.load_failures.pop(device_name, None)
+                    self.register_devices(
+                        lazy_devices, *groupDevices(config, lazy_devices)
+                    )
+
+        if loading["connection_timeout"]:
+            with GLOBAL_STARTUP_PROFILE.phase("connections"):
+                not_connected = waitForConnections(
+                    loaded, loading["connection_timeout"]
+                )
+            if not_connected:
+                print(
+                    warning_msg(
+                        f"{len(not_connected)} of {len(loaded)} devices did not "
+                        f"connect within {loading['connection_timeout']} s"
+                    )
+                )
+            failures.update(not_connected)
+        self.load_failures.update(failures)
+        reportLoadFailures(failures)
+
+    def _is_lazy(self, device_info, lazy):
+        if "_alias" in device_info:
+            root = self.devices.get(device_info["_alias"].split(".")[0])
+            return isinstance(root, LazyDevice) and not root.materialized
+        return device_info.get("_lazy", lazy)
+
+    def _make_lazy_devices(self, config, keys, graph, ns=None):
+        """
+        Create LazyDevice placeholders for devices and aliases of lazy devices.
+
+        Parameters
+        ----------
+        config : dict
+            Device configuration dictionary
+        keys : list of str
+            Keys of the devices to create placeholders for
+        graph : DeviceGraph
+            Dependency graph of config
+        ns : dict, optional
+            Namespace for loading devices
+
+        Returns
+        -------
+        dict
+            Dictionary of placeholders
+        """
+        devices = {}
+        for key in keys:
+            info = config[key]
+            if "_alias" in info:
+                parts = info["_alias"].split(".")
+                root = self.devices[parts[0]]
+                if len(parts) == 1:
+                    device = root
+                else:
+                    device = LazyDevice(
+                        key,
+                        "_".join([root.name] + parts[1:]),
+                        self._lazy_alias_loader(parts, ns),
+                        root=root,
+                    )
+                add_to_ns = True
+            else:
+                device = LazyDevice(
+                    key,
+                    info.get("name", key),
+                    self._lazy_device_loader(key, info, graph.requires[key], ns),
+                )
+                add_to_ns = info.get("_add_to_ns", True)
+            devices[key] = device
+            if ns is not None and add_to_ns:
+                ns[key] = device
+        if devices and not self._lazy_devices:
+            atexit.register(self.report_lazy_devices)
+        self._lazy_devices.update(devices)
+        return devices
+
+    def _lazy_device_loader(self, key, info, requires, ns=None):
+        def loader(placeholder):
+            for dep in requires:
+                resolve_lazy(self.devices.get(dep))
+            print(f"Loading lazy device {key}")
+            with GLOBAL_STARTUP_PROFILE.item("lazy_devices", key):
+                device = instantiateOphyd(key, info)
+                timeout = self.get_device_loading_settings()["connection_timeout"]
+                if timeout:
+                    failures = waitForConnections({key: device}, timeout)
+                    self.load_failures.update(failures)
+                    reportLoadFailures(failures)
+            self._replace_device(placeholder, device, ns)
+            return device
+
+        return loader
+
+    def _lazy_alias_loader(self, parts, ns=None):
+        def loader(placeholder):
+            device = resolve_lazy(placeholder._lazy_root)
+            for attr in parts[1:]:
+                device = getattr(device, attr)
+            self._replace_device(placeholder, device, ns)
+            return device
+
+        return loader
+
+    def _replace_device(self, old_device, new_device, ns=None):
+        """
+        Replace every reference to a device in devices, groups, roles and baseline.
+
+        Parameters
+        ----------
+        old_device : object
+            The device to replace, typically a LazyDevice placeholder
+        new_device : object
+            The device to put in its place
+        ns : dict, optional
+            Namespace that may also hold old_device
+        """
+        for key, device in list(self.devices.items()):
+            if device is old_device:
+                self.devices[key] = new_device
+                if ns is not None and ns.get(key) is old_device:
+                    ns[key] = new_device
+        for group in self.groups:
+            group_obj = getattr(self, group)
+            for key, device in list(group_obj.devices.items()):
+                if device is old_device:
+                    group_obj.replace(key, new_device)
+        for role in self.roles:
+            if getattr(self, role, None) is old_device:
+                setattr(self, role, new_device)
+        baseline = self.supplemental_data.baseline
+        for i, device in enumerate(baseline):
+            if device is old_device:
+                baseline[i] = new_device
+
+    def get_unmaterialized_devices(self):
+        """Return the keys of lazy devices that have not been used yet."""
+        return sorted(
+            key for key, device in self._lazy_devices.items() if not device.materialized
+        )
+
+    def report_lazy_devices(self):
+        """Print the lazy devices that were never instantiated in this session."""
+        unused = self.get_unmaterialized_devices()
+        if unused:
+            boxed_text(
+                f"{len(unused)} of {len(self._lazy_devices)} lazy devices never used",
+                unused,
+                "white",
+            )
 
     def load_deferred_device(self, device_name, ns=None):
         """
@@ -330,26 +783,195 @@ class BeamlineModel:
         RuntimeError
             If loading the device fails
         """
-        if device_name not in self._deferred_devices:
-            raise KeyError(f"Device {device_name} is not in deferred devices")
+        with self._deferred_lock:
+            if device_name not in self._deferred_devices:
+                if device_name in self.devices:
+                    # Already loaded, e.g. by preconnect_deferred_devices
+                    return self.devices[device_name]
+                raise KeyError(f"Device {device_name} is not in deferred devices")
+
+            # Instantiate exactly the precomputed closure of the device
+            graph = self._get_device_graph()
+            keys = [
+                key
+                for key in graph.activation_closure(device_name)
+                if key not in self.devices
+            ]
+            for key in keys:
+                graph.config[key]["_defer_loading"] = False
+
+            try:
+                self.load_devices(
+                    graph.config,
+                    ns,
+                    graph=graph,
+                    lazy=False,
+                    keys=keys,
+                    include_deferred=True,
+                )
+            except Exception as e:
+                raise RuntimeError(f"Failed to load device {device_name}: {e}") from e
+            if device_name not in self.devices and device_name in self.load_failures:
+                e = self.load_failures[device_name]
+                raise RuntimeError(f"Failed to load device {device_name}: {e}") from e
+            return self.devices.get(device_name)
 
-        # If it's an alias, get and load the root device
-        config = self._deferred_config.get(device_name, {})
-        if isinstance(config, dict) and "_alias" in config:
-            root_device = config["_alias"].split(".")[0]
-            if root_device != device_name:  # Prevent recursion
-                return self.load_deferred_device(root_device, ns)
+    def _get_device_graph(self):
+        if self.device_graph is None:
+            config = self.config.get("devices") or self._deferred_config
+            self.device_graph = DeviceGraph(config)
+        return self.device_graph
 
-        # Create config with just this device and its dependencies
-        self._deferred_config[device_name]["_defer_loading"] = False
+    def find_deferred_devices(self, obj):
+        """
+        Find the deferred devices named anywhere in a plan description.
 
-        try:
-            # Load the device using the main loading function
-            self.load_devices(self._deferred_config, ns)
+        Parameters
+        ----------
+        obj : object
+            A device name, or nested lists, tuples and dicts, such as the
+            args and kwargs of queue items. Dotted names refer to their root device.
 
-            return self.devices.get(device_name)
-        except Exception as e:
-            raise RuntimeError(f"Failed to load device {device_name}: {e}") from e
+        Returns
+        -------
+        list of str
+            Names of deferred devices, in order of first appearance
+        """
+        found = {}
+        stack = [obj]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                name = item.split(".")[0]
+                if name in self._deferred_devices:
+                    found[name] = None
+            elif isinstance(item, dict):
+                stack.extend(reversed(list(item.keys()) + list(item.values())))
+            elif isinstance(item, (list, tuple, set)):
+                stack.extend(reversed(list(item)))
+        return list(found)
+
+    def _preconnect(self, name, ns=None):
+        """
+        Instantiate and connect the devices of a deferred device's closure.
+
+        Only devices whose dependencies are already registered are created,
+        since factories may look up their dependencies on the beamline. The
+        devices are kept aside, and nothing on the beamline or in the
+        namespace changes until they are registered.
+        """
+        graph = self._get_device_graph()
+        keys = [
+            key
+            for key in graph.activation_closure(name)
+            if key not in self.devices
+            and "_alias" not in graph.config[key]
+            and graph.config[key].get("_target", "IGNORE") != "IGNORE"
+            and all(dep in self.devices for dep in graph.requires[key])
+        ]
+        with self._preconnect_lock:
+            keys = [key for key in keys if key not in self._preconnected]
+        loading = self.get_device_loading_settings()
+        max_workers = loading["max_workers"] if loading["parallel"] else 1
+        devices, failures = instantiateDevicesParallel(
+            graph.config, keys, instantiateOphyd, max_workers=max_workers
+        )
+        if loading["connection_timeout"]:
+            failures.update(
+                waitForConnections(devices, loading["connection_timeout"])
+            )
+        reportLoadFailures(failures, title=f"Failures preconnecting {name}")
+        with self._preconnect_lock:
+            self._preconnected.update(devices)
+            self._preconnect_ns[name] = ns
+
+    def register_preconnected_devices(self):
+        """
+        Register the deferred devices that were preconnected in the background.
+
+        Called by the RunEngine at the start of each plan, see
+        :func:`nbs_bl.run_engine.setup_run_engine`, so that devices never
+        appear on the beamline while a run is open.
+
+        Returns
+        -------
+        list of str
+            Names of the registered deferred devices
+        """
+        with self._preconnect_lock:
+            pending = self._preconnect_ns
+            self._preconnect_ns = {}
+        registered = []
+        for name, ns in pending.items():
+            try:
+                self.load_deferred_device(name, ns)
+                registered.append(name)
+            except KeyError:
+                # Loaded in the meantime
+                pass
+            except Exception as e:
+                print(f"Could not register preconnected device {name}: {e}")
+        # Devices that were loaded by a plan while they were being preconnected
+        with self._preconnect_lock:
+            duplicates = [key for key in self._preconnected if key in self.devices]
+            duplicates = [self._preconnected.pop(key) for key in duplicates]
+        for device in duplicates:
+            if hasattr(device, "destroy"):
+                device.destroy()
+        return registered
+
+    def preconnect_deferred_devices(self, plans, ns=None, background=True):
+        """
+        Connect the deferred devices that queued plans refer to, before they run.
+
+        Intended to be called with the items of the plan queue, e.g. through
+        a queueserver function, so that deferred devices are connected while
+        earlier plans run, rather than when a plan first needs them.
+
+        Devices are only instantiated and connected in the background. They
+        are registered on the beamline, in their groups and in the namespace
+        by :meth:`register_preconnected_devices`, at the start of the next
+        plan, or when a plan loads them with :meth:`load_deferred_device`.
+
+        Parameters
+        ----------
+        plans : object
+            Queue items, or any nested structure of device names
+        ns : dict, optional
+            Namespace for loading devices. Defaults to the IPython user namespace.
+        background : bool, optional
+            If True, connect the devices in a daemon thread. If False, connect
+            and register them before returning
+
+        Returns
+        -------
+        threading.Thread or None
+            The connecting thread, if devices are connected in the background
+        """
+        names = self.find_deferred_devices(plans)
+        if not names:
+            return None
+        if ns is None:
+            ip = IPython.get_ipython()
+            ns = ip.user_global_ns if ip is not None else None
+
+        def preconnect():
+            for name in names:
+                try:
+                    self._preconnect(name, ns)
+                except Exception as e:
+                    print(f"Could not preconnect {name}: {e}")
+
+        print(f"Preconnecting deferred devices: {names}")
+        if not background:
+            preconnect()
+            self.register_preconnected_devices()
+            return None
+        thread = threading.Thread(
+            target=preconnect, name="preconnect_deferred_devices", daemon=True
+        )
+        thread.start()
+        return thread
 
     def load_redis(self):
         redis_settings = (
@@ -386,15 +1008,27 @@ class BeamlineModel:
         """
         If get_subdevice, follow dotted device names and return the deepest device.
         If False, follow the parents and return the overall parent device
+
+        Resolved names are cached for as long as the top-level device is unchanged.
         """
+        cache_key = (device_name, get_subdevice)
+        cached = self._device_cache.get(cache_key)
         device_parts = device_name.split(".")
-        device = self.devices[device_parts[0]]
+        root = self.devices[device_parts[0]]
+        if cached is not None and cached[0] is root:
+            return cached[1]
+        device = root
         if get_subdevice:
             for subdev in device_parts[1:]:
                 device = getattr(device, subdev)
+        elif isinstance(device, LazyDevice) and not device._lazy_root.materialized:
+            # Avoid instantiating a lazy device just to find its parent
+            device = device._lazy_root
         else:
             while device.parent is not None:
                 device = device.parent
+        # Materializing a lazy root replaces it in self.devices
+        self._device_cache[cache_key] = (self.devices[device_parts[0]], device)
         return device
 
     def add_to_baseline(self, device_or_name, only_subdevice=False):
@@ -436,7 +1070,7 @@ class BeamlineModel:
         """Check if a device is currently deferred."""
         return device_name in self._deferred_devices
 
-    def defer_device(self, device_name):
+    def defer_device(self, device_name, ns=None):
         """
         Move a loaded device to deferred state.
 
@@ -444,6 +1078,8 @@ class BeamlineModel:
         ----------
         device_name : str
             Name of the device to defer
+        ns : dict, optional
+            Namespace to remove the device from. Defaults to the IPython user namespace.
 
         Raises
         ------
@@ -452,7 +1088,9 @@ class BeamlineModel:
         RuntimeError
             If the device cannot be deferred
         """
-        ip = IPython.get_ipython()
+        if ns is None:
+            ip = IPython.get_ipython()
+            ns = ip.user_global_ns if ip is not None else None
 
         if device_name in self._deferred_devices:
             print(
@@ -467,41 +1105,167 @@ class BeamlineModel:
         # Update configuration to defer loading
         device_config["_defer_loading"] = True
 
-        deferred_devices, _, deferred_config = _find_deferred_devices(
-            self.config["devices"]
+        graph = self._get_device_graph()
+        deferred_devices = graph.dependents_closure([device_name])
+        self._deferred_config.update(
+            {key: graph.config[key] for key in deferred_devices}
         )
-
-        self._deferred_config.update(deferred_config)
         self._deferred_devices.update(deferred_devices)
 
-        # Remove from groups
         for newly_deferred in deferred_devices:
-            if newly_deferred not in self.devices:
-                continue
-            for group in self.groups:
-                group_obj = getattr(self, group)
-                if newly_deferred in group_obj.devices:
-                    group_obj.remove(newly_deferred)
-
-            # Remove from roles
-            for role in self.roles:
-                if hasattr(self, role) and getattr(self, role) == self.devices.get(
-                    newly_deferred, None
-                ):
-                    setattr(self, role, None)
-
-            # Remove from baseline if present
-            device = self.devices.get(newly_deferred, None)
-            if device != None and device in self.supplemental_data.baseline:
-                self.supplemental_data.baseline.remove(device)
-
-            # Remove from devices registry
-            if device != None:
-                self.devices.pop(newly_deferred)
-                del device
-            ip.user_global_ns.pop(newly_deferred, None)
+            if newly_deferred in self.devices:
+                self._unregister_device(newly_deferred, ns)
         return device_name
 
+    def _unregister_device(self, device_name, ns=None):
+        """
+        Remove a loaded device from groups, roles, baseline, devices and ns.
+
+        Parameters
+        ----------
+        device_name : str
+            Key of the device to remove
+        ns : dict, optional
+            Namespace to remove the device from
+
+        Returns
+        -------
+        object
+            The removed device, or None if it was not loaded
+        """
+        # Remove from groups
+        for group in self.groups:
+            group_obj = getattr(self, group)
+            if device_name in group_obj.devices:
+                group_obj.remove(device_name)
+
+        # Remove from roles
+        for role in self.roles:
+            if hasattr(self, role) and getattr(self, role) == self.devices.get(
+                device_name, None
+            ):
+                setattr(self, role, None)
+
+        # Remove from baseline if present
+        device = self.devices.get(device_name, None)
+        if device != None and device in self.supplemental_data.baseline:
+            self.supplemental_data.baseline.remove(device)
+
+        # Remove from devices registry
+        if device != None:
+            release_monitored(device)
+            self.devices.pop(device_name)
+        self._lazy_devices.pop(device_name, None)
+        for key in [k for k in self._device_cache if k[0].split(".")[0] == device_name]:
+            del self._device_cache[key]
+        if ns is not None:
+            ns.pop(device_name, None)
+        return device
+
+    def reload_configuration(self, startup_dir=None, ns=None):
+        """
+        Reload devices.toml, and reload only the devices that changed.
+
+        The new configuration is compared to ``self.config["devices"]``.
+        Removed and changed devices, and every device that depends on them,
+        are unregistered and destroyed. Added and changed devices, and their
+        dependents, are then loaded with load_devices. All other devices stay
+        connected. ``_defer_loading`` is ignored in the comparison, since it
+        also tracks runtime calls to defer_device and load_deferred_device.
+
+        Parameters
+        ----------
+        startup_dir : str, optional
+            Directory containing configuration files. Defaults to the
+            startup directory that the beamline was loaded from.
+        ns : dict, optional
+            Namespace for loading devices. Defaults to the IPython user namespace.
+
+        Returns
+        -------
+        dict
+            Keys of the "added", "removed", "changed" and "reloaded" devices
+        """
+        if startup_dir is None:
+            startup_dir = self.settings["startup_dir"]
+        if ns is None:
+            ip = IPython.get_ipython()
+            ns = ip.user_global_ns if ip is not None else None
+        _, object_file = self.get_configuration_files(startup_dir)
+        with open(object_file, "rb") as f:
+            new_config = tomllib.load(f)
+
+        old_config = self.config.get("devices", {})
+        old_graph = self.device_graph or DeviceGraph(old_config)
+        # Preconnected devices may have been created from the old configuration
+        with self._preconnect_lock:
+            stale = list(self._preconnected.values())
+            self._preconnected.clear()
+            self._preconnect_ns.clear()
+        for device in stale:
+            if hasattr(device, "destroy"):
+                device.destroy()
+
+        def strip(info):
+            if not isinstance(info, dict):
+                return info
+            return {k: v for k, v in info.items() if k != "_defer_loading"}
+
+        added = [key for key in new_config if key not in old_config]
+        removed = [key for key in old_config if key not in new_config]
+        changed = [
+            key
+            for key in new_config
+            if key in old_config and strip(new_config[key]) != strip(old_config[key])
+        ]
+
+        # Keep the existing entries of unchanged devices, with their runtime state
+        config = {
+            key: new_config[key] if key in added or key in changed else old_config[key]
+            for key in new_config
+        }
+        graph = DeviceGraph(config)
+
+        # Devices built from a removed or changed device hold a reference to it
+        stale = old_graph.dependents_closure(removed + changed) & old_config.keys()
+        reload = graph.dependents_closure(
+            [key for key in added + changed + list(stale) if key in config]
+        )
+        teardown = (stale | reload) & old_config.keys()
+
+        for key in teardown:
+            device = self._unregister_device(key, ns)
+            self._deferred_config.pop(key, None)
+            self._deferred_devices.discard(key)
+            self.load_failures.pop(key, None)
+            # Aliases are owned by their root device
+            if device is None or "_alias" in old_config[key]:
+                continue
+            if isinstance(device, LazyDevice) and not device.materialized:
+                continue
+            destroy = getattr(resolve_lazy(device), "destroy", None)
+            if destroy is not None:
+                try:
+                    destroy()
+                except Exception as e:
+                    print(f"Error destroying {key}: {e}")
+
+        self.config["devices"] = config
+        self.device_graph = graph
+        self.load_devices(config, ns, graph=graph, keys=reload)
+
+        summary = {
+            "added": sorted(added),
+            "removed": sorted(removed),
+            "changed": sorted(changed),
+            "reloaded": sorted(reload),
+        }
+        print(
+            f"Reloaded {len(reload)} devices "
+            f"({len(added)} added, {len(removed)} removed, {len(changed)} changed)"
+        )
+        return summary
+
     def __getitem__(self, key):
         """Allow dictionary-like access to devices."""
         return self.devices[key]
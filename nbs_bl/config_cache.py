@@ -0,0 +1,137 @@
+"""
+Cache of compiled beamline configurations.
+
+A compiled configuration holds the parsed beamline and device configuration,
+and the DeviceGraph analysis of the devices. It is stored as JSON, so that
+loading a cache entry never runs code, in a file whose name is derived from
+the content of the settings file and the versions of the packages that
+produce the analysis. The content hashes of all other configuration files
+are stored alongside, so that a change to any of them invalidates the entry.
+"""
+
+import hashlib
+import json
+import os
+import sys
+from importlib.metadata import version, PackageNotFoundError
+from os.path import join, exists, expanduser
+from .device_graph import DeviceGraph
+
+# Bump when the layout of a compiled configuration changes
+CACHE_FORMAT = 4
+
+_versioned_packages = ["nbs-bl", "nbs-core"]
+
+
+def get_cache_dir():
+    """Return the directory for compiled configurations, from NBS_BL_CACHE_DIR."""
+    return os.environ.get("NBS_BL_CACHE_DIR", expanduser("~/.cache/nbs_bl"))
+
+
+def _hash_file(filename):
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _package_versions():
+    versions = {"python": sys.version, "format": CACHE_FORMAT}
+    for package in _versioned_packages:
+        try:
+            versions[package] = version(package)
+        except PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+
+def _cache_filename(settings_file):
+    key = hashlib.sha256()
+    key.update(os.path.abspath(settings_file).encode())
+    key.update(_hash_file(settings_file).encode())
+    key.update(repr(sorted(_package_versions().items())).encode())
+    return join(get_cache_dir(), f"config-{key.hexdigest()[:32]}.json")
+
+
+def has_compiled_config(settings_file):
+    """
+    Check whether there is a cache entry for the current settings file.
+
+    Entries are only written while config_cache is enabled, and are named by
+    the content of the settings file, so an entry exists only if the current
+    settings file enables the cache. This lets startup use the cached
+    settings instead of parsing the settings file.
+
+    Parameters
+    ----------
+    settings_file : str
+        Path to beamline.toml
+
+    Returns
+    -------
+    bool
+    """
+    return exists(settings_file) and exists(_cache_filename(settings_file))
+
+
+def load_compiled_config(settings_file):
+    """
+    Load the compiled configuration for a settings file, if it is up to date.
+
+    Parameters
+    ----------
+    settings_file : str
+        Path to beamline.toml
+
+    Returns
+    -------
+    dict or None
+        The compiled configuration, or None if there is no valid cache entry
+    """
+    if not exists(settings_file):
+        return None
+    cache_file = _cache_filename(settings_file)
+    if not exists(cache_file):
+        return None
+    try:
+        with open(cache_file, "r") as f:
+            compiled = json.load(f)
+        for filename, file_hash in compiled["file_hashes"].items():
+            if not exists(filename) or _hash_file(filename) != file_hash:
+                return None
+        if "device_graph" in compiled:
+            compiled["device_graph"] = DeviceGraph.from_dict(
+                compiled["device_graph"], compiled.get("device_config")
+            )
+    except Exception as e:
+        print(f"Ignoring unreadable configuration cache {cache_file}: {e}")
+        return None
+    return compiled
+
+
+def save_compiled_config(settings_file, files, **compiled):
+    """
+    Store a compiled configuration for a settings file.
+
+    Parameters
+    ----------
+    settings_file : str
+        Path to beamline.toml
+    files : list of str
+        All configuration files that the compiled configuration was built from
+    **compiled
+        Contents of the compiled configuration, e.g. the parsed configurations
+        and the DeviceGraph. Configurations that cannot be stored as JSON,
+        e.g. with TOML dates, are not cached
+    """
+    compiled["file_hashes"] = {filename: _hash_file(filename) for filename in files}
+    if "device_graph" in compiled:
+        compiled["device_graph"] = compiled["device_graph"].to_dict()
+    cache_file = _cache_filename(settings_file)
+    try:
+        content = json.dumps(compiled)
+        os.makedirs(get_cache_dir(), exist_ok=True)
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as f:
+            f.write(content)
+        os.replace(tmp_file, cache_file)
+    except Exception as e:
+        print(f"Could not write configuration cache {cache_file}: {e}")
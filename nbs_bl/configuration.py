@@ -2,7 +2,8 @@ from os.path import join
 from importlib.util import find_spec
 from .beamline import GLOBAL_BEAMLINE
 from .queueserver import request_update, get_status
-import pkg_resources
+from .profiling import GLOBAL_STARTUP_PROFILE
+from .entrypoints import GLOBAL_ENTRY_POINTS
 
 
 def get_startup_dir():
@@ -31,7 +32,7 @@ def load_plans(startup_dir):
     plan_settings = GLOBAL_BEAMLINE.settings.get("plans", {})
     print(f"Loading plans from {startup_dir}")
     # Iterate through all registered plan loaders
-    for entry_point in pkg_resources.iter_entry_points(group="nbs_bl.plan_loaders"):
+    for entry_point in GLOBAL_ENTRY_POINTS.select("nbs_bl.plan_loaders"):
         plan_type = entry_point.name
         print(f"Loading {plan_type} plans")
         plan_files = plan_settings.get(plan_type, [])
@@ -41,13 +42,14 @@ def load_plans(startup_dir):
             continue
         print(f"Loading {plan_type} plans from {plan_files}")
         # Load the plan loader function
-        plan_loader = entry_point.load()
+        plan_loader = GLOBAL_ENTRY_POINTS.load(entry_point)
 
         # Load each plan file for this plan type
         for plan_file in plan_files:
             full_path = join(startup_dir, plan_file)
             try:
-                plan_loader(full_path)
+                with GLOBAL_STARTUP_PROFILE.item("plan_files", plan_file):
+                    plan_loader(full_path)
                 print(f"Loaded {plan_type} plans from {plan_file}")
             except Exception as e:
                 print(f"Error loading {plan_type} plans from {plan_file}: {str(e)}")
@@ -63,6 +65,7 @@ def load_and_configure_everything(startup_dir=None):
         The directory from which to load configuration files.
         If not specified, uses the IPython startup directory.
     """
+    GLOBAL_STARTUP_PROFILE.reset()
     if startup_dir is None:
         startup_dir = get_startup_dir()
 
@@ -70,9 +73,39 @@ def load_and_configure_everything(startup_dir=None):
     ip.user_ns["get_status"] = get_status
     ip.user_ns["request_update"] = request_update
 
-    GLOBAL_BEAMLINE.load_beamline(startup_dir, ip.user_ns)
-    load_plans(startup_dir)  # Load plans after beamline configuration
-    configure_modules()
+    with GLOBAL_STARTUP_PROFILE.phase("load_beamline"):
+        GLOBAL_BEAMLINE.load_beamline(startup_dir, ip.user_ns)
+    with GLOBAL_STARTUP_PROFILE.phase("load_plans"):
+        load_plans(startup_dir)  # Load plans after beamline configuration
+    with GLOBAL_STARTUP_PROFILE.phase("configure_modules"):
+        configure_modules()
+    report_startup_profile(startup_dir)
+
+
+def report_startup_profile(startup_dir):
+    """
+    Write and print the startup profile, if enabled in the beamline settings.
+
+    Enabled by ``startup = true`` in the ``[settings.profiling]`` table. The
+    JSON report is written to ``report_file``, relative to the startup directory.
+
+    Parameters
+    ----------
+    startup_dir : str
+        Directory containing configuration files
+    """
+    profile_settings = GLOBAL_BEAMLINE.settings.get("profiling", {})
+    if not profile_settings.get("startup", False):
+        return
+    report_file = join(
+        startup_dir, profile_settings.get("report_file", "startup_profile.json")
+    )
+    try:
+        GLOBAL_STARTUP_PROFILE.write_report(report_file)
+        print(f"Wrote startup profile to {report_file}")
+    except OSError as e:
+        print(f"Could not write startup profile to {report_file}: {e}")
+    GLOBAL_STARTUP_PROFILE.print_summary(profile_settings.get("summary_length", 10))
 
 
 def configure_modules():
@@ -85,4 +118,5 @@ def configure_modules():
     for module_name in modules:
         module_path = find_spec(module_name).origin
         print(f"Trying to import {module_name} from {module_path}")
-        ip.run_line_magic("run", module_path)
+        with GLOBAL_STARTUP_PROFILE.item("startup_modules", module_name):
+            ip.run_line_magic("run", module_path)
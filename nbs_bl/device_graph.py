@@ -0,0 +1,280 @@
+from .utils import iterfy
+
+
+class DeviceGraph:
+    """
+    Dependency graph of the devices in a device configuration.
+
+    The configuration is analyzed once, when the graph is created. A device
+    depends on another device through:
+
+    - ``_alias``: an alias requires its root device
+    - ``_depends_on``: explicit dependencies, for devices whose factory looks
+      up other devices at creation time, e.g. ``EnPosFactory(beamline=...)``
+    - ``_load_order``: a device without ``_depends_on`` is loaded after every
+      non-deferred device with a lower load order
+
+    Deferred devices are those with ``_defer_loading``, plus every device
+    that requires one through an alias or ``_depends_on``.
+
+    Parameters
+    ----------
+    config : dict
+        Device configuration dictionary
+
+    Raises
+    ------
+    ValueError
+        If the configuration contains circular dependencies
+    """
+
+    def __init__(self, config):
+        self.config = {k: v for k, v in config.items() if isinstance(v, dict)}
+        # Hard dependencies, which must be loaded for a device to be created
+        self.requires = {}
+        # Dependencies that only constrain ordering, from _load_order
+        self.after = {key: set() for key in self.config}
+        # Hard dependencies that are not in the configuration at all
+        self.missing = {}
+        # Module of the class or factory that creates each device
+        self.modules = {}
+
+        for key, info in self.config.items():
+            target = info.get("_target", None)
+            if isinstance(target, str) and "." in target:
+                self.modules[key] = target.rsplit(".", 1)[0]
+            requires = set(iterfy(info.get("_depends_on", [])))
+            if "_alias" in info:
+                requires.add(info["_alias"].split(".")[0])
+            requires.discard(key)
+            missing = requires - self.config.keys()
+            if missing:
+                self.missing[key] = missing
+            self.requires[key] = requires - missing
+
+        # Reverse of requires, for dependents_closure
+        self.dependents = {key: set() for key in self.config}
+        for key, requires in self.requires.items():
+            for dep in requires:
+                self.dependents[dep].add(key)
+
+        explicitly_deferred = {
+            key for key, info in self.config.items() if info.get("_defer_loading", False)
+        }
+        self.deferred = self.dependents_closure(explicitly_deferred)
+
+        for key, info in self.config.items():
+            order = info.get("_load_order", 1)
+            if order > 1 and "_depends_on" not in info and "_alias" not in info:
+                self.after[key] = {
+                    other
+                    for other, other_info in self.config.items()
+                    if other_info.get("_load_order", 1) < order
+                    and other not in self.deferred
+                }
+
+        # Validate the whole graph once, so that cycles are reported at startup
+        self.waves(self.config.keys())
+
+        # Devices to instantiate when a deferred device is activated
+        self._activation = {}
+        for key in self.deferred:
+            self.activation_closure(key)
+
+    def to_dict(self):
+        """
+        Get the analysis of the graph as plain data, e.g. to store as JSON.
+
+        Returns
+        -------
+        dict
+            Configuration and dependencies, with sets stored as sorted lists,
+            see :meth:`from_dict`
+        """
+        return {
+            "config": self.config,
+            "requires": {k: sorted(v) for k, v in self.requires.items()},
+            "after": {k: sorted(v) for k, v in self.after.items()},
+            "missing": {k: sorted(v) for k, v in self.missing.items()},
+            "modules": self.modules,
+            "deferred": sorted(self.deferred),
+            "activation": {k: sorted(v) for k, v in self._activation.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data, config=None):
+        """
+        Restore a graph from :meth:`to_dict`, without analyzing it again.
+
+        Parameters
+        ----------
+        data : dict
+            Output of :meth:`to_dict`
+        config : dict, optional
+            Device configuration that the graph was built from. If given, the
+            graph shares its device entries, as if built with ``DeviceGraph(config)``
+
+        Returns
+        -------
+        DeviceGraph
+        """
+        graph = cls.__new__(cls)
+        if config is None:
+            config = data["config"]
+        graph.config = {k: v for k, v in config.items() if isinstance(v, dict)}
+        graph.requires = {k: set(v) for k, v in data["requires"].items()}
+        graph.after = {k: set(v) for k, v in data["after"].items()}
+        graph.missing = {k: set(v) for k, v in data["missing"].items()}
+        graph.modules = dict(data["modules"])
+        graph.dependents = {key: set() for key in graph.config}
+        for key, requires in graph.requires.items():
+            for dep in requires:
+                graph.dependents[dep].add(key)
+        graph.deferred = set(data["deferred"])
+        graph._activation = {k: frozenset(v) for k, v in data["activation"].items()}
+        return graph
+
+    @property
+    def deferred_config(self):
+        """Configuration of only the deferred devices"""
+        return {k: v for k, v in self.config.items() if k in self.deferred}
+
+    def dependencies(self, key):
+        """Return the set of devices that key must be loaded after"""
+        return self.requires[key] | self.after[key]
+
+    def target_modules(self, keys):
+        """
+        Find the modules that must be imported to create keys.
+
+        Parameters
+        ----------
+        keys : iterable of str
+            Device keys
+
+        Returns
+        -------
+        list of str
+            Unique module names, in the order of keys
+        """
+        modules = [self.modules[key] for key in keys if key in self.modules]
+        return list(dict.fromkeys(modules))
+
+    def dependents_closure(self, keys):
+        """
+        Find every device that requires any of keys, directly or indirectly.
+
+        Parameters
+        ----------
+        keys : iterable of str
+            Device keys
+
+        Returns
+        -------
+        set
+            keys, plus every device that cannot be created without them
+        """
+        return self._closure(keys, self.dependents)
+
+    def dependency_closure(self, keys):
+        """
+        Find every device that any of keys requires, directly or indirectly.
+
+        Parameters
+        ----------
+        keys : iterable of str
+            Device keys
+
+        Returns
+        -------
+        set
+            keys, plus every device needed to create them
+        """
+        return self._closure(keys, self.requires)
+
+    def activation_closure(self, key):
+        """
+        Find the devices to instantiate to activate a device on demand.
+
+        This is the dependency closure of key, plus the aliases of any device
+        in it whose own dependencies are all in the closure, so that loading
+        a root device also makes its aliases available. Results are cached,
+        and precomputed for all deferred devices.
+
+        Parameters
+        ----------
+        key : str
+            Device key
+
+        Returns
+        -------
+        frozenset
+            Device keys, including key
+        """
+        if key not in self._activation:
+            closure = self.dependency_closure([key])
+            aliases = [k for k, info in self.config.items() if "_alias" in info]
+            added = True
+            while added:
+                added = False
+                for alias in aliases:
+                    requires = self.requires[alias]
+                    if alias not in closure and requires and requires <= closure:
+                        closure.add(alias)
+                        added = True
+            self._activation[key] = frozenset(closure)
+        return self._activation[key]
+
+    @staticmethod
+    def _closure(keys, edges):
+        closure = set()
+        stack = [key for key in keys]
+        while stack:
+            key = stack.pop()
+            if key in closure:
+                continue
+            closure.add(key)
+            stack.extend(edges.get(key, ()))
+        return closure
+
+    def waves(self, keys=None):
+        """
+        Schedule devices into waves that can each be loaded concurrently.
+
+        Every device in a wave depends only on devices in earlier waves, or on
+        devices outside of keys, which are assumed to be loaded already.
+
+        Parameters
+        ----------
+        keys : iterable of str, optional
+            The devices to schedule. Defaults to all non-deferred devices.
+
+        Returns
+        -------
+        list of list of str
+            Device keys in topological waves, in configuration order within each wave
+
+        Raises
+        ------
+        ValueError
+            If keys contain circular dependencies
+        """
+        if keys is None:
+            keys = [key for key in self.config if key not in self.deferred]
+        keys = set(keys)
+        remaining = {
+            key: self.dependencies(key) & keys for key in self.config if key in keys
+        }
+        waves = []
+        while remaining:
+            wave = [key for key, deps in remaining.items() if not deps]
+            if not wave:
+                raise ValueError(
+                    f"Circular device dependencies among {sorted(remaining)}"
+                )
+            for key in wave:
+                remaining.pop(key)
+            for deps in remaining.values():
+                deps.difference_update(wave)
+            waves.append(wave)
+        return waves
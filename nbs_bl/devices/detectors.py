@@ -1,10 +1,250 @@
 from ophyd import Device, Component as Cpt, EpicsSignal, Signal
 from ophyd.status import DeviceStatus
+from event_model import compose_resource
+from collections import deque
+import os
+import struct
+import tempfile
 import threading
-from queue import Queue, Empty
 import time
+import uuid
+import warnings
+from queue import Queue
 import numpy as np
 
+# Size of the NPY header of raw sample files, so that it can be rewritten in
+# place with the final shape
+_NPY_HEADER_SIZE = 128
+
+
+class SampleBuffer:
+    """
+    Preallocated, thread-safe buffer of monitored samples.
+
+    Each sample is a row of floats, by default its value, the time it was
+    received, and its timestamp. A ring buffer keeps the latest ``capacity``
+    samples, and overwrites the oldest ones when it is full. A growing buffer
+    doubles its capacity instead, so that no sample is lost.
+
+    Samples are numbered from the last :meth:`clear`, so that a reader can
+    take the samples that arrived after a :meth:`mark` with :meth:`since`.
+
+    Parameters
+    ----------
+    capacity : int, optional
+        Number of samples that fit in the buffer
+    columns : int, optional
+        Number of floats in each sample
+    grow : bool, optional
+        If True, grow the buffer when it is full, instead of overwriting
+    """
+
+    def __init__(self, capacity=1024, columns=3, grow=False):
+        self._lock = threading.Lock()
+        self._data = np.empty((capacity, columns))
+        self._grow = grow
+        self._count = 0
+        # Number of the oldest sample that was not dropped by a resize
+        self._first = 0
+
+    @property
+    def capacity(self):
+        return len(self._data)
+
+    @property
+    def columns(self):
+        return self._data.shape[1]
+
+    def __len__(self):
+        return self._count - max(self._first, self._count - len(self._data))
+
+    def _rows(self, first):
+        """Copy the samples from number first on, oldest first."""
+        capacity = len(self._data)
+        first = max(first, self._first, self._count - capacity)
+        n = max(0, self._count - first)
+        start = first % capacity
+        if start + n <= capacity:
+            return self._data[start : start + n].copy()
+        return np.concatenate((self._data[start:], self._data[: start + n - capacity]))
+
+    def _resize(self, capacity):
+        first = max(0, self._count - capacity)
+        rows = self._rows(first)
+        self._first = self._count - len(rows)
+        self._data = np.empty((capacity, self._data.shape[1]))
+        self._data[np.arange(self._first, self._count) % capacity] = rows
+
+    def reserve(self, capacity):
+        """Grow the buffer to hold at least capacity samples, keeping its samples."""
+        with self._lock:
+            if capacity > len(self._data):
+                self._resize(capacity)
+
+    def append(self, *row):
+        """Add a sample, e.g. from a monitor callback."""
+        with self._lock:
+            capacity = len(self._data)
+            if self._grow and self._count >= capacity:
+                self._resize(2 * capacity)
+                capacity = len(self._data)
+            self._data[self._count % capacity] = row
+            self._count += 1
+
+    def clear(self):
+        """Drop all samples, and number new samples from 0."""
+        with self._lock:
+            self._count = 0
+            self._first = 0
+
+    def mark(self):
+        """
+        Get the number of the next sample.
+
+        Returns
+        -------
+        int
+            Pass to :meth:`since` to get the samples that arrive from now on
+        """
+        with self._lock:
+            return self._count
+
+    def since(self, mark=None):
+        """
+        Get a copy of the samples since a mark.
+
+        Parameters
+        ----------
+        mark : int, optional
+            Number of the first sample, from :meth:`mark`. By default, all
+            samples in the buffer
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (samples, columns), oldest first. A ring buffer
+            only returns the samples it still holds, and warns if samples
+            since the mark were overwritten
+        """
+        with self._lock:
+            if mark is None:
+                return self._rows(0)
+            oldest = max(self._first, self._count - len(self._data))
+            if mark < oldest:
+                warnings.warn(
+                    f"{oldest - mark} samples since the mark were overwritten, "
+                    f"the buffer only holds {len(self._data)} samples",
+                    RuntimeWarning,
+                )
+            return self._rows(mark)
+
+
+def _npy_header(shape):
+    header = repr({"descr": "<f8", "fortran_order": False, "shape": shape})
+    header = header.ljust(_NPY_HEADER_SIZE - 11) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode()
+
+
+class RawSampleStore:
+    """
+    Raw samples of one staging, spilled to an NPY file as they are acquired.
+
+    Each write appends the samples of one point to the file, and creates a
+    Datum that refers to its rows. The Resource and Datum documents are
+    collected with :meth:`collect_asset_docs`, so that the raw samples are
+    published as an external field of the detector. The file is a valid NPY
+    file of shape (rows, columns) once the store is closed, and can be read
+    with :class:`RawSampleHandler`.
+
+    Parameters
+    ----------
+    root : str
+        Directory of the file
+    name : str
+        Prefix of the file name, e.g. the name of the detector
+    columns : int, optional
+        Number of floats in each sample
+    """
+
+    spec = "NBS_RAW_NPY"
+
+    def __init__(self, root, name, columns=2):
+        os.makedirs(root, exist_ok=True)
+        self.columns = columns
+        self.resource_path = f"{name}_{uuid.uuid4()}.npy"
+        self.path = os.path.join(root, self.resource_path)
+        self._lock = threading.Lock()
+        self._rows = 0
+        self._file = open(self.path, "wb")
+        self._file.write(_npy_header((0, columns)))
+        resource, self._datum_factory, _ = compose_resource(
+            start={"uid": "replaced by the RunEngine"},
+            spec=self.spec,
+            root=root,
+            resource_path=self.resource_path,
+            resource_kwargs={},
+        )
+        resource.pop("run_start")
+        self._asset_docs = [("resource", resource)]
+
+    def write(self, samples):
+        """
+        Append the samples of one point.
+
+        Parameters
+        ----------
+        samples : np.ndarray
+            Array of shape (samples, columns)
+
+        Returns
+        -------
+        str
+            The datum id of the samples
+        """
+        samples = np.ascontiguousarray(samples, dtype="<f8")
+        with self._lock:
+            start = self._rows
+            self._file.write(samples.tobytes())
+            self._rows += len(samples)
+            datum = self._datum_factory(
+                datum_kwargs={"start": start, "stop": self._rows}
+            )
+            self._asset_docs.append(("datum", datum))
+        return datum["datum_id"]
+
+    def collect_asset_docs(self):
+        with self._lock:
+            docs, self._asset_docs = self._asset_docs, []
+        yield from docs
+
+    def close(self):
+        """Write the final shape to the header, and close the file."""
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.seek(0)
+            self._file.write(_npy_header((self._rows, self.columns)))
+            self._file.close()
+
+
+class RawSampleHandler:
+    """
+    Read the raw samples of one point, from a :class:`RawSampleStore` file.
+
+    The NPY header of the file only gets its row count when the store is
+    closed, when the detector is unstaged. Until then, the header claims that
+    the file has no rows, so files of a detector that is still staged, or
+    whose process died while staged, read as empty.
+    """
+
+    specs = {RawSampleStore.spec}
+
+    def __init__(self, resource_path, **resource_kwargs):
+        self._samples = np.load(resource_path, mmap_mode="r")
+
+    def __call__(self, start, stop):
+        return np.array(self._samples[start:stop])
+
 
 class ScalarBase(Device):
     exposure_time = Cpt(Signal, value=1, name="exposure_time", kind="config")
@@ -17,12 +257,77 @@ class ScalarBase(Device):
     offset = Cpt(Signal, value=0, name="offset", kind="config")
     gain = Cpt(Signal, value=1, name="gain", kind="config")
 
-    def __init__(self, *args, rescale=1, **kwargs):
+    def __init__(
+        self,
+        *args,
+        rescale=1,
+        expected_rate=1000,
+        acquire_mode="sleep",
+        window_timeout=1.0,
+        raw_directory=None,
+        raw_memory_points=100,
+        flyer_chunk=4096,
+        **kwargs,
+    ):
+        """
+        Parameters
+        ----------
+        rescale : float, optional
+            Factor applied to every monitored value
+        expected_rate : float, optional
+            Highest expected monitor rate in Hz. The sample buffer is sized to
+            hold twice the samples of an exposure at this rate. If more
+            samples arrive, the oldest samples of the exposure are lost, and
+            a RuntimeWarning is issued
+        acquire_mode : str, optional
+            "sleep" acquires the samples that arrive while a new thread sleeps
+            for the exposure time. "timestamp" acquires the samples whose
+            timestamps are within an exposure window, in a worker thread that
+            finishes the trigger as soon as a sample past the end of the
+            window arrives. The window starts at the timestamp of the first
+            sample after the trigger, so that it is compared with timestamps
+            of the same clock. The worker stops when the detector is unstaged
+            or destroyed
+        window_timeout : float, optional
+            In "timestamp" mode, seconds to wait for the first sample, and
+            after the end of the window for a later sample, before the
+            trigger finishes without them
+        raw_directory : str, optional
+            If given, the raw samples of each point are written to a file in
+            this directory, one file per staging, and published in the
+            "<name>_raw" field, see :class:`RawSampleStore`
+        raw_memory_points : int, optional
+            Number of points whose raw samples are also kept in memory
+        flyer_chunk : int, optional
+            Number of samples of a fly scan that are kept in memory. Whenever
+            this many samples arrive, they are spilled to a temporary file in
+            raw_directory, or in the system temporary directory, until they
+            are collected
+        """
+        if acquire_mode not in ("sleep", "timestamp"):
+            raise ValueError(f"Unknown acquire_mode {acquire_mode!r}")
         self._flying = False
         self._measuring = False
         self._reading = False
-        self._flyer_buffer = []
-        self._flyer_time_buffer = []
+        self.expected_rate = expected_rate
+        self.acquire_mode = acquire_mode
+        self.window_timeout = window_timeout
+        self.raw_directory = raw_directory
+        self.raw_memory_points = raw_memory_points
+        self._raw_store = None
+        self._raw_datum = None
+        self._secret_buffer = deque(maxlen=raw_memory_points)
+        self._secret_time_buffer = deque(maxlen=raw_memory_points)
+        self._latest_timestamp = -np.inf
+        self._window_end = None
+        self._window_done = threading.Condition()
+        self._window_requests = None
+        # Columns are the scaled value, the time received, and the timestamp
+        self._samples = SampleBuffer()
+        self._flyer_samples = SampleBuffer(capacity=flyer_chunk)
+        self._flyer_lock = threading.Lock()
+        self._flyer_spill = None
+        self._flyer_spilled = 0
         super().__init__(*args, **kwargs)
         self.mean.name = self.name
         self.rescale.set(rescale).wait(timeout=60)
@@ -30,10 +335,11 @@ class ScalarBase(Device):
             self.gain.set(kwargs["gain"]).wait(timeout=60)
 
     def kickoff(self):
-        self._flyer_buffer = []
-        self._flyer_time_buffer = []
-        self._flyer_timestamp_buffer = []
-        self._flyer_queue = Queue()
+        with self._flyer_lock:
+            self._flyer_samples.clear()
+            spill, _ = self._take_flyer_spill()
+        if spill is not None:
+            spill.close()
         kickoff_st = DeviceStatus(device=self)
         kickoff_st.set_finished()
         self._flying = True
@@ -44,10 +350,11 @@ class ScalarBase(Device):
         return kickoff_st
 
     def stage(self):
-        self._secret_buffer = []
-        self._secret_time_buffer = []
-        self._buffer = []
-        self._time_buffer = []
+        self._secret_buffer = deque(maxlen=self.raw_memory_points)
+        self._secret_time_buffer = deque(maxlen=self.raw_memory_points)
+        if self.raw_directory is not None:
+            self._raw_store = RawSampleStore(self.raw_directory, self.name)
+        self._samples.clear()
         self._reading = True
         if not self._measuring:
             self.target.subscribe(self._aggregate, run=False)
@@ -59,43 +366,61 @@ class ScalarBase(Device):
             self.target.clear_sub(self._aggregate)
             self._measuring = False
         self._reading = False
+        self._stop_window_worker()
+        if self._raw_store is not None:
+            self._raw_store.close()
+            self._raw_store = None
+            self._raw_datum = None
         return super().unstage()
 
+    def new_resource(self):
+        """
+        Write the raw samples of the following points to a new file.
+
+        Called between runs that share one staging, so that each run
+        publishes its own Resource, see :func:`nbs_bl.plans.groups.repeat`.
+        """
+        if self._raw_store is not None:
+            self._raw_store.close()
+            self._raw_store = RawSampleStore(self.raw_directory, self.name)
+            self._raw_datum = None
+
     def set_exposure(self, exp_time):
-        self.exposure_time.set(exp_time).wait(timeout=60)
+        self.start_set_exposure(exp_time).wait(timeout=60)
+
+    def start_set_exposure(self, exp_time):
+        """
+        Start setting the exposure time, without waiting for it.
+
+        Returns
+        -------
+        Status
+            Status of the set, so that plans can configure several detectors
+            at once, see :func:`nbs_bl.plans.plan_stubs.set_exposure`
+        """
+        return self.exposure_time.set(exp_time, timeout=60)
 
     def _aggregate(self, value, **kwargs):
         scale_value = value * self.rescale.get() - self.offset.get()
         t = time.time()
+        timestamp = kwargs.get("timestamp", t)
         if self._reading:
-            self._buffer.append(scale_value)
-            self._time_buffer.append(t)
+            self._samples.append(scale_value, t, timestamp)
         if self._flying:
-            event = dict()
-            event["time"] = t
-            event["data"] = dict()
-            event["timestamps"] = dict()
-            event["data"][self.name] = scale_value
-            event["timestamps"][self.name] = kwargs.get("timestamp", t)
-            self._flyer_buffer.append(scale_value)
-            self._flyer_time_buffer.append(t)
-            self._flyer_timestamp_buffer.append(kwargs.get("timestamp", t))
-            self._flyer_queue.put(event)
+            with self._flyer_lock:
+                self._flyer_samples.append(scale_value, t, timestamp)
+                if len(self._flyer_samples) == self._flyer_samples.capacity:
+                    self._spill_flyer_samples()
+        self._latest_timestamp = timestamp
+        window_end = self._window_end
+        if window_end is not None and timestamp >= window_end:
+            with self._window_done:
+                self._window_done.notify_all()
 
-    def _acquire(self, status):
-        self._buffer = []
-        self._time_buffer = []
-        time.sleep(self.exposure_time.get())
-        if len(self._buffer) == 0:
-            ntry = 10
-            n = 0
-            while len(self._buffer) < 1:
-                time.sleep(0.1 * self.exposure_time.get())
-                n += 1
-                if n > ntry:
-                    break
-        buf = np.array(self._buffer)
-        tbuf = np.array(self._time_buffer[: len(buf)])
+    def _reserve(self, exposure):
+        self._samples.reserve(int(np.ceil(2 * self.expected_rate * exposure)))
+
+    def _publish(self, buf, tbuf):
         if len(buf) == 0:
             self.mean.put(np.nan)
             self.median.put(np.nan)
@@ -111,23 +436,162 @@ class ScalarBase(Device):
             self.sum.put(np.sum(buf))
         self._secret_buffer.append(buf)
         self._secret_time_buffer.append(tbuf)
-        status.set_finished()
-        return
+        if self._raw_store is not None:
+            self._raw_datum = self._raw_store.write(np.column_stack((buf, tbuf)))
+
+    def describe(self):
+        description = super().describe()
+        if self._raw_store is not None:
+            description[self.name + "_raw"] = {
+                "source": f"{self._raw_store.spec}:{self.name}",
+                "dtype": "array",
+                "shape": [None, self._raw_store.columns],
+                "external": "FILESTORE:",
+            }
+        return description
+
+    def read(self):
+        reading = super().read()
+        if self._raw_store is not None:
+            # Each trigger's samples are read once. Reads without a new trigger
+            # refer to no samples, so that every reading has the same keys.
+            datum, self._raw_datum = self._raw_datum, None
+            if datum is None:
+                datum = self._raw_store.write(np.empty((0, self._raw_store.columns)))
+            reading[self.name + "_raw"] = {"value": datum, "timestamp": time.time()}
+        return reading
+
+    def collect_asset_docs(self):
+        if self._raw_store is not None:
+            yield from self._raw_store.collect_asset_docs()
+
+    def _window_worker(self, requests):
+        """Finish the triggers of "timestamp" mode, until a None request."""
+        while True:
+            request = requests.get()
+            if request is None:
+                return
+            status, mark, exposure = request
+            try:
+                self._publish_window(mark, exposure)
+            except Exception as e:
+                status.set_exception(e)
+            else:
+                status.set_finished()
+
+    def _publish_window(self, mark, exposure):
+        with self._window_done:
+            # Any sample wakes the worker until the window has a start
+            self._window_end = -np.inf
+            self._window_done.wait_for(
+                lambda: self._samples.mark() > mark, exposure + self.window_timeout
+            )
+            first = self._samples.since(mark)
+            if len(first) == 0:
+                self._window_end = None
+                self._publish(first[:, 0], first[:, 2])
+                return
+            start = first[0, 2]
+            end = start + exposure
+            self._window_end = end
+            self._window_done.wait_for(
+                lambda: self._latest_timestamp >= end, exposure + self.window_timeout
+            )
+            self._window_end = None
+        samples = self._samples.since(mark)
+        timestamps = samples[:, 2]
+        samples = samples[(timestamps >= start) & (timestamps < end)]
+        self._publish(samples[:, 0], samples[:, 2])
+
+    def _stop_window_worker(self):
+        if self._window_requests is not None:
+            self._window_requests.put(None)
+            self._window_requests = None
+
+    def destroy(self):
+        self._stop_window_worker()
+        super().destroy()
+
+    def _acquire(self, status):
+        exposure = self.exposure_time.get()
+        self._reserve(exposure)
+        mark = self._samples.mark()
+        time.sleep(exposure)
+        if self._samples.mark() == mark:
+            ntry = 10
+            n = 0
+            while self._samples.mark() == mark:
+                time.sleep(0.1 * exposure)
+                n += 1
+                if n > ntry:
+                    break
+        samples = self._samples.since(mark)
+        try:
+            self._publish(samples[:, 0], samples[:, 1])
+        except Exception as e:
+            status.set_exception(e)
+        else:
+            status.set_finished()
 
     def trigger(self):
         status = DeviceStatus(self)
-        threading.Thread(target=self._acquire, args=(status,), daemon=True).start()
+        if self.acquire_mode == "timestamp":
+            if self._window_requests is None:
+                self._window_requests = Queue()
+                threading.Thread(
+                    target=self._window_worker,
+                    args=(self._window_requests,),
+                    daemon=True,
+                ).start()
+            exposure = self.exposure_time.get()
+            self._reserve(exposure)
+            self._window_requests.put((status, self._samples.mark(), exposure))
+        else:
+            threading.Thread(target=self._acquire, args=(status,), daemon=True).start()
         return status
 
+    def _spill_flyer_samples(self):
+        """Move the flyer samples in memory to the spill file, with the lock held."""
+        samples = self._flyer_samples.since()
+        self._flyer_samples.clear()
+        if len(samples) == 0:
+            return
+        if self._flyer_spill is None:
+            self._flyer_spill = tempfile.TemporaryFile(dir=self.raw_directory)
+        self._flyer_spill.write(np.ascontiguousarray(samples, dtype="<f8").tobytes())
+        self._flyer_spilled += len(samples)
+
+    def _take_flyer_spill(self):
+        """Detach the spill file and its row count, with the lock held."""
+        spill, rows = self._flyer_spill, self._flyer_spilled
+        self._flyer_spill = None
+        self._flyer_spilled = 0
+        return spill, rows
+
     def collect(self):
-        events = []
-        while True:
-            try:
-                e = self._flyer_queue.get_nowait()
-                events.append(e)
-            except Empty:
-                break
-        yield from events
+        # Drain the samples, so that only the samples that arrive from now on
+        # are kept, and read them back one chunk at a time
+        with self._flyer_lock:
+            self._spill_flyer_samples()
+            spill, rows = self._take_flyer_spill()
+        if spill is None:
+            return
+        chunk = self._flyer_samples.capacity
+        columns = self._flyer_samples.columns
+        try:
+            spill.seek(0)
+            for start in range(0, rows, chunk):
+                n = min(chunk, rows - start)
+                data = spill.read(8 * columns * n)
+                samples = np.frombuffer(data, dtype="<f8").reshape(n, columns)
+                for value, t, timestamp in samples.tolist():
+                    yield {
+                        "time": t,
+                        "data": {self.name: value},
+                        "timestamps": {self.name: timestamp},
+                    }
+        finally:
+            spill.close()
 
     def complete(self):
         self._flying = False
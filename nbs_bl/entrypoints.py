@@ -0,0 +1,172 @@
+"""
+Process-wide registry of the nbs_bl entry points of installed packages.
+
+Scanning the metadata of every installed distribution is slow, so the
+entry points of all ``nbs_bl.*`` groups are collected once per process.
+The result is also stored as JSON in the cache directory, keyed by the
+modification times of the directories on sys.path, which change whenever
+a distribution is installed, upgraded or removed, and of the metadata of
+each distribution in them, which changes when e.g. an editable install is
+rebuilt in place.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+from importlib.metadata import distributions, EntryPoint
+from os.path import join, exists, isdir
+from .config_cache import get_cache_dir
+
+GROUP_PREFIX = "nbs_bl."
+
+
+_METADATA_SUFFIXES = (".dist-info", ".egg-info", ".egg-link")
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _path_key():
+    key = hashlib.sha256(sys.version.encode())
+    for path in sys.path:
+        path = path or os.getcwd()
+        if not isdir(path):
+            continue
+        key.update(f"{path}:{_mtime(path)}".encode())
+        try:
+            names = sorted(os.listdir(path))
+        except OSError:
+            continue
+        for name in names:
+            if name.endswith(_METADATA_SUFFIXES):
+                # entry_points.txt may be rewritten without touching its directory
+                meta = join(path, name)
+                eps = join(meta, "entry_points.txt")
+                key.update(f"{name}:{_mtime(meta)}:{_mtime(eps)}".encode())
+    return key.hexdigest()[:32]
+
+
+class EntryPointRegistry:
+    """
+    Entry points of all nbs_bl groups, discovered once.
+
+    Parameters
+    ----------
+    persist : bool, optional
+        If True, store discovered entry points in the cache directory, and
+        reuse them while the installed distributions are unchanged
+    """
+
+    def __init__(self, persist=True):
+        self.persist = persist
+        self._lock = threading.Lock()
+        self._entry_points = None
+        self._loaded = {}
+
+    def _cache_file(self):
+        return join(get_cache_dir(), f"entry_points-{_path_key()}.json")
+
+    def _discover(self):
+        found = {}
+        seen = set()
+        for dist in distributions():
+            # Like entry_points, only the first distribution of a name counts
+            dist_name = (dist.metadata["Name"] or "").lower().replace("_", "-")
+            if dist_name in seen:
+                continue
+            seen.add(dist_name)
+            for ep in dist.entry_points:
+                if ep.group.startswith(GROUP_PREFIX):
+                    found.setdefault(ep.group, []).append((ep.name, ep.value))
+        return found
+
+    def _read_cache(self, cache_file):
+        if not exists(cache_file):
+            return None
+        try:
+            with open(cache_file, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Ignoring unreadable entry point cache {cache_file}: {e}")
+            return None
+
+    def _write_cache(self, cache_file, found):
+        try:
+            os.makedirs(get_cache_dir(), exist_ok=True)
+            tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(found, f)
+            os.replace(tmp_file, cache_file)
+        except Exception as e:
+            print(f"Could not write entry point cache {cache_file}: {e}")
+
+    def _build(self):
+        found = None
+        if self.persist:
+            cache_file = self._cache_file()
+            found = self._read_cache(cache_file)
+        if found is None:
+            found = self._discover()
+            if self.persist:
+                self._write_cache(cache_file, found)
+        return {
+            group: [EntryPoint(name, value, group) for name, value in eps]
+            for group, eps in found.items()
+        }
+
+    def select(self, group, name=None):
+        """
+        Get the entry points of a group.
+
+        Parameters
+        ----------
+        group : str
+            Entry point group, e.g. "nbs_bl.plan_loaders"
+        name : str, optional
+            Only return entry points with this name
+
+        Returns
+        -------
+        list of importlib.metadata.EntryPoint
+        """
+        if self._entry_points is None:
+            with self._lock:
+                if self._entry_points is None:
+                    self._entry_points = self._build()
+        eps = self._entry_points.get(group, [])
+        if name is not None:
+            eps = [ep for ep in eps if ep.name == name]
+        return eps
+
+    def load(self, entry_point):
+        """
+        Load an entry point, reusing the object if it was loaded before.
+
+        Parameters
+        ----------
+        entry_point : importlib.metadata.EntryPoint
+
+        Returns
+        -------
+        object
+            The object that the entry point refers to
+        """
+        key = (entry_point.group, entry_point.name, entry_point.value)
+        if key not in self._loaded:
+            self._loaded[key] = entry_point.load()
+        return self._loaded[key]
+
+    def refresh(self):
+        """Discard the discovered entry points, e.g. after installing a package."""
+        with self._lock:
+            self._entry_points = None
+            self._loaded = {}
+
+
+GLOBAL_ENTRY_POINTS = EntryPointRegistry()
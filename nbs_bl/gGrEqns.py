@@ -1,9 +1,5 @@
 import numpy as np
-import scipy.optimize as opt
 import bluesky.plan_stubs as bps
-from .printing import run_report
-
-run_report(__file__)
 
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
@@ -83,6 +79,8 @@ def find_best_offsets(mirror_pitches, grating_pitches, mguesses, eVs, k_invmm):
         output.x the optimized offsets of the mirror, and grating pitch
         output.success wether the optimize function thinks that it succeeded or not.  experince shows that good fits are still possible when this is false
     '''
+    import scipy.optimize as opt
+
     fit_result = opt.minimize(diffraction_pitch_offset_error_func,
                               x0=[0.0001, -0.0001],
                               args=(
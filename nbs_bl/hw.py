@@ -1,6 +1,11 @@
 from .queueserver import GLOBAL_USER_STATUS
 from .printing import boxed_text
+from .utils import iterfy
+from .lazy import LazyDevice
 from nbs_core.autoload import loadFromConfig as _loadFromConfig
+from concurrent.futures import ThreadPoolExecutor
+from rich.markup import escape
+import time
 
 
 def loadFromConfig(
@@ -19,6 +24,194 @@ def loadFromConfig(
     return devices, groups, roles
 
 
+def instantiateDevicesParallel(
+    config, keys, instantiateDevice, namespace=None, max_workers=None
+):
+    """
+    Instantiate a set of mutually independent devices concurrently.
+
+    Parameters
+    ----------
+    config : dict
+        Device configuration dictionary
+    keys : list of str
+        Keys of the devices to instantiate. None of these devices may
+        depend on another device in the same list.
+    instantiateDevice : callable
+        Function to instantiate each device
+    namespace : dict, optional
+        Namespace to add devices to
+    max_workers : int, optional
+        Maximum number of devices to instantiate at once
+
+    Returns
+    -------
+    tuple
+        (device_dict, error_dict), where error_dict maps the key of each
+        device that could not be instantiated to the raised exception
+    """
+    devices = {}
+    errors = {}
+    if not keys:
+        return devices, errors
+    with ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="nbs_device_load"
+    ) as executor:
+        futures = {
+            key: executor.submit(instantiateDevice, key, config[key], namespace=None)
+            for key in keys
+        }
+        for key, future in futures.items():
+            try:
+                devices[key] = future.result()
+            except Exception as e:
+                errors[key] = e
+    # Namespace updates happen here, in config order, rather than in the workers
+    for key, device in devices.items():
+        if namespace is not None and config[key].get("_add_to_ns", True):
+            namespace[key] = device
+    return devices, errors
+
+
+def waitForConnections(devices, timeout=10):
+    """
+    Wait for a set of devices to connect, sharing one aggregate timeout.
+
+    Parameters
+    ----------
+    devices : dict
+        Dictionary of device keys to devices
+    timeout : float, optional
+        Total time in seconds to wait for all devices
+
+    Returns
+    -------
+    dict
+        Maps the key of each device that did not connect to the exception raised
+    """
+    errors = {}
+    deadline = time.monotonic() + timeout
+    for key, device in devices.items():
+        if not hasattr(device, "wait_for_connection"):
+            continue
+        remaining = max(deadline - time.monotonic(), 1e-3)
+        try:
+            device.wait_for_connection(timeout=remaining)
+        except Exception as e:
+            errors[key] = e
+    return errors
+
+
+def reportLoadFailures(errors, title="Device loading failures"):
+    """
+    Print a summary of devices that failed to instantiate or connect.
+
+    Parameters
+    ----------
+    errors : dict
+        Maps device keys to the exception raised for that device
+    title : str, optional
+        Title of the printed report
+    """
+    if not errors:
+        return
+    text = [escape(f"{key}: {e!r}") for key, e in errors.items()]
+    boxed_text(title, text, "red")
+
+
+def loadDeviceWave(
+    config,
+    keys,
+    instantiateDevice,
+    namespace=None,
+    available=None,
+    max_workers=None,
+):
+    """
+    Load one wave of mutually independent devices, instantiating them concurrently.
+
+    Devices that fail to instantiate are reported and skipped rather than
+    aborting the load. Aliases in the wave are resolved against devices that
+    are already available.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary containing device information
+    keys : list of str
+        Device and alias keys in the wave
+    instantiateDevice : callable
+        Function to instantiate each device
+    namespace : dict, optional
+        Namespace to add devices to
+    available : dict, optional
+        Already loaded devices, used to resolve aliases
+    max_workers : int, optional
+        Maximum number of devices to instantiate at once
+
+    Returns
+    -------
+    tuple
+        (device_dict, group_dict, role_dict, failure_dict)
+    """
+    available = available or {}
+    alias_keys = [key for key in keys if "_alias" in config[key]]
+    device_keys = [
+        key
+        for key in keys
+        if key not in alias_keys and config[key].get("_target", "IGNORE") != "IGNORE"
+    ]
+    devices, failures = instantiateDevicesParallel(
+        config, device_keys, instantiateDevice, namespace, max_workers
+    )
+
+    for alias_key in alias_keys:
+        device_names = config[alias_key]["_alias"].split(".")
+        try:
+            device = available[device_names[0]]
+            for key in device_names[1:]:
+                device = getattr(device, key)
+        except (KeyError, AttributeError) as e:
+            failures[alias_key] = e
+            continue
+        devices[alias_key] = device
+        if namespace is not None:
+            namespace[alias_key] = device
+
+    groups, roles = groupDevices(config, devices)
+
+    for key, device in devices.items():
+        globals()[key] = device
+    return devices, groups, roles, failures
+
+
+def groupDevices(config, keys):
+    """
+    Collect the groups and roles of a set of devices from their configuration.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary containing device information
+    keys : iterable of str
+        Device keys
+
+    Returns
+    -------
+    tuple
+        (group_dict, role_dict)
+    """
+    groups = {}
+    roles = {}
+    for key in keys:
+        device_info = config[key]
+        for g in iterfy(device_info.get("_group", ["misc"])):
+            groups.setdefault(g, []).append(key)
+        if "_role" in device_info:
+            roles[device_info["_role"]] = key
+    return groups, roles
+
+
 class HardwareGroup:
     def __init__(self, name="", use_redis=False):
         self.groupname = name
@@ -28,6 +221,8 @@ class HardwareGroup:
         self.descriptions = GLOBAL_USER_STATUS.request_status_dict(
             f"{self.groupname.upper()}_DESCRIPTIONS", use_redis=use_redis
         )
+        # Reverse index of id(device) -> key, so get_key does not scan devices
+        self._keys_by_id = {}
 
     def values(self):
         return self.devices.values()
@@ -42,17 +237,41 @@ class HardwareGroup:
             else:
                 raise KeyError(f"Device {device_or_key} not found")
         else:
+            key = self._keys_by_id.get(id(device_or_key))
+            if key is not None and self.devices.get(key) is device_or_key:
+                return key
+            # Fall back to a scan for devices that were not added through add
             for k, v in self.devices.items():
                 if v == device_or_key:
+                    self._keys_by_id[id(device_or_key)] = k
                     return k
         raise KeyError(f"Device {device_or_key} not found")
 
+    def _index_device(self, key, device):
+        old_device = self.devices.get(key, None)
+        if old_device is not None and self._keys_by_id.get(id(old_device)) == key:
+            self._keys_by_id.pop(id(old_device))
+        self.devices[key] = device
+        self._keys_by_id[id(device)] = key
+
     def get(self, device_or_key):
         key = self.get_key(device_or_key)
         return self.devices[key]
 
     def add(self, key, device, description="", **kwargs):
-        self.devices[key] = device
+        self._index_device(key, device)
+        self._add_descriptions(key, device, description)
+
+    def replace(self, key, device):
+        """Swap in a new object for an existing key, e.g. a materialized LazyDevice"""
+        self._index_device(key, device)
+        self._add_descriptions(key, device, self.descriptions.get(key, ""))
+
+    def _add_descriptions(self, key, device, description=""):
+        if isinstance(device, LazyDevice) and not device.materialized:
+            # Describing subdevices would instantiate the device
+            self.descriptions[key] = description
+            return
         has_subdevices = False
         if hasattr(device, "real_positioners"):
             try:
@@ -84,7 +303,9 @@ class HardwareGroup:
 
     def remove(self, device_or_key):
         key = self.get_key(device_or_key)
-        self.devices.pop(key, None)
+        device = self.devices.pop(key, None)
+        if self._keys_by_id.get(id(device)) == key:
+            self._keys_by_id.pop(id(device))
         self.descriptions.pop(key, None)
         for dkey in list(self.descriptions.keys()):
             if dkey.split(".")[0] == key:
@@ -116,6 +337,9 @@ class DetectorGroup(HardwareGroup):
         self.active = GLOBAL_USER_STATUS.request_status_list(
             f"{self.groupname.upper()}_ACTIVE", use_redis=False
         )
+        # Keys of the active detectors, in activation order. This is the source
+        # of truth, and active is rebuilt from it
+        self._active_keys = {}
         self.detector_sets = GLOBAL_USER_STATUS.request_status_dict(
             f"{self.groupname.upper()}_SETS", use_redis=use_redis
         )
@@ -141,6 +365,12 @@ class DetectorGroup(HardwareGroup):
         if threshold is not None:
             self.thresholds[key] = threshold
 
+    def replace(self, key, device):
+        old_device = self.devices[key]
+        super().replace(key, device)
+        if key in self._active_keys:
+            self._update_active()
+
     def remove(self, device_or_key):
         self.deactivate(device_or_key)
         key = self.get_key(device_or_key)
@@ -148,6 +378,14 @@ class DetectorGroup(HardwareGroup):
         self.status.pop(key, None)
         self.thresholds.pop(key, None)
 
+    def _update_active(self):
+        """Rebuild the active list from _active_keys, in one update."""
+        active = [self.devices[key] for key in self._active_keys]
+        if len(active) != len(self.active) or any(
+            new is not old for new, old in zip(active, self.active)
+        ):
+            self.active[:] = active
+
     def activate(self, device_or_key, role=None):
         key = self.get_key(device_or_key)
         detector = self.devices[key]
@@ -156,27 +394,36 @@ class DetectorGroup(HardwareGroup):
             return
         else:
             self.status[key] = "active"
-        if detector not in self.active:
+        if key not in self._active_keys:
+            self._active_keys[key] = None
             self.active.append(detector)
         if role is not None:
             self.add_role(key, role)
 
     def deactivate(self, device_or_key):
         key = self.get_key(device_or_key)
-        device = self.get(device_or_key)
-        if device in self.active:
-            idx = self.active.index(device)
-            self.active.pop(idx)
+        if self._deactivate_key(key):
+            self._update_active()
+
+    def _deactivate_key(self, key):
+        """Deactivate a detector without updating active, see deactivate."""
         if self.status[key] != "disabled":
             self.status[key] = "inactive"
+        if key not in self._active_keys:
+            return False
+        del self._active_keys[key]
+        return True
 
     def activate_set(self, set_name):
         for key in self.detector_sets.get(set_name, []):
             self.activate(key)
 
     def deactivate_set(self, set_name):
+        changed = False
         for key in self.detector_sets.get(set_name, []):
-            self.deactivate(key)
+            changed = self._deactivate_key(self.get_key(key)) or changed
+        if changed:
+            self._update_active()
 
     def add_set(self, set_name, set_keys):
         self.detector_sets[set_name] = set_keys
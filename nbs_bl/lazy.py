@@ -0,0 +1,104 @@
+import threading
+from bluesky.preprocessors import msg_mutator
+
+
+class LazyDevice:
+    """
+    Placeholder for a device that is only instantiated when it is first used.
+
+    The real device is created on first access to any attribute other than
+    ``name``, or when a plan message that references the placeholder reaches
+    the RunEngine (see :func:`materialize_lazy_devices_wrapper`). After that,
+    all attribute access is forwarded to the real device.
+
+    Parameters
+    ----------
+    key : str
+        Device key in the configuration
+    name : str
+        Name that the real device will have
+    loader : callable
+        Called with the placeholder, must return the real device
+    root : LazyDevice, optional
+        For a placeholder of a subdevice, the placeholder of its root device
+    """
+
+    def __init__(self, key, name, loader, root=None):
+        self._lazy_key = key
+        self._lazy_name = name
+        self._lazy_loader = loader
+        self._lazy_root = root if root is not None else self
+        self._lazy_device = None
+        self._lazy_lock = threading.RLock()
+
+    @property
+    def name(self):
+        if self._lazy_device is not None:
+            return self._lazy_device.name
+        return self._lazy_name
+
+    @property
+    def materialized(self):
+        """True once the real device has been instantiated"""
+        return self._lazy_device is not None
+
+    def materialize(self):
+        """
+        Instantiate the real device, if that has not happened yet.
+
+        Returns
+        -------
+        object
+            The real device
+        """
+        with self._lazy_lock:
+            if self._lazy_device is None:
+                self._lazy_device = self._lazy_loader(self)
+        return self._lazy_device
+
+    def __getattr__(self, attr):
+        # Only called for attributes not found on the placeholder itself
+        if attr.startswith("_lazy_"):
+            raise AttributeError(attr)
+        return getattr(self.materialize(), attr)
+
+    def __setattr__(self, attr, value):
+        if attr.startswith("_lazy_"):
+            object.__setattr__(self, attr, value)
+        else:
+            setattr(self.materialize(), attr, value)
+
+    def __repr__(self):
+        if self._lazy_device is not None:
+            return repr(self._lazy_device)
+        return f"LazyDevice({self._lazy_key!r}, name={self._lazy_name!r})"
+
+
+def resolve_lazy(obj):
+    """Return the real device for a LazyDevice, or obj unchanged otherwise."""
+    if isinstance(obj, LazyDevice):
+        return obj.materialize()
+    return obj
+
+
+def _materialize_msg(msg):
+    obj = resolve_lazy(msg.obj)
+    if any(isinstance(arg, LazyDevice) for arg in msg.args):
+        args = tuple(resolve_lazy(arg) for arg in msg.args)
+    else:
+        args = msg.args
+    if obj is msg.obj and args is msg.args:
+        return msg
+    return msg._replace(obj=obj, args=args)
+
+
+def materialize_lazy_devices_wrapper(plan):
+    """
+    Preprocessor that replaces LazyDevice placeholders in messages with real devices.
+
+    Parameters
+    ----------
+    plan : iterable or iterator
+        a generator, list, or similar containing `Msg` objects
+    """
+    return (yield from msg_mutator(plan, _materialize_msg))
@@ -0,0 +1,537 @@
+"""
+Dry runs of plans on a virtual clock, to predict how long they take.
+
+The plan is iterated like the RunEngine would, but its messages are never
+sent to the hardware, and no method of a device is called. Instead, every
+device is represented by a stand-in that knows how long its actions take:
+
+- Positioners with a ``velocity`` and ``acceleration`` move with a
+  trapezoidal velocity profile, from their current (virtual) position.
+- Shutters take ``shutter_time`` for every move.
+- Detectors take their exposure time, as set during the plan, plus
+  ``trigger_overhead`` for every trigger.
+- Reads return the virtual position of a device, or ``read_value``.
+
+The stand-ins are built from ``[settings.dry_run]``, with the position,
+velocity, acceleration and exposure of single devices in
+``[settings.dry_run.devices.<name>]``. Values that are not configured are
+taken from what is already held in memory: the position of positioners, the
+last value that each signal received, e.g. from its monitor, and the
+exposure times recorded in :data:`~nbs_bl.state_cache.GLOBAL_STATE_CACHE`.
+The control system is never asked for a value, so motors whose velocity was
+never received take ``move_time`` for every move.
+
+Python code in the plan runs as usual, so a plan that reads devices
+directly, instead of via messages, still reads the real devices. Changes
+that the plan setup makes to the beamline, like activating detectors, are
+undone when the dry run ends.
+"""
+
+import math
+from contextlib import contextmanager
+from uuid import uuid4
+from ophyd import Signal
+from ophyd.signal import DEFAULT_EPICSSIGNAL_VALUE
+from ..beamline import GLOBAL_BEAMLINE
+from ..help import GLOBAL_IMPORT_DICTIONARY
+from ..hw import DetectorGroup
+from ..state_cache import GLOBAL_STATE_CACHE
+from . import plan_stubs
+
+_default_dry_run = {
+    "move_time": 1.0,
+    "settle_time": 0.0,
+    "shutter_time": 1.0,
+    "trigger_time": 0.1,
+    "trigger_overhead": 0.0,
+    "read_time": 0.0,
+    "event_overhead": 0.0,
+    "read_value": 0.0,
+    "max_messages": 1000000,
+    "devices": {},
+}
+
+EXPOSURE_ATTRS = ("exposure_time", "exposure", "acquire_time")
+
+# Messages that do not take time, and whose response is None
+_NO_OP_COMMANDS = {
+    "create",
+    "save",
+    "drop",
+    "declare_stream",
+    "stage",
+    "unstage",
+    "subscribe",
+    "unsubscribe",
+    "monitor",
+    "unmonitor",
+    "checkpoint",
+    "clear_checkpoint",
+    "pause",
+    "install_suspender",
+    "remove_suspender",
+    "null",
+    "wait_for",
+    "prepare",
+}
+
+
+def get_dry_run_settings():
+    """
+    Get the dry run settings, filled in with defaults.
+
+    Returns
+    -------
+    dict
+        The [settings.dry_run] table from beamline.toml, with defaults for
+        any missing keys
+    """
+    settings = dict(_default_dry_run)
+    settings.update(GLOBAL_BEAMLINE.settings.get("dry_run", {}))
+    return settings
+
+
+class VirtualStatus:
+    """
+    Status that is done once the virtual clock reaches a given time.
+
+    Parameters
+    ----------
+    clock : VirtualClock
+        The clock of the dry run
+    done_at : float
+        Virtual time at which the action is done
+    kind : str
+        Kind of action, used in the time breakdown
+    device : str
+        Name of the device that does the action
+    """
+
+    def __init__(self, clock, done_at, kind, device):
+        self.clock = clock
+        self.done_at = done_at
+        self.kind = kind
+        self.device = device
+        self.success = True
+
+    @property
+    def done(self):
+        return self.clock.now >= self.done_at
+
+    def wait(self, timeout=None):
+        self.clock.advance_to(self.done_at, self.kind, self.device)
+
+    def add_callback(self, callback):
+        callback(self)
+
+    @property
+    def finished_cb(self):
+        return None
+
+    @finished_cb.setter
+    def finished_cb(self, callback):
+        callback(self)
+
+    def __repr__(self):
+        return f"VirtualStatus({self.kind}, {self.device}, done_at={self.done_at})"
+
+
+class VirtualClock:
+    """
+    Time of a dry run, with a record of what the time was spent on.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.phase = "setup"
+        self.phases = {}
+        self.by_kind = {}
+        self.by_device = {}
+
+    def advance_to(self, t, kind, device=None):
+        """
+        Advance the clock, and attribute the elapsed time.
+
+        Parameters
+        ----------
+        t : float
+            New time. Times in the past are ignored
+        kind : str
+            What the time was spent on, e.g. "move" or "trigger"
+        device : str, optional
+            Name of the device that the time was spent on
+        """
+        dt = t - self.now
+        if dt <= 0:
+            return
+        self.now = t
+        self.phases[self.phase] = self.phases.get(self.phase, 0) + dt
+        self.by_kind[kind] = self.by_kind.get(kind, 0) + dt
+        if device is not None:
+            self.by_device[device] = self.by_device.get(device, 0) + dt
+
+    def advance(self, dt, kind, device=None):
+        self.advance_to(self.now + dt, kind, device)
+
+
+def _move_time(distance, velocity, acceleration):
+    """
+    Time of a move with a trapezoidal velocity profile.
+
+    Parameters
+    ----------
+    distance : float
+        Distance to travel
+    velocity : float
+        Maximum velocity
+    acceleration : float
+        Time to reach the maximum velocity, like the ACCL field of a motor
+    """
+    distance = abs(distance)
+    if distance == 0:
+        return 0.0
+    acceleration = max(acceleration or 0, 0)
+    if distance >= velocity * acceleration:
+        return distance / velocity + acceleration
+    return 2 * math.sqrt(distance * acceleration / velocity)
+
+
+def _cached_value(signal):
+    """Last value that a signal received, without asking the control system."""
+    if not isinstance(signal, Signal):
+        return None
+    # Updated by the monitor of the signal, or by its last get
+    value = getattr(signal, "_readback", None)
+    if value is DEFAULT_EPICSSIGNAL_VALUE:
+        return None
+    return value
+
+
+def _signal_value(obj, attr):
+    """Cached value of a signal of obj, or None."""
+    return _cached_value(getattr(obj, attr, None))
+
+
+def _cached_position(obj):
+    """Position of a positioner, or the cached value of a signal, or None."""
+    if hasattr(obj, "position"):
+        # The position of ophyd positioners is kept up to date by their readback
+        try:
+            return obj.position
+        except Exception:
+            return None
+    return _cached_value(obj)
+
+
+@contextmanager
+def _isolated_beamline():
+    """Undo the changes that a plan setup makes to the beamline state."""
+    detector_groups = []
+    for name in GLOBAL_BEAMLINE.groups:
+        group = getattr(GLOBAL_BEAMLINE, name, None)
+        if isinstance(group, DetectorGroup):
+            detector_groups.append(
+                (
+                    group,
+                    [group.get_key(detector) for detector in group.active],
+                    dict(group.status),
+                    dict(group.roles),
+                )
+            )
+    exposure_time = plan_stubs.GLOBAL_EXPOSURE_TIME
+    try:
+        yield
+    finally:
+        plan_stubs.GLOBAL_EXPOSURE_TIME = exposure_time
+        for group, active, status, roles in detector_groups:
+            changed = [group.get_key(detector) for detector in group.active] != active
+            if changed:
+                for detector in list(group.active):
+                    group.deactivate(detector)
+            for key, value in status.items():
+                if group.status.get(key) != value:
+                    group.status[key] = value
+            if changed:
+                for key in active:
+                    group.activate(key)
+            group.roles = roles
+
+
+class DryRun:
+    """
+    Run a plan on a virtual clock.
+
+    Parameters
+    ----------
+    settings : dict, optional
+        Dry run settings, by default from :func:`get_dry_run_settings`
+    """
+
+    def __init__(self, settings=None):
+        if settings is None:
+            settings = get_dry_run_settings()
+        self.settings = settings
+        self.clock = VirtualClock()
+        self.groups = {}
+        self.messages = 0
+        self._positions = {}
+        self._exposures = {}
+        self._timing = {}
+        self._flights = {}
+        self._shutters = self._find_shutters()
+
+    def _find_shutters(self):
+        shutters = set()
+        group = getattr(GLOBAL_BEAMLINE, "shutters", None)
+        if group is not None:
+            shutters.update(id(device) for device in group.devices.values())
+        if GLOBAL_BEAMLINE.default_shutter is not None:
+            shutters.add(id(GLOBAL_BEAMLINE.default_shutter))
+        return shutters
+
+    def _device_settings(self, obj):
+        return self.settings["devices"].get(getattr(obj, "name", None), {})
+
+    def _is_shutter(self, obj):
+        while obj is not None:
+            if id(obj) in self._shutters:
+                return True
+            obj = getattr(obj, "parent", None)
+        return False
+
+    def _position(self, obj):
+        key = id(obj)
+        if key not in self._positions:
+            position = self._device_settings(obj).get("position", None)
+            if position is None:
+                position = _cached_position(obj)
+            self._positions[key] = position
+        return self._positions[key]
+
+    def _motion(self, obj):
+        """Velocity and acceleration time of a positioner, or None."""
+        key = id(obj)
+        if key not in self._timing:
+            overrides = self._device_settings(obj)
+            velocity = overrides.get("velocity", _signal_value(obj, "velocity"))
+            acceleration = overrides.get(
+                "acceleration", _signal_value(obj, "acceleration")
+            )
+            if velocity:
+                self._timing[key] = (abs(velocity), acceleration or 0)
+            else:
+                self._timing[key] = None
+        return self._timing[key]
+
+    def _set_time(self, obj, value):
+        """Time that setting obj to value takes, updating virtual positions."""
+        overrides = self._device_settings(obj)
+        if "move_time" in overrides:
+            duration = overrides["move_time"]
+        elif self._is_shutter(obj):
+            duration = self.settings["shutter_time"]
+        else:
+            duration = self._positioner_time(obj, value)
+        self._positions[id(obj)] = value
+        return duration + overrides.get("settle_time", self.settings["settle_time"])
+
+    def _positioner_time(self, obj, value):
+        parent = getattr(obj, "parent", None)
+        if parent is not None and getattr(obj, "attr_name", None) in EXPOSURE_ATTRS:
+            self._exposures[id(parent)] = value
+            return 0.0
+        motion = self._motion(obj)
+        start = self._position(obj)
+        if motion is None or start is None:
+            if hasattr(obj, "position"):
+                return self.settings["move_time"]
+            return 0.0
+        try:
+            return _move_time(float(value) - float(start), *motion)
+        except (TypeError, ValueError):
+            return self.settings["move_time"]
+
+    def _exposure(self, obj):
+        key = id(obj)
+        if key not in self._exposures:
+            overrides = self._device_settings(obj)
+            exposure = overrides.get("exposure", None)
+            if exposure is None:
+                exposure = GLOBAL_STATE_CACHE.get_state(obj).get("exposure", None)
+            for attr in EXPOSURE_ATTRS:
+                if exposure is not None:
+                    break
+                exposure = _signal_value(obj, attr)
+            self._exposures[key] = exposure
+        exposure = self._exposures[key]
+        if exposure is None:
+            if hasattr(obj, "position"):
+                # Positioners are triggered in scans, but just report their position
+                return 0.0
+            exposure = self.settings["trigger_time"]
+        overhead = self._device_settings(obj).get(
+            "trigger_overhead", self.settings["trigger_overhead"]
+        )
+        return exposure + overhead
+
+    def _status(self, duration, kind, obj, group):
+        status = VirtualStatus(
+            self.clock, self.clock.now + duration, kind, getattr(obj, "name", None)
+        )
+        if group is not None:
+            self.groups.setdefault(group, []).append(status)
+        return status
+
+    def _reading(self, obj):
+        value = self._position(obj)
+        if value is None:
+            value = self._device_settings(obj).get(
+                "read_value", self.settings["read_value"]
+            )
+        fields = getattr(obj, "hints", {}).get("fields", []) or [obj.name]
+        return {key: {"value": value, "timestamp": self.clock.now} for key in fields}
+
+    def _call_obj(self, obj, method, args, kwargs):
+        if method in ("set_exposure", "start_set_exposure"):
+            self._exposures[id(obj)] = args[0]
+        elif method == "preflight":
+            start, stop = args[:2]
+            speed = kwargs.get("speed", args[2] if len(args) > 2 else None)
+            if speed is None:
+                speed = (self._motion(obj) or (None,))[0]
+            self._flights[id(obj)] = (start, stop, speed)
+            return self._status(self._set_time(obj, start), "move", obj, None)
+        elif method == "fly":
+            start, stop, speed = self._flights.pop(id(obj))
+            if speed:
+                duration = abs(stop - start) / speed
+            else:
+                duration = self.settings["move_time"]
+            self._positions[id(obj)] = stop
+            return self._status(duration, "fly", obj, None)
+        # Other methods, including getters, are not simulated and return None
+        return None
+
+    def _handle(self, msg):
+        command = msg.command
+        obj = msg.obj
+        if command in _NO_OP_COMMANDS:
+            if command == "save":
+                self.clock.advance(self.settings["event_overhead"], "overhead")
+            return None
+        elif command == "set":
+            duration = self._set_time(obj, msg.args[0])
+            kind = "shutter" if self._is_shutter(obj) else "move"
+            return self._status(duration, kind, obj, msg.kwargs.get("group"))
+        elif command == "trigger":
+            return self._status(
+                self._exposure(obj), "trigger", obj, msg.kwargs.get("group")
+            )
+        elif command == "wait":
+            statuses = self.groups.pop(msg.kwargs.get("group"), [])
+            for status in sorted(statuses, key=lambda s: s.done_at):
+                status.wait()
+            return None
+        elif command == "sleep":
+            self.clock.advance(msg.args[0], "sleep")
+            return None
+        elif command == "read":
+            self.clock.advance(self.settings["read_time"], "read", obj.name)
+            return self._reading(obj)
+        elif command == "locate":
+            position = self._position(obj)
+            return {"setpoint": position, "readback": position}
+        elif command == "open_run":
+            self.clock.phase = "run"
+            return str(uuid4())
+        elif command == "close_run":
+            self.clock.phase = "cleanup"
+            return None
+        elif command == "call_obj":
+            kwargs = dict(msg.kwargs)
+            method = kwargs.pop("method")
+            kwargs.pop("group", None)
+            kwargs.pop("await_status", None)
+            return self._call_obj(obj, method, msg.args, kwargs)
+        elif command in ("kickoff", "complete"):
+            return self._status(0, command, obj, msg.kwargs.get("group"))
+        elif command == "collect":
+            return []
+        elif command == "configure":
+            return {}, {}
+        elif command == "input":
+            return ""
+        return None
+
+    def run(self, plan):
+        """
+        Iterate a plan, and answer its messages on the virtual clock.
+
+        Parameters
+        ----------
+        plan : generator
+            The plan to run
+
+        Returns
+        -------
+        dict
+            The predicted duration in seconds, under "duration", and the
+            time spent in each phase ("setup", "run" and "cleanup"), on each
+            kind of action, and on each device
+        """
+        max_messages = self.settings["max_messages"]
+        response = None
+        with _isolated_beamline():
+            while True:
+                try:
+                    msg = plan.send(response)
+                except StopIteration:
+                    break
+                self.messages += 1
+                if self.messages > max_messages:
+                    plan.close()
+                    raise RuntimeError(
+                        f"Dry run stopped after {max_messages} messages, "
+                        "the plan may never finish on a virtual clock"
+                    )
+                response = self._handle(msg)
+        return {
+            "duration": self.clock.now,
+            "phases": dict(self.clock.phases),
+            "by_kind": dict(self.clock.by_kind),
+            "by_device": dict(self.clock.by_device),
+            "messages": self.messages,
+        }
+
+
+def dry_run(plan, *args, preprocessors=(), settings=None, **kwargs):
+    """
+    Predict how long a plan takes, by running it on a virtual clock.
+
+    Parameters
+    ----------
+    plan : str, callable or generator
+        A plan name from the list of built-in plans, a plan function, or a
+        generator that was already created
+    *args
+        Positional arguments for the plan function
+    preprocessors : iterable, optional
+        Preprocessors to apply to the plan, like those of a RunEngine
+    settings : dict, optional
+        Dry run settings, by default from :func:`get_dry_run_settings`
+    **kwargs
+        Keyword arguments for the plan function
+
+    Returns
+    -------
+    dict
+        The predicted duration, and its breakdown, see :meth:`DryRun.run`
+    """
+    if isinstance(plan, str):
+        plan = GLOBAL_IMPORT_DICTIONARY[plan]
+    with _isolated_beamline():
+        if callable(plan):
+            plan = plan(*args, **kwargs)
+        for preprocessor in preprocessors:
+            plan = preprocessor(plan)
+        return DryRun(settings).run(plan)
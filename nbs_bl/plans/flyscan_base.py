@@ -2,8 +2,7 @@ from bluesky.protocols import Readable, Flyable
 from bluesky.utils import get_hinted_fields
 import bluesky.preprocessors as bpp
 from bluesky.plan_stubs import trigger_and_read
-from warnings import warn
-from .plan_stubs import call_obj
+from .plan_stubs import call_obj, _call_detectors
 
 from bluesky.utils import Msg, ensure_generator, short_uid as _short_uid, single_gen
 from bluesky.preprocessors import plan_mutator
@@ -155,12 +154,7 @@ def fly_scan(
     _md["hints"].update(md.get("hints", {}) or {})
 
     if period is not None:
-        for d in readers:
-            try:
-                if hasattr(d, "set_exposure"):
-                    yield from call_obj(d, "set_exposure", period)
-            except RuntimeError as ex:
-                warn(repr(ex), RuntimeWarning)
+        yield from _call_detectors(readers, "set_exposure", period)
 
     yield from call_obj(motor, "preflight", start, stop, *args, **kwargs)
 
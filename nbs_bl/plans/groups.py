@@ -1,19 +1,192 @@
 import uuid
 from functools import wraps
-from bluesky.preprocessors import inject_md_wrapper
+from bluesky import Msg
+from bluesky.plan_stubs import close_run, unstage
+from bluesky.preprocessors import inject_md_wrapper, finalize_wrapper
+from ophyd import Signal
 from .preprocessors import wrap_metadata, merge_func
+from .pipeline import _run_pipeline
+
+_repeat_modes = ("full", "runs", "single_run")
+
+
+def _shared_message(msg, index, state):
+    """
+    Yield one message of a repetition, sharing staging and runs.
+
+    Devices are staged by the first repetition that stages them, and stay
+    staged until all repetitions are done. In "runs" mode, staged devices
+    with a ``new_resource`` method start a new resource for each run after
+    the first, so that the documents of each run refer to its own resources.
+
+    In "single_run" mode, only the first run is opened, and events of its
+    primary stream also read the repeat index. Other streams that the first
+    repetition records before its first primary event are taken as streams
+    of run-level wrappers, such as baselines, as are change-only baseline
+    streams. These are only recorded before the primary events of the first
+    repetition, and after the primary events of the last one, so that the
+    run has one baseline at its start and one at its end.
+    """
+    command = msg.command
+    if state["dropping"] and command in ("read", "save", "drop"):
+        if command != "read":
+            state["dropping"] = False
+        return None
+    if command == "stage":
+        if any(obj is msg.obj for obj in state["staged"]):
+            return []
+        ret = yield msg
+        state["staged"].append(msg.obj)
+        return ret
+    elif command == "unstage":
+        if any(obj is msg.obj for obj in state["staged"]):
+            return []
+    elif command == "open_run":
+        repeat_md = {"uid": state["uid"], "len": state["len"], "mode": state["mode"]}
+        if state["mode"] == "runs":
+            repeat_md["index"] = index
+            if index > 0:
+                for obj in state["staged"]:
+                    if hasattr(obj, "new_resource"):
+                        obj.new_resource()
+            return (yield msg._replace(kwargs=dict(msg.kwargs, repeat=repeat_md)))
+        if state["run_uid"] is None:
+            state["run_streams"].update(msg.kwargs.get("baseline_references", {}))
+            state["run_uid"] = yield msg._replace(
+                kwargs=dict(msg.kwargs, repeat=repeat_md)
+            )
+        return state["run_uid"]
+    elif command == "close_run" and state["mode"] == "single_run":
+        if msg.kwargs.get("exit_status", None) is None:
+            # Closed once all repetitions are done
+            return None
+        state["run_uid"] = None
+    elif command == "declare_stream" and state["mode"] == "single_run":
+        if _skip_stream(msg.kwargs.get("name", "primary"), index, state):
+            return None
+    elif command == "create":
+        state["stream"] = msg.kwargs.get("name", "primary")
+        if state["mode"] == "single_run":
+            if _skip_stream(state["stream"], index, state):
+                state["dropping"] = True
+                return None
+            state["primary_seen"] |= state["stream"] == "primary"
+    elif command == "save" and state["mode"] == "single_run":
+        if state["stream"] == "primary":
+            yield Msg("read", state["index"])
+    return (yield msg)
+
+
+def _skip_stream(name, index, state):
+    """Whether a "single_run" repetition leaves out a stream, see `_shared_message`."""
+    if name == "primary":
+        return False
+    if not state["primary_seen"]:
+        if index == 0:
+            state["run_streams"].add(name)
+            return False
+        return name in state["run_streams"]
+    return name in state["run_streams"] and index < state["len"] - 1
+
+
+def _shared_repetition(plan, index, state):
+    """Run one repetition of a plan, see `_shared_message`."""
+    response = None
+    exception = None
+    while True:
+        try:
+            if exception is not None:
+                msg = plan.throw(exception)
+            else:
+                msg = plan.send(response)
+        except StopIteration as e:
+            return e.value
+        response = None
+        exception = None
+        try:
+            response = yield from _shared_message(msg, index, state)
+        except GeneratorExit:
+            plan.close()
+            raise
+        except Exception as e:
+            exception = e
+
+
+def _shared_repeat(func, repeat, mode):
+    """
+    Make a plan that does the setup of func once, and repeats the rest.
+
+    If func is a setup pipeline, see `setup_step`, its setup steps are done
+    once, and only its inner plan is repeated. Staging is shared by all
+    repetitions, and runs are shared as well in "single_run" mode.
+    """
+    pipeline = getattr(func, "_pipeline", None)
+    if pipeline is not None and pipeline[0] is func:
+        steps, target = pipeline[1], pipeline[2]
+    else:
+        steps, target = [], func
+
+    def repeated(*args, **kwargs):
+        state = {
+            "mode": mode,
+            "uid": str(uuid.uuid4()),
+            "len": repeat,
+            "staged": [],
+            "run_uid": None,
+            "stream": None,
+            "run_streams": set(),
+            "primary_seen": False,
+            "dropping": False,
+            "index": Signal(name="repeat_index", value=0),
+        }
+
+        def repetitions():
+            return_list = []
+            for i in range(repeat):
+                state["index"].put(i)
+                state["primary_seen"] = False
+                r = yield from _shared_repetition(target(*args, **kwargs), i, state)
+                return_list.append(r)
+            if state["run_uid"] is not None:
+                state["run_uid"] = None
+                yield from close_run()
+            return return_list
+
+        def unstage_all():
+            staged = state["staged"]
+            while staged:
+                yield from unstage(staged.pop())
+
+        return (yield from finalize_wrapper(repetitions(), unstage_all()))
+
+    return _run_pipeline(steps, repeated)
 
 
 def repeat(func):
     @merge_func(func)
-    def inner(*args, repeat: int = 1, **kwargs):
+    def inner(*args, repeat: int = 1, repeat_mode: str = "full", **kwargs):
         """
         Parameters
         ----------
         repeat : int, optional
-            The number of times to repeat the entire scan
+            The number of times to repeat the scan
+        repeat_mode : str, optional
+            How the scan is repeated. "full" repeats the entire scan,
+            including its setup. "runs" does the setup and staging once, and
+            records each repetition in its own run. "single_run" does the
+            setup and staging once, and records all repetitions in one run,
+            with the index of each repetition in the "repeat_index" field of
+            the primary stream, and baselines only at the start and end of
+            the run. By default "full"
         """
-        if repeat > 1:
+        if repeat_mode not in _repeat_modes:
+            raise ValueError(
+                f"repeat_mode must be one of {_repeat_modes}, not {repeat_mode!r}"
+            )
+        if repeat > 1 and repeat_mode != "full":
+            plan = _shared_repeat(func, repeat, repeat_mode)
+            return (yield from plan(*args, **kwargs))
+        elif repeat > 1:
             repeat_uid = str(uuid.uuid4())
             return_list = []
             for i in range(repeat):
@@ -1,4 +1,3 @@
-from bluesky_live.bluesky_run import BlueskyRun, DocumentCache
 import bluesky.preprocessors as bpp
 from .preprocessors import run_return_decorator
 from bluesky.plan_stubs import mv, mvr, trigger_and_read
@@ -6,11 +5,12 @@ import numpy as np
 
 from nbs_bl.plans.flyscan_base import fly_scan
 from .scan_decorators import wrap_plan_name
-import pandas as pd
 from typing import List
 
 
 def process_fly_scan(run, signal_names=None, time_offsets=None):
+    import pandas as pd
+
     if time_offsets is None:
         time_offsets = {}
 
@@ -161,6 +161,8 @@ def fly_max(
     }
     _md.update(md or {})
 
+    from bluesky_live.bluesky_run import BlueskyRun, DocumentCache
+
     dc = DocumentCache()
 
     @bpp.subs_decorator(dc)
@@ -193,6 +195,8 @@ def find_max(
     """
     invert turns find_max into find_min
     """
+    from bluesky_live.bluesky_run import BlueskyRun, DocumentCache
+
     dc = DocumentCache()
 
     md = md or {}
@@ -243,6 +247,8 @@ def find_min(plan, dets, *args):
 
 
 def find_max_deriv(plan, dets, *args, max_channel=None):
+    from bluesky_live.bluesky_run import BlueskyRun, DocumentCache
+
     dc = DocumentCache()
 
     @bpp.subs_decorator(dc)
@@ -282,6 +288,8 @@ def find_halfmax(plan, dets, *args, max_channel=None, **kwargs):
     the motor value where the detector is half of the maximum
     value
     """
+    from bluesky_live.bluesky_run import BlueskyRun, DocumentCache
+
     dc = DocumentCache()
 
     @bpp.subs_decorator(dc)
@@ -0,0 +1,164 @@
+"""
+Setup steps that compose into a single scan pipeline.
+
+A plain plan decorator wraps its plan in one more generator, so that every
+message of a scan passes through one frame per decorator. Plan decorators
+made with `setup_step` instead compose with each other: a stack of them
+becomes one generator that runs all setup steps in order, and then yields
+from the inner plan directly.
+
+Steps that move devices can be declared with ``moves=True``. If a move
+stage policy is set, with `set_move_stage_policy`, the moves of adjacent
+move steps are collected instead of being done one after the other, and
+are then done concurrently, in the stages given by the policy.
+"""
+
+import inspect
+from functools import partial
+from bluesky import Msg
+from bluesky.utils import short_uid
+from ..utils import merge_func
+
+# Called when a pipeline starts. Returns None to do setup moves one after
+# the other, or a function that gives the stage of each moved device.
+_move_stage_policy = None
+
+
+def set_move_stage_policy(policy):
+    """
+    Set how the setup moves of a pipeline are combined.
+
+    Parameters
+    ----------
+    policy : callable or None
+        Called without arguments each time a pipeline runs. It returns None
+        to do setup moves in sequence, as the steps request them, or a
+        function ``stage(obj)`` that returns the stage of a moved device.
+        All moves of a stage are done concurrently, and stages are done in
+        ascending order. If the policy is None, moves are done in sequence
+    """
+    global _move_stage_policy
+    _move_stage_policy = policy
+
+
+def _collect_moves(plan, moves):
+    """
+    Run a setup step, collecting its set messages instead of yielding them.
+
+    Every set message is collected, whatever its device, and answered with
+    None. Waits for the groups of collected sets are dropped as well.
+    """
+    groups = set()
+    response = None
+    exception = None
+    while True:
+        try:
+            if exception is not None:
+                msg = plan.throw(exception)
+            else:
+                msg = plan.send(response)
+        except StopIteration as e:
+            return e.value
+        response = None
+        exception = None
+        if msg.command == "set":
+            moves.append(msg)
+            groups.add(msg.kwargs.get("group", None))
+        elif msg.command == "wait" and msg.kwargs.get("group", None) in groups:
+            pass
+        else:
+            try:
+                response = yield msg
+            except GeneratorExit:
+                plan.close()
+                raise
+            except Exception as e:
+                exception = e
+
+
+def _move_in_stages(moves, stage):
+    """Do collected moves concurrently, one stage after the other."""
+    stages = {}
+    for msg in moves:
+        # A later move of the same device replaces the earlier one
+        stages.setdefault(stage(msg.obj), {})[id(msg.obj)] = msg
+    for n in sorted(stages):
+        group = short_uid("setup_moves")
+        for msg in stages[n].values():
+            yield msg._replace(kwargs=dict(msg.kwargs, group=group))
+        yield Msg("wait", None, group=group)
+
+
+def _run_pipeline(steps, target):
+    def pipeline(*args, **kwargs):
+        stage = _move_stage_policy() if _move_stage_policy is not None else None
+        moves = []
+        for step, is_plan, step_moves in steps:
+            if moves and not step_moves:
+                yield from _move_in_stages(moves, stage)
+                moves = []
+            if not is_plan:
+                args, kwargs = step(*args, **kwargs)
+            elif step_moves and stage is not None:
+                args, kwargs = yield from _collect_moves(step(*args, **kwargs), moves)
+            else:
+                args, kwargs = yield from step(*args, **kwargs)
+        if moves:
+            yield from _move_in_stages(moves, stage)
+        return (yield from target(*args, **kwargs))
+
+    return pipeline
+
+
+def setup_step(step=None, *, omit_params=[], moves=False):
+    """
+    Make a plan decorator from a setup step.
+
+    The step is called with the arguments of the plan, and takes its own
+    keyword parameters like the wrapper of a plan decorator would. It may
+    yield setup messages, and returns the ``(args, kwargs)`` to call the
+    inner plan with. The signature and docstring of the step are merged into
+    the decorated plan with `merge_func`.
+
+    Parameters
+    ----------
+    step : callable
+        The setup step, a function or generator function
+    omit_params : list of str, optional
+        Parameters of the inner plan to omit from the merged signature, e.g.
+        the ones that the step provides
+    moves : bool, optional
+        If True, the moves that the step requests may be combined with the
+        moves of other steps, see `set_move_stage_policy`. The step must not
+        depend on its moves being done before it returns. While moves are
+        combined, every ``set`` message of the step is collected as a move,
+        and waits on the groups of those sets are dropped, so a step with
+        moves=True should only set devices that it moves. The responses to
+        the collected sets are None, instead of a Status
+
+    Returns
+    -------
+    callable
+        A plan decorator
+    """
+    if step is None:
+        return partial(setup_step, omit_params=omit_params, moves=moves)
+    is_plan = inspect.isgeneratorfunction(step)
+
+    def decorator(func):
+        pipeline = getattr(func, "_pipeline", None)
+        if pipeline is not None and pipeline[0] is func:
+            # Compose with the steps of the pipeline below
+            steps = [(step, is_plan, moves)] + pipeline[1]
+            target = pipeline[2]
+        else:
+            steps = [(step, is_plan, moves)]
+            target = func
+        wrapper = _run_pipeline(steps, target)
+        wrapper.__signature__ = inspect.signature(step)
+        wrapper.__doc__ = step.__doc__
+        wrapper = merge_func(func, omit_params)(wrapper)
+        wrapper._pipeline = (wrapper, steps, target)
+        return wrapper
+
+    return decorator
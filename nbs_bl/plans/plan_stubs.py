@@ -1,8 +1,12 @@
 from ..beamline import GLOBAL_BEAMLINE
 from ..help import add_to_plan_list
+from ..run_engine import status_done
+from ..state_cache import GLOBAL_STATE_CACHE, is_at_position
 import warnings
 from bluesky import Msg
 from bluesky.plan_stubs import rd, sleep, mv
+from bluesky.protocols import Status
+from functools import partial
 import time
 from typing import Optional
 
@@ -14,6 +18,90 @@ def call_obj(obj, method, *args, **kwargs):
     return ret
 
 
+def _skip_unchanged():
+    return GLOBAL_BEAMLINE.get_setup_settings()["skip_unchanged"]
+
+
+def _setup_tolerance(device):
+    tolerances = GLOBAL_BEAMLINE.get_setup_settings()["tolerances"]
+    # Keys are device keys or roles, like move_order, or else device names
+    for name, tolerance in tolerances.items():
+        if name in GLOBAL_BEAMLINE.devices:
+            if GLOBAL_BEAMLINE.devices[name] is device:
+                return tolerance
+        elif name in GLOBAL_BEAMLINE.roles:
+            if getattr(GLOBAL_BEAMLINE, name, None) is device:
+                return tolerance
+    if device.name in tolerances:
+        return tolerances[device.name]
+    tolerance = getattr(device, "tolerance", None)
+    if tolerance is not None and hasattr(tolerance, "get"):
+        tolerance = tolerance.get()
+    if isinstance(tolerance, (int, float)):
+        return tolerance
+    return 0
+
+
+def move_if_changed(device, position):
+    """
+    Move a device, unless it is already within tolerance of the position.
+
+    Moves are only skipped if ``skip_unchanged`` is set in [settings.setup].
+    The tolerance of a device is taken from [settings.setup.tolerances], by
+    device key, role or device name, or from its ``tolerance`` attribute,
+    and is 0 otherwise.
+    """
+    if _skip_unchanged() and is_at_position(
+        device, position, _setup_tolerance(device)
+    ):
+        print(f"Skipping move of {device.name}, already at {position}")
+        return ()
+    return (yield from mv(device, position))
+
+
+def _call_detectors(detectors, method, *args):
+    """
+    Call a configuration method of detectors, skipping unchanged ones.
+
+    All detectors are called before any of them is waited on, so detectors
+    whose methods return a Status are configured concurrently. Detectors
+    with a ``start_<method>`` method, which returns a Status instead of
+    blocking, are called with it instead. Failures are reported for each
+    detector, and do not stop the other detectors.
+    """
+    skip = _skip_unchanged()
+    skipped = []
+    errors = []
+    pending = []
+    for d in detectors:
+        try:
+            call = f"start_{method}" if hasattr(d, f"start_{method}") else method
+            if hasattr(d, call):
+                if skip and GLOBAL_STATE_CACHE.is_current(d, method, *args):
+                    skipped.append(d.name)
+                else:
+                    ret = yield from call_obj(d, call, *args)
+                    if isinstance(ret, Status):
+                        pending.append((d, ret))
+        except RuntimeError as ex:
+            errors.append((d, ex))
+    # Statuses are not added to a wait group, where the first failure would be
+    # raised into the plan, and are checked one by one instead
+    if pending:
+        yield Msg(
+            "wait_for", None, [partial(status_done, status) for _, status in pending]
+        )
+    for d, status in pending:
+        if not status.success:
+            errors.append((d, status.exception()))
+    arguments = ", ".join(repr(arg) for arg in args)
+    if skipped:
+        print(f"Skipping unchanged {method}({arguments}) for {', '.join(skipped)}")
+    if errors:
+        report = "; ".join(f"{d.name}: {ex!r}" for d, ex in errors)
+        warnings.warn(f"{method}({arguments}) failed for {report}", RuntimeWarning)
+
+
 def sampleholder_move_sample_old(sampleholder, sample_id=None, **position):
     """
     Set and move a sample. Dangerous! Sample moves really need to go through Bluesky's mv plan,
@@ -30,8 +118,11 @@ def sampleholder_move_sample(sampleholder, sample_id=None, **position):
         sampleholder, "get_sample_position", sample_id, **position
     )
     print(f"Moving {sampleholder.name} to {positions}")
-    yield from mv(sampleholder, positions)
-    print("Done Moving ", sampleholder.name)
+    statuses = yield from move_if_changed(sampleholder, positions)
+    # Skipped moves have no statuses, and moves that a setup pipeline collects
+    # to do later have None
+    if statuses and all(status is not None for status in statuses):
+        print("Done Moving ", sampleholder.name)
 
 
 def sampleholder_set_sample(sampleholder, sample_id):
@@ -49,42 +140,24 @@ def set_exposure(time: Optional[float] = None, extra_dets=[]):
         GLOBAL_EXPOSURE_TIME = time
 
     all_dets = GLOBAL_BEAMLINE.detectors.active + extra_dets
-    for d in all_dets:
-        try:
-            if hasattr(d, "set_exposure"):
-                yield from call_obj(d, "set_exposure", GLOBAL_EXPOSURE_TIME)
-        except RuntimeError as ex:
-            warnings.warn(repr(ex), RuntimeWarning)
+    yield from _call_detectors(all_dets, "set_exposure", GLOBAL_EXPOSURE_TIME)
 
 
 @add_to_plan_list
 def set_roi(label, llim, ulim):
-    for d in GLOBAL_BEAMLINE.detectors.active:
-        try:
-            if hasattr(d, "set_roi"):
-                yield from call_obj(d, "set_roi", label, llim, ulim)
-        except RuntimeError as ex:
-            warnings.warn(repr(ex), RuntimeWarning)
+    yield from _call_detectors(
+        GLOBAL_BEAMLINE.detectors.active, "set_roi", label, llim, ulim
+    )
 
 
 @add_to_plan_list
 def clear_all_rois():
-    for d in GLOBAL_BEAMLINE.detectors.active:
-        try:
-            if hasattr(d, "clear_all_rois"):
-                yield from call_obj(d, "clear_all_rois")
-        except RuntimeError as ex:
-            warnings.warn(repr(ex), RuntimeWarning)
+    yield from _call_detectors(GLOBAL_BEAMLINE.detectors.active, "clear_all_rois")
 
 
 @add_to_plan_list
 def clear_one_roi(label):
-    for d in GLOBAL_BEAMLINE.detectors.active:
-        try:
-            if hasattr(d, "clear_roi"):
-                yield from call_obj(d, "clear_roi", label)
-        except RuntimeError as ex:
-            warnings.warn(repr(ex), RuntimeWarning)
+    yield from _call_detectors(GLOBAL_BEAMLINE.detectors.active, "clear_roi", label)
 
 
 def wait_for_signal_below(
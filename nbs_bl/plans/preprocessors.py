@@ -3,7 +3,7 @@ from bluesky.utils import RunEngineControlException, make_decorator
 from bluesky.preprocessors import contingency_wrapper
 from functools import wraps
 from ..utils import merge_func
-from copy import deepcopy
+from .pipeline import setup_step
 import inspect
 import uuid
 from typing import Optional
@@ -27,50 +27,69 @@ def sanitize(arg):
 
 
 def plan_md_decorator(plan_function):
+    # Inspected once, so that each call only costs O(number of arguments)
+    signature = inspect.signature(plan_function)
+    plan_name = plan_function.__name__
+    defaults = {
+        p.name: p.default
+        for p in signature.parameters.values()
+        if p.default is not p.empty
+    }
+    kinds = {p.name: p.kind for p in signature.parameters.values()}
+
+    def record_arguments(args, kwargs):
+        arguments = dict(defaults)
+        try:
+            bound = signature.bind_partial(*args, **kwargs)
+        except TypeError:
+            # The signature does not match the call, e.g. a signature that was
+            # set by a decorator, so positional arguments are matched by name
+            for a, n in zip(args, plan_function.__code__.co_varnames):
+                arguments[n] = sanitize(a)
+            for k, v in kwargs.items():
+                arguments[k] = sanitize(v)
+            return arguments
+        for name, value in bound.arguments.items():
+            if kinds[name] == inspect.Parameter.VAR_KEYWORD:
+                for k, v in value.items():
+                    arguments[k] = sanitize(v)
+            elif kinds[name] == inspect.Parameter.VAR_POSITIONAL:
+                arguments[name] = sanitize(list(value))
+            else:
+                arguments[name] = sanitize(value)
+        return arguments
+
     @wraps(plan_function)
     def _inner(*args, md: Optional[dict] = None, plan_level=0, **kwargs):
-        plan_name = plan_function.__name__
         md = md or {}
         _md = {}
-        arguments = {}
-        s = inspect.signature(plan_function)
-        for p in s.parameters.values():
-            if p.default is not s.empty:
-                arguments[p.name] = p.default
-
-        for a, n in zip(args, plan_function.__code__.co_varnames):
-            arguments[n] = sanitize(a)
-        for k, v in kwargs.items():
-            arguments[k] = sanitize(v)
-        if "md" in arguments:
-            del arguments["md"]
+        arguments = record_arguments(args, kwargs)
+        arguments.pop("md", None)
 
         _md["plan_history"] = []
         if plan_level == 0:
             _md["master_plan"] = plan_name
             _md["batch_uid"] = str(uuid.uuid4())
-        _md.update(deepcopy(md))
-        _md["plan_history"].append(
+        # Share the values of md, only the history list is extended
+        _md.update(md)
+        _md["plan_history"] = _md["plan_history"] + [
             {"plan_name": plan_name, "arguments": arguments, "plan_level": plan_level}
-        )
+        ]
         return plan_function(*args, md=_md, plan_level=plan_level + 1, **kwargs)
 
     return _inner
 
 
 def wrap_metadata(param):
-    def decorator(func):
-        @merge_func(func)
-        def inner(*args, md: Optional[dict] = None, **kwargs):
-            md = md or {}
-            _md = {}
-            _md.update(param)
-            _md.update(md)
-            return (yield from func(*args, md=_md, **kwargs))
-
-        return inner
-
-    return decorator
+    @setup_step
+    def inner(*args, md: Optional[dict] = None, **kwargs):
+        md = md or {}
+        _md = {}
+        _md.update(param)
+        _md.update(md)
+        return args, dict(kwargs, md=_md)
+
+    return inner
 
 
 def run_return_wrapper(plan, *, md: Optional[dict] = None):
@@ -6,17 +6,23 @@ from ..detectors import (
     activate_detector_set,
 )
 from ..utils import merge_func
-from .plan_stubs import set_exposure, sampleholder_set_sample, sampleholder_move_sample
-from bluesky.plan_stubs import mv, trigger_and_read, declare_stream
+from .plan_stubs import (
+    set_exposure,
+    sampleholder_set_sample,
+    sampleholder_move_sample,
+    move_if_changed,
+)
+from ..baseline import baseline_wrapper
 from bluesky.utils import separate_devices
-from bluesky.preprocessors import stage_wrapper, plan_mutator, set_run_key_wrapper
+from bluesky.preprocessors import stage_wrapper
 from .preprocessors import wrap_metadata
 from .suspenders import dynamic_suspenders
+from .pipeline import setup_step, set_move_stage_policy
 from .groups import repeat
 
 # from ..settings import settings
 from typing import Optional
-from importlib.metadata import entry_points
+from ..entrypoints import GLOBAL_ENTRY_POINTS
 from functools import reduce
 from datetime import datetime
 
@@ -28,6 +34,44 @@ def wrap_scantype(scantype):
     return decorator
 
 
+def _setup_move_stages():
+    """
+    Move stage policy of the setup pipeline, from [settings.setup].
+
+    Returns
+    -------
+    callable or None
+        None if setup moves are done in sequence, otherwise a function that
+        returns the stage of a device in ``move_order``, or 0 if it is not
+        listed. Names in ``move_order`` are device keys, or attributes of
+        the beamline such as roles
+    """
+    settings = GLOBAL_BEAMLINE.get_setup_settings()
+    if not settings["concurrent_moves"]:
+        return None
+    stages = {}
+    for n, names in enumerate(settings["move_order"]):
+        for name in names:
+            if name in GLOBAL_BEAMLINE.devices:
+                device = GLOBAL_BEAMLINE.devices[name]
+            else:
+                device = getattr(GLOBAL_BEAMLINE, name, None)
+            if device is not None:
+                stages[id(device)] = n
+
+    def stage(obj):
+        while obj is not None:
+            if id(obj) in stages:
+                return stages[id(obj)]
+            obj = getattr(obj, "parent", None)
+        return 0
+
+    return stage
+
+
+set_move_stage_policy(_setup_move_stages)
+
+
 def _beamline_setup(func):
     blconf = GLOBAL_BEAMLINE.config.get("configuration", {})
     if blconf.get("has_slits", False):
@@ -41,121 +85,106 @@ def _beamline_setup(func):
     return func
 
 
-def _eref_setup(func):
-    @merge_func(func)
-    def _inner(
-        *args, eref_sample: Optional[str] = None, md: Optional[dict] = None, **kwargs
-    ):
-        """
-        Parameters
-        ----------
-        eref_sample : str, optional
-            The energy reference sample. If given, the selected reference sample is set
-        """
-        md = md or {}
-        _md = {}
-        blconf = GLOBAL_BEAMLINE.config.get("configuration", {})
-        if eref_sample is not None and blconf.get("has_motorized_eref", False):
-            yield from sampleholder_move_sample(
-                GLOBAL_BEAMLINE.reference_sampleholder, eref_sample
-            )
-
-            _md.update({"reference_sample": eref_sample})
-        _md.update(md)
-        return (yield from func(*args, md=_md, **kwargs))
-
-    return _inner
-
-
-def _sample_setup_with_move(func):
-    @merge_func(func)
-    def _inner(
-        *args,
-        sample: Optional[str] = None,
-        sample_position: Optional[dict] = {},
-        **kwargs,
-    ):
-        """
-        Parameters
-        ----------
-        sample : str, optional
-            The sample id. If given, the selected sample metadata is set
-        sample_position: dict, optional
-            A dictionary of positions relative to the sample center. Parameters not given will be assumed to
-            be the default for the sampleholder (typically moving the sample into the beam at a typical angle)
-        """
-        if sample is not None:
-            yield from sampleholder_move_sample(
-                GLOBAL_BEAMLINE.primary_sampleholder, sample, **sample_position
-            )
-        return (yield from func(*args, **kwargs))
-
-    return _inner
-
-
-def _sample_setup_no_move(func):
-    @merge_func(func)
-    def _inner(*args, sample=None, **kwargs):
-        """
-        Parameters
-        ----------
-        sample : str, optional
-            The sample id. If given, the selected sample metadata is set, but the sample is not moved
-        """
-        if sample is not None:
-            yield from sampleholder_set_sample(
-                GLOBAL_BEAMLINE.primary_sampleholder, sample
-            )
-        return (yield from func(*args, **kwargs))
+@setup_step(moves=True)
+def _eref_setup(
+    *args, eref_sample: Optional[str] = None, md: Optional[dict] = None, **kwargs
+):
+    """
+    Parameters
+    ----------
+    eref_sample : str, optional
+        The energy reference sample. If given, the selected reference sample is set
+    """
+    md = md or {}
+    _md = {}
+    blconf = GLOBAL_BEAMLINE.config.get("configuration", {})
+    if eref_sample is not None and blconf.get("has_motorized_eref", False):
+        yield from sampleholder_move_sample(
+            GLOBAL_BEAMLINE.reference_sampleholder, eref_sample
+        )
 
-    return _inner
+        _md.update({"reference_sample": eref_sample})
+    _md.update(md)
+    return args, dict(kwargs, md=_md)
 
 
-def _slit_setup(func):
-    @merge_func(func)
-    def _inner(*args, eslit: Optional[float] = None, **kwargs):
-        """
-        Parameters
-        ----------
-        eslit : float, optional
-            If not None, will set the beamline exit slit prior to the plan start.
-        """
-        if eslit is not None:
-            yield from mv(GLOBAL_BEAMLINE.slits, eslit)
-        return (yield from func(*args, **kwargs))
+@setup_step(moves=True)
+def _sample_setup_with_move(
+    *args,
+    sample: Optional[str] = None,
+    sample_position: Optional[dict] = {},
+    **kwargs,
+):
+    """
+    Parameters
+    ----------
+    sample : str, optional
+        The sample id. If given, the selected sample metadata is set
+    sample_position: dict, optional
+        A dictionary of positions relative to the sample center. Parameters not given will be assumed to
+        be the default for the sampleholder (typically moving the sample into the beam at a typical angle)
+    """
+    if sample is not None:
+        yield from sampleholder_move_sample(
+            GLOBAL_BEAMLINE.primary_sampleholder, sample, **sample_position
+        )
+    return args, kwargs
 
-    return _inner
 
+@setup_step
+def _sample_setup_no_move(*args, sample=None, **kwargs):
+    """
+    Parameters
+    ----------
+    sample : str, optional
+        The sample id. If given, the selected sample metadata is set, but the sample is not moved
+    """
+    if sample is not None:
+        yield from sampleholder_set_sample(GLOBAL_BEAMLINE.primary_sampleholder, sample)
+    return args, kwargs
 
-def _energy_setup(func):
-    @merge_func(func)
-    def _inner(
-        *args,
-        energy: Optional[float] = None,
-        polarization: Optional[float] = None,
-        **kwargs,
-    ):
-        """
-        Parameters
-        ----------
-        energy : float, optional
-            If not None, will set the beamline energy prior to the plan start.
-        """
-        if energy is not None:
-            yield from mv(GLOBAL_BEAMLINE.energy, energy)
-        if polarization is not None and hasattr(GLOBAL_BEAMLINE, "polarization"):
-            yield from mv(GLOBAL_BEAMLINE.polarization, polarization)
-        return (yield from func(*args, **kwargs))
 
-    return _inner
+@setup_step(moves=True)
+def _slit_setup(*args, eslit: Optional[float] = None, **kwargs):
+    """
+    Parameters
+    ----------
+    eslit : float, optional
+        If not None, will set the beamline exit slit prior to the plan start.
+    """
+    if eslit is not None:
+        yield from move_if_changed(GLOBAL_BEAMLINE.slits, eslit)
+    return args, kwargs
+
+
+@setup_step(moves=True)
+def _energy_setup(
+    *args,
+    energy: Optional[float] = None,
+    polarization: Optional[float] = None,
+    **kwargs,
+):
+    """
+    Parameters
+    ----------
+    energy : float, optional
+        If not None, will set the beamline energy prior to the plan start.
+    """
+    if energy is not None:
+        yield from move_if_changed(GLOBAL_BEAMLINE.energy, energy)
+    if polarization is not None and hasattr(GLOBAL_BEAMLINE, "polarization"):
+        yield from move_if_changed(GLOBAL_BEAMLINE.polarization, polarization)
+    return args, kwargs
 
 
-def staged_baseline_wrapper(plan, devices, name="staged_baseline"):
+def staged_baseline_wrapper(
+    plan, devices, name="staged_baseline", monitor=False, change_only=False
+):
     """
     Preprocessor that records a baseline of all `devices` after `open_run`
 
-    The readings are designated for a separate event stream named 'baseline' by
-    default.
+    The readings are designated for a separate event stream named
+    'staged_baseline' by default.
 
     Parameters
     ----------
@@ -165,41 +194,24 @@ def staged_baseline_wrapper(plan, devices, name="staged_baseline"):
         collection of Devices to read
         If None, the plan passes through unchanged.
     name : string, optional
-        name for event stream; by default, 'baseline'
+        name for event stream; by default, 'staged_baseline'
+    monitor : bool, optional
+        If True, record the monitored values of the devices instead of
+        triggering and reading them, see :class:`nbs_bl.baseline.MonitoredReadable`
+    change_only : bool, optional
+        If True, only record the values that differ from the last full
+        baseline, see :func:`nbs_bl.baseline.baseline_wrapper`
 
     Yields
     ------
     msg : Msg
         messages from plan, with 'set' messages inserted
     """
-
-    def head():
-        yield from declare_stream(*devices, name=name)
-        yield from trigger_and_read(devices, name=name)
-
-    def tail():
-        yield from trigger_and_read(devices, name=name)
-
-    def insert_baseline(msg):
-        if msg.command == "open_run":
-            if msg.run is not None:
-                return None, set_run_key_wrapper(head(), msg.run)
-            else:
-                return None, head()
-
-        elif msg.command == "close_run":
-            if msg.run is not None:
-                return set_run_key_wrapper(tail(), msg.run), None
-            else:
-                return tail(), None
-
-        return None, None
-
-    if not devices:
-        # no-op
-        return (yield from plan)
-    else:
-        return (yield from plan_mutator(plan, insert_baseline))
+    return (
+        yield from baseline_wrapper(
+            plan, devices, name=name, monitor=monitor, change_only=change_only
+        )
+    )
 
 
 def _nbs_setup_detectors_with_baseline(func):
@@ -238,8 +250,15 @@ def _nbs_setup_detectors_with_baseline(func):
         def inner():
             yield from func(all_dets, *args, **kwargs)
 
+        baseline_settings = GLOBAL_BEAMLINE.get_baseline_settings()
         ret = yield from stage_wrapper(
-            staged_baseline_wrapper(inner(), staged_baseline_devices), devices_to_stage
+            staged_baseline_wrapper(
+                inner(),
+                staged_baseline_devices,
+                monitor=baseline_settings["monitor"],
+                change_only=baseline_settings["change_only"],
+            ),
+            devices_to_stage,
         )
 
         # for det in extra_dets:
@@ -250,140 +269,126 @@ def _nbs_setup_detectors_with_baseline(func):
     return _inner
 
 
-def _nbs_setup_detectors(func):
-    @merge_func(func, ["detectors"])
-    def _inner(*args, extra_dets=[], dwell: Optional[float] = None, **kwargs):
-        """
-        Parameters
-        ----------
-        extra_dets : list, optional
-            A list of extra detectors to be activated for the scan, by default [].
-        dwell : float, optional
-            The exposure time in seconds for all detectors, by default None.
-            If None, do not set any exposure time, and assume that detectors are already set
-        """
-
-        # for det in extra_dets:
-        #    activate_detector(det)
-        print("Detector Setup Decorator")
-        if dwell is not None:
-            yield from set_exposure(dwell, extra_dets=extra_dets)
-        all_dets = GLOBAL_BEAMLINE.detectors.active + extra_dets
-        ret = yield from func(all_dets, *args, **kwargs)
-
-        # for det in extra_dets:
-        #    deactivate_detector(det)
-
-        return ret
-
-    return _inner
-
+@setup_step(omit_params=["detectors"])
+def _nbs_setup_detectors(*args, extra_dets=[], dwell: Optional[float] = None, **kwargs):
+    """
+    Parameters
+    ----------
+    extra_dets : list, optional
+        A list of extra detectors to be activated for the scan, by default [].
+    dwell : float, optional
+        The exposure time in seconds for all detectors, by default None.
+        If None, do not set any exposure time, and assume that detectors are already set
+    """
 
-def _nbs_add_plot_md(func):
-    @merge_func(func)
-    def _inner(*args, md: Optional[dict] = None, plot_detectors: list = None, **kwargs):
-        md = md or {}
-        plot_hints = {}
-        if plot_detectors is not None:
-            activate_detector_set(plot_detectors)
-        plot_hints = GLOBAL_BEAMLINE.detectors.get_plot_hints()
-        _md = {"plot_hints": plot_hints}
+    # for det in extra_dets:
+    #    activate_detector(det)
+    print("Detector Setup Decorator")
+    if dwell is not None:
+        yield from set_exposure(dwell, extra_dets=extra_dets)
+    all_dets = GLOBAL_BEAMLINE.detectors.active + extra_dets
+    return (all_dets,) + args, kwargs
+
+
+@setup_step
+def _nbs_add_plot_md(
+    *args, md: Optional[dict] = None, plot_detectors: list = None, **kwargs
+):
+    md = md or {}
+    plot_hints = {}
+    if plot_detectors is not None:
+        activate_detector_set(plot_detectors)
+    plot_hints = GLOBAL_BEAMLINE.detectors.get_plot_hints()
+    _md = {"plot_hints": plot_hints}
+    _md.update(md)
+    return args, dict(kwargs, md=_md)
+
+
+@setup_step
+def _nbs_add_sample_md(*args, md: Optional[dict] = None, **kwargs):
+    """
+    Sample information is automatically added to the run md
+    """
+    md = md or {}
+    if hasattr(GLOBAL_BEAMLINE, "current_sample"):
+        _md = {
+            "sample_name": GLOBAL_BEAMLINE.current_sample.get("name", ""),
+            "sample_id": GLOBAL_BEAMLINE.current_sample.get("sample_id", ""),
+            "sample_desc": GLOBAL_BEAMLINE.current_sample.get("description", ""),
+            "sample_set": GLOBAL_BEAMLINE.current_sample.get("group", ""),
+            "sample_info": {
+                k: v
+                for k, v in GLOBAL_BEAMLINE.current_sample.items()
+                if k not in ["name", "sample_id", "description", "group"]
+            },
+        }
         _md.update(md)
-        return (yield from func(*args, md=_md, **kwargs))
-
-    return _inner
-
-
-def _nbs_add_sample_md(func):
-    @merge_func(func)
-    def _inner(*args, md: Optional[dict] = None, **kwargs):
-        """
-        Sample information is automatically added to the run md
-        """
-        md = md or {}
-        if hasattr(GLOBAL_BEAMLINE, "current_sample"):
-            _md = {
-                "sample_name": GLOBAL_BEAMLINE.current_sample.get("name", ""),
-                "sample_id": GLOBAL_BEAMLINE.current_sample.get("sample_id", ""),
-                "sample_desc": GLOBAL_BEAMLINE.current_sample.get("description", ""),
-                "sample_set": GLOBAL_BEAMLINE.current_sample.get("group", ""),
-                "sample_info": {
-                    k: v
-                    for k, v in GLOBAL_BEAMLINE.current_sample.items()
-                    if k not in ["name", "sample_id", "description", "group"]
-                },
-            }
-            _md.update(md)
-            return (yield from func(*args, md=_md, **kwargs))
-        else:
-            return (yield from func(*args, md=md, **kwargs))
-
-    return _inner
-
+        return args, dict(kwargs, md=_md)
+    else:
+        return args, dict(kwargs, md=md)
 
-def _nbs_add_comment(func):
-    @merge_func(func)
-    def _inner(
-        *args,
-        md: Optional[dict] = None,
-        comment: Optional[str] = None,
-        group_name: Optional[str] = None,
-        **kwargs,
-    ):
-        """
-        Parameters
-        ----------
-        comment : str, optional
-            A comment that will be added into the run metadata. If not provided, no comment will be added.
-        group_name : str, optional
-            A group name label that will be added into the run metadata.
-        """
-        md = md or {}
-        if comment is not None:
-            _md = {"comment": comment}
-        else:
-            _md = {}
-        if group_name is not None:
-            _md["group_name"] = group_name
-        _md.update(md)
-        return (yield from func(*args, md=_md, **kwargs))
 
-    return _inner
+@setup_step
+def _nbs_add_comment(
+    *args,
+    md: Optional[dict] = None,
+    comment: Optional[str] = None,
+    group_name: Optional[str] = None,
+    **kwargs,
+):
+    """
+    Parameters
+    ----------
+    comment : str, optional
+        A comment that will be added into the run metadata. If not provided, no comment will be added.
+    group_name : str, optional
+        A group name label that will be added into the run metadata.
+    """
+    md = md or {}
+    if comment is not None:
+        _md = {"comment": comment}
+    else:
+        _md = {}
+    if group_name is not None:
+        _md["group_name"] = group_name
+    _md.update(md)
+    return args, dict(kwargs, md=_md)
 
 
 def nbs_base_scan_decorator(func):
-    @repeat
-    @_nbs_add_plan_args
-    @_beamline_setup
-    @_nbs_setup_detectors
-    @_nbs_add_sample_md
-    @_nbs_add_plot_md
-    @_nbs_add_comment
-    @merge_func(func)
-    def _inner(*args, **kwargs):
-        return (yield from func(*args, **kwargs))
-
-    return _inner
+    # The setup steps compose into a single pipeline that yields from func directly
+    decorators = [
+        _nbs_add_comment,
+        _nbs_add_plot_md,
+        _nbs_add_sample_md,
+        _nbs_setup_detectors,
+        _beamline_setup,
+        _nbs_add_plan_args,
+        repeat,
+    ]
+    return reduce(lambda f, dec: dec(f), decorators, func)
 
 
 def _nbs_add_plan_args(func):
-    @merge_func(func)
-    def _inner(*args, md: Optional[dict] = None, **kwargs):
+    plan_name = func.__name__
+
+    @setup_step
+    def _plan_args(*args, md: Optional[dict] = None, **kwargs):
         md = md or {}
         _md = {}
         _md.update(md)
         _md.update(
             {
-                "plan_passed_name": func.__name__,
+                "plan_passed_name": plan_name,
                 # Don't have a way to normalize args and kwargs, copy.deepcopy is dangerous
                 # "plan_passed_args": args,
                 # "plan_passed_kwargs": kwargs,
                 "time_human": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             }
         )
-        return (yield from func(*args, md=_md, **kwargs))
+        return args, dict(kwargs, md=_md)
 
-    return _inner
+    return _plan_args(func)
 
 
 """
@@ -438,13 +443,14 @@ def get_decorator_entrypoints():
 
     decorators = []
     if decorator_entrypoints:
-        eps = entry_points()
         for ep_name in decorator_entrypoints:
             try:
                 # Look for entrypoint in nbs_bl.plan_decorators group
-                matches = eps.select(group="nbs_bl.plan_decorators", name=ep_name)
+                matches = GLOBAL_ENTRY_POINTS.select(
+                    "nbs_bl.plan_decorators", ep_name
+                )
                 for match in matches:
-                    decorator = match.load()
+                    decorator = GLOBAL_ENTRY_POINTS.load(match)
                     decorators.append(decorator)
             except Exception as e:
                 print(f"Failed to load decorator {ep_name}: {e}")
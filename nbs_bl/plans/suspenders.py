@@ -1,5 +1,5 @@
 from ..utils import merge_func
-from importlib.metadata import entry_points
+from ..entrypoints import GLOBAL_ENTRY_POINTS
 from bluesky.preprocessors import finalize_wrapper
 from bluesky.suspenders import SuspenderBase
 from bluesky import Msg
@@ -20,15 +20,15 @@ def get_suspender_entrypoints():
     print(f"Suspender entrypoints: {suspender_entrypoints}")
     suspenders = []
     if suspender_entrypoints:
-        eps = entry_points()
-
         for ep_name in suspender_entrypoints:
             try:
                 # Look for entrypoint in nbs_bl.suspenders group
-                matches = eps.select(group="nbs_bl.suspenders", name=ep_name)
+                matches = GLOBAL_ENTRY_POINTS.select(
+                    "nbs_bl.suspenders", ep_name
+                )
                 for match in matches:
                     print(f"Loading suspender {match.name}")
-                    suspender = match.load()
+                    suspender = GLOBAL_ENTRY_POINTS.load(match)
 
                     # Handle both single suspender and list of suspenders
                     if isinstance(suspender, (list, tuple)):
@@ -1,5 +1,7 @@
 import numpy as np
 from .scan_base import _make_gscan_points
+from .dry_run import dry_run
+from ..beamline import GLOBAL_BEAMLINE
 
 """
 Time estimation functions for plan execution time calculation.
@@ -27,6 +29,11 @@ Usage Examples:
    plan_args = {"dwell_time": 2.0, "points": 100, "repeat": 3}
    time = generic_estimate("my_plan", plan_args, estimation_dict)
    # Result: (base_time * 3) + (5.0 * 2) = base_time * 3 + 10.0
+
+3. Dry run on a virtual clock, including moves, exposures and shutters:
+   estimation_dict = {"estimator": "dry_run_estimate"}
+   plan_args = {"args": ["en", 280, 300, 1], "dwell": 1}
+   time = dry_run_estimate("nbs_energy_scan", plan_args, estimation_dict)
 """
 
 
@@ -166,3 +173,33 @@ def gscan_estimate(plan_name, plan_args, estimation_dict):
     c = get_dwell(plan_args, estimation_dict)
 
     return a + b * points + c * points
+
+
+def _resolve_device_names(value):
+    """Replace names of beamline devices in plan arguments by the devices."""
+    if isinstance(value, str):
+        return GLOBAL_BEAMLINE.devices.get(value, value)
+    if isinstance(value, (list, tuple)):
+        return type(value)(_resolve_device_names(v) for v in value)
+    return value
+
+
+def dry_run_estimate(plan_name, plan_args, estimation_dict):
+    """
+    Estimate the plan time with a dry run on a virtual clock.
+
+    The plan is run against stand-ins of the beamline devices, see
+    :mod:`nbs_bl.plans.dry_run`. If the dry run fails, the estimate falls
+    back to :func:`generic_estimate`.
+    """
+    args = _resolve_device_names(plan_args.get("args", []))
+    kwargs = {
+        key: _resolve_device_names(value)
+        for key, value in plan_args.items()
+        if key != "args"
+    }
+    try:
+        return dry_run(plan_name, *args, **kwargs)["duration"]
+    except Exception as e:
+        print(f"Dry run of {plan_name} failed, using generic estimate: {e}")
+        return generic_estimate(plan_name, plan_args, estimation_dict)
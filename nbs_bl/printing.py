@@ -1,4 +1,3 @@
-from IPython.utils.coloransi import TermColors as color
 from rich import print
 import sys
 import re
@@ -0,0 +1,412 @@
+import json
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from bluesky import Msg
+from .printing import boxed_text
+
+
+class StartupProfiler:
+    """
+    Collect per-phase and per-item timings during beamline startup.
+
+    Phases are timed in the main thread and may be nested, in which case the
+    recorded name is the dotted path of the enclosing phases. Items, such as
+    individual devices, plan files or modules, are grouped by category and
+    may be timed from worker threads.
+
+    Parameters
+    ----------
+    enabled : bool, optional
+        If False, phases and items are not timed. The beamline sets this from
+        ``startup`` in [settings.profiling] once its settings are loaded
+    """
+
+    def __init__(self, enabled=True):
+        self._lock = threading.Lock()
+        self.reset(enabled)
+
+    def reset(self, enabled=True):
+        """
+        Discard all timings and restart the clock.
+
+        Parameters
+        ----------
+        enabled : bool, optional
+            Whether to time the phases and items from now on
+        """
+        self.enabled = enabled
+        self.start_time = datetime.now()
+        self._t0 = time.perf_counter()
+        self._stack = []
+        self.phases = []
+        self.items = {}
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time a startup phase.
+
+        Parameters
+        ----------
+        name : str
+            Name of the phase
+        """
+        if not self.enabled:
+            yield
+            return
+        self._stack.append(name)
+        full_name = ".".join(self._stack)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            self.phases.append(
+                {
+                    "name": full_name,
+                    "start": start - self._t0,
+                    "duration": time.perf_counter() - start,
+                }
+            )
+
+    @contextmanager
+    def item(self, category, name):
+        """
+        Time a single item within a category.
+
+        Parameters
+        ----------
+        category : str
+            Category of the item, e.g. "devices"
+        name : str
+            Name of the item, e.g. a device key
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                self.items.setdefault(category, {})[name] = duration
+
+    def report(self):
+        """
+        Build a structured report of all timings.
+
+        Returns
+        -------
+        dict
+            JSON-serializable dictionary of phases and items, with the items
+            in each category sorted from slowest to fastest
+        """
+        return {
+            "start_time": self.start_time.isoformat(),
+            "total": time.perf_counter() - self._t0,
+            "phases": sorted(self.phases, key=lambda p: p["start"]),
+            "items": {
+                category: dict(
+                    sorted(items.items(), key=lambda item: item[1], reverse=True)
+                )
+                for category, items in self.items.items()
+            },
+        }
+
+    def write_report(self, filename):
+        """
+        Write the report as JSON.
+
+        Parameters
+        ----------
+        filename : str
+            Path of the JSON file to write
+        """
+        with open(filename, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def print_summary(self, n=10):
+        """
+        Print the phase timings and the slowest items of each category.
+
+        Parameters
+        ----------
+        n : int, optional
+            Number of items to show for each category
+        """
+        report = self.report()
+        text = [f"Total: {report['total']:.2f} s", "", "Phases:"]
+        for p in report["phases"]:
+            text.append(f"{p['name']}: {p['duration']:.3f} s")
+        for category, items in report["items"].items():
+            text.append("")
+            text.append(f"Slowest {category} ({len(items)} total):")
+            for name, duration in list(items.items())[:n]:
+                text.append(f"{name}: {duration:.3f} s")
+        boxed_text("Startup profile", text, "white")
+
+
+GLOBAL_STARTUP_PROFILE = StartupProfiler()
+
+
+def import_times(module):
+    """
+    Import a module in a fresh interpreter with ``python -X importtime``.
+
+    Parameters
+    ----------
+    module : str
+        Name of the module to import
+
+    Returns
+    -------
+    dict
+        Maps each imported module name to its cumulative import time in microseconds
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+class _ProfileReadable:
+    """Readable that reports the message timings of a run as one event."""
+
+    def __init__(self, name, timings):
+        self.name = name
+        self.parent = None
+        self._timings = timings
+
+    def describe(self):
+        return {
+            key: {"source": "MessageProfiler", "dtype": "number", "shape": []}
+            for key in self._timings
+        }
+
+    def read(self):
+        now = time.time()
+        return {
+            key: {"value": value, "timestamp": now}
+            for key, value in self._timings.items()
+        }
+
+
+class _RunProfile:
+    """Message timings of a single run."""
+
+    def __init__(self):
+        self.uid = None
+        self.start = time.perf_counter()
+        self.plan_time = 0.0
+        self.messages = {}
+        self.classes = {}
+        # Devices whose statuses are waited on, by group
+        self.groups = {}
+        # True between create and save or drop
+        self.bundling = False
+
+    def record(self, command, device, duration):
+        entry = self.messages.setdefault(command, {}).setdefault(
+            device, {"count": 0, "time": 0.0}
+        )
+        entry["count"] += 1
+        entry["time"] += duration
+
+    def report(self):
+        total = time.perf_counter() - self.start
+        return {
+            "uid": self.uid,
+            "total": total,
+            "plan": self.plan_time,
+            "messages": self.messages,
+            "classes": self.classes,
+        }
+
+
+class MessageProfiler:
+    """
+    Preprocessor that times every message of a plan in the RunEngine.
+
+    The time between yielding a message and receiving the response is
+    attributed to the message's command and target device. Time spent in
+    ``wait`` is attributed to the device whose status finished last, since
+    that is the device that was waited on. Time spent in the plan itself,
+    between messages, is recorded separately.
+
+    Timings are aggregated per run. When a run closes, they are recorded in
+    a separate event stream, with one field per command and device, e.g.
+    ``wait:en``, and a summary is printed. Runs that close with a failure,
+    or inside an open event bundle, are only printed, so that the profile
+    never replaces the error of the run.
+
+    Parameters
+    ----------
+    stream_name : str, optional
+        Name of the event stream for the timings. If None, no stream is
+        recorded
+    print_summary : bool, optional
+        If True, print the slowest commands and devices when a run closes
+    summary_length : int, optional
+        Number of entries in the printed summary
+    """
+
+    def __init__(self, stream_name="profile", print_summary=True, summary_length=10):
+        self.stream_name = stream_name
+        self.print_summary = print_summary
+        self.summary_length = summary_length
+        self.last_report = None
+        self._runs = {}
+
+    def __call__(self, plan):
+        return (yield from self._profile(plan))
+
+    def _track_status(self, run, msg, status):
+        group = msg.kwargs.get("group", None)
+        if group is None or not hasattr(status, "add_callback"):
+            return
+        entry = [msg.obj.name, None]
+        run.groups.setdefault(group, []).append(entry)
+
+        def finished(status):
+            entry[1] = time.perf_counter()
+
+        status.add_callback(finished)
+
+    def _wait_device(self, run, msg):
+        entries = run.groups.pop(msg.kwargs.get("group", None), [])
+        finished = [entry for entry in entries if entry[1] is not None]
+        if not finished:
+            return None
+        return max(finished, key=lambda entry: entry[1])[0]
+
+    def _record(self, msg, response, duration):
+        run = self._runs.get(msg.run, None)
+        if run is None:
+            return
+        if msg.command == "wait":
+            device = self._wait_device(run, msg)
+        else:
+            device = getattr(msg.obj, "name", None)
+            if msg.obj is not None:
+                run.classes[device] = type(msg.obj).__name__
+            if msg.command in ("set", "trigger", "kickoff", "complete", "call_obj"):
+                self._track_status(run, msg, response)
+        run.record(msg.command, device, duration)
+
+    def _close_run(self, msg):
+        """Record the timings of a run, before its close_run message."""
+        run = self._runs.pop(msg.run, None)
+        if run is None:
+            return
+        report = run.report()
+        self.last_report = report
+        if self.print_summary:
+            self.print_report(report)
+        if self.stream_name is None or run.bundling:
+            return
+        if msg.kwargs.get("exit_status", None) not in (None, "success"):
+            return
+        timings = {"total": report["total"], "plan": report["plan"]}
+        for command, devices in report["messages"].items():
+            for device, entry in devices.items():
+                timings[f"{command}:{device}"] = entry["time"]
+        readable = _ProfileReadable(self.stream_name, timings)
+        yield Msg("create", name=self.stream_name, run=msg.run)
+        yield Msg("read", readable, run=msg.run)
+        yield Msg("save", run=msg.run)
+
+    def _profile(self, plan):
+        # Runs that fail outside of run_wrapper, or are aborted, are closed by
+        # the RunEngine without a close_run message, so drop them on exit
+        opened = set()
+        try:
+            return (yield from self._profile_messages(plan, opened))
+        finally:
+            for key in opened:
+                self._runs.pop(key, None)
+
+    def _profile_messages(self, plan, opened):
+        response = None
+        exception = None
+        while True:
+            start = time.perf_counter()
+            try:
+                if exception is not None:
+                    msg = plan.throw(exception)
+                else:
+                    msg = plan.send(response)
+            except StopIteration as e:
+                return e.value
+            if msg.run in self._runs:
+                self._runs[msg.run].plan_time += time.perf_counter() - start
+
+            run = self._runs.get(msg.run, None)
+            if msg.command == "open_run":
+                self._runs[msg.run] = _RunProfile()
+                opened.add(msg.run)
+            elif msg.command == "close_run":
+                opened.discard(msg.run)
+                yield from self._close_run(msg)
+            elif run is not None and msg.command in ("create", "save", "drop"):
+                run.bundling = msg.command == "create"
+
+            start = time.perf_counter()
+            try:
+                response = yield msg
+                exception = None
+            except GeneratorExit:
+                plan.close()
+                raise
+            except Exception as e:
+                response = None
+                exception = e
+            self._record(msg, response, time.perf_counter() - start)
+            if msg.command == "open_run" and msg.run in self._runs:
+                self._runs[msg.run].uid = response
+
+    def print_report(self, report=None):
+        """
+        Print where the time of a run went.
+
+        Parameters
+        ----------
+        report : dict, optional
+            A run report, by default the one of the last run
+        """
+        if report is None:
+            report = self.last_report
+        if report is None:
+            return
+        total = report["total"] or 1
+        entries = []
+        for command, devices in report["messages"].items():
+            for device, entry in devices.items():
+                entries.append((entry["time"], command, device, entry["count"]))
+        entries.append((report["plan"], "plan", None, None))
+        entries.sort(reverse=True, key=lambda entry: entry[0])
+        text = [f"Total: {report['total']:.3f} s"]
+        for duration, command, device, count in entries[: self.summary_length]:
+            label = command
+            if device is not None:
+                label += f" {device}"
+                cls = report["classes"].get(device, None)
+                if cls is not None:
+                    label += f" ({cls})"
+            if count is not None:
+                label += f" x{count}"
+            text.append(f"{label}: {duration:.3f} s, {100 * duration / total:.0f}%")
+        boxed_text(f"Message profile of {report['uid']}", text, "white")
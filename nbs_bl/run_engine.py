@@ -1,6 +1,15 @@
 import asyncio
+import warnings
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from bluesky import RunEngine
+from bluesky.protocols import Status
+from bluesky.utils import FailedStatus
 from .beamline import GLOBAL_BEAMLINE
+from .lazy import materialize_lazy_devices_wrapper
+from .profiling import MessageProfiler
+from .state_cache import GLOBAL_STATE_CACHE
 from bluesky_queueserver import is_re_worker_active
 
 
@@ -10,22 +19,187 @@ async def generic_cmd(msg):
     return ret
 
 
-async def call_obj(msg):
+async def status_done(status):
+    """
+    Wait until a status is done, without blocking the event loop.
+
+    Failures are not raised, so that the waiting plan can check each status.
+    """
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+
+    def finished(status):
+        loop.call_soon_threadsafe(lambda: done.done() or done.set_result(None))
+
+    status.add_callback(finished)
+    await done
+    return status
+
+
+async def _await_status(status):
+    await status_done(status)
+    if not status.success:
+        raise status.exception() or FailedStatus(status)
+
+
+async def call_obj(msg, engine=None, executor=None):
+    """
+    Call a method of an object.
+
+    Expected message object is::
+
+        Msg("call_obj", obj, *args, method=<METHOD>, group=<GROUP>,
+            await_status=<AWAIT_STATUS>, **kwargs)
+
+    If an executor is given, the method runs in one of its threads, so that
+    methods that block do not stall the RunEngine's event loop, e.g. its
+    suspenders and pause requests.
+
+    The group and await_status are not passed to the method. If the method
+    returns a Status and a group is given, the status is added to the group,
+    so that it can be waited on like the status of a set. Otherwise, if
+    await_status is True, the command returns once the status is done.
+
+    If the command is cancelled while the method runs in the executor or its
+    status is awaited, a warning is issued. If the RunEngine is aborting,
+    halting or stopping, the object is also stopped with its ``stop`` method.
+    After a pause, the object is not stopped, like in bluesky's own
+    ``call_obj``, and the plan repeats the call when it resumes.
+    """
     obj = msg.obj
-    kwargs = msg.kwargs
+    kwargs = dict(msg.kwargs)
     args = msg.args
     command = kwargs.pop("method")
-    ret = getattr(obj, command)(*args, **kwargs)
+    group = kwargs.pop("group", None)
+    await_status = kwargs.pop("await_status", False)
+    method = getattr(obj, command)
+    try:
+        if executor is None:
+            ret = method(*args, **kwargs)
+        else:
+            loop = asyncio.get_running_loop()
+            try:
+                ret = await loop.run_in_executor(
+                    executor, partial(method, *args, **kwargs)
+                )
+            except asyncio.CancelledError:
+                _cancelled(obj, command, engine)
+                raise
+    except Exception:
+        GLOBAL_STATE_CACHE.forget(obj)
+        raise
+    if isinstance(ret, Status):
+
+        def record(status):
+            if status.success:
+                GLOBAL_STATE_CACHE.record_call(obj, command, args, kwargs)
+            else:
+                GLOBAL_STATE_CACHE.forget(obj)
+
+        ret.add_callback(record)
+        if group is not None and engine is not None:
+            engine._add_status_to_group(obj, ret, group, command)
+        elif await_status:
+            try:
+                await _await_status(ret)
+            except asyncio.CancelledError:
+                _cancelled(obj, command, engine)
+                raise
+    else:
+        GLOBAL_STATE_CACHE.record_call(obj, command, args, kwargs)
     return ret
 
 
-def load_RE_commands(engine):
-    engine.register_command("call_obj", call_obj)
+# States of a RunEngine that ends the plan without resuming it
+_ENDING_STATES = ("aborting", "halting", "stopping")
+
+
+def _cancelled(obj, command, engine):
+    """Handle a call_obj command that was cancelled before it finished."""
+    GLOBAL_STATE_CACHE.forget(obj)
+    name = getattr(obj, "name", obj)
+    stop = getattr(obj, "stop", None)
+    ending = engine is not None and engine.state in _ENDING_STATES
+    if stop is None or not ending:
+        warnings.warn(
+            f"call_obj {command} of {name} was cancelled, and may still be running",
+            RuntimeWarning,
+        )
+        return
+    warnings.warn(
+        f"call_obj {command} of {name} was cancelled, stopping {name}",
+        RuntimeWarning,
+    )
+    try:
+        stop()
+    except Exception as e:
+        print(f"Failed to stop {name}: {e}")
+
+
+def register_preconnected_devices_wrapper(plan):
+    """
+    Preprocessor that registers preconnected deferred devices as a plan starts.
+
+    Devices connected by :meth:`BeamlineModel.preconnect_deferred_devices`
+    are registered on the RunEngine thread before the first message of the
+    plan, so that no device appears on the beamline while a run is open.
+    """
+    GLOBAL_BEAMLINE.register_preconnected_devices()
+    return (yield from plan)
+
+
+def load_RE_commands(engine, call_workers=None):
+    """
+    Register nbs commands with a RunEngine.
+
+    Parameters
+    ----------
+    engine : RunEngine
+    call_workers : int, optional
+        Number of threads that run the methods of call_obj messages, or 0 to
+        call them on the RunEngine's event loop. By default, taken from
+        ``call_workers`` in [settings.run_engine]. The threads are shut down
+        when the RunEngine is garbage collected
+    """
+    if call_workers is None:
+        call_workers = GLOBAL_BEAMLINE.get_run_engine_settings()["call_workers"]
+    executor = None
+    if call_workers > 0:
+        executor = ThreadPoolExecutor(
+            max_workers=call_workers, thread_name_prefix="call_obj"
+        )
+        weakref.finalize(engine, executor.shutdown, wait=False)
+    engine.register_command(
+        "call_obj", partial(call_obj, engine=engine, executor=executor)
+    )
+
 
+def setup_run_engine(RE, profile_messages=None):
+    """
+    Register nbs commands and preprocessors with a RunEngine.
 
-def setup_run_engine(RE):
+    Parameters
+    ----------
+    RE : RunEngine
+    profile_messages : bool, optional
+        If True, time every message of each run with a MessageProfiler,
+        installed as the outermost preprocessor. By default, taken from
+        ``messages`` in [settings.profiling]
+    """
     load_RE_commands(RE)
+    RE.preprocessors.append(register_preconnected_devices_wrapper)
     RE.preprocessors.append(GLOBAL_BEAMLINE.supplemental_data)
+    RE.preprocessors.append(materialize_lazy_devices_wrapper)
+    profile_settings = GLOBAL_BEAMLINE.settings.get("profiling", {})
+    if profile_messages is None:
+        profile_messages = profile_settings.get("messages", False)
+    if profile_messages:
+        RE.preprocessors.append(
+            MessageProfiler(
+                stream_name=profile_settings.get("message_stream", "profile"),
+                summary_length=profile_settings.get("summary_length", 10),
+            )
+        )
     return RE
 
 
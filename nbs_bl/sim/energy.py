@@ -3,7 +3,6 @@ from ophyd import PseudoPositioner, Signal, PVPositioner, EpicsSignal, EpicsSign
 from ophyd.pseudopos import pseudo_position_argument, real_position_argument
 import pathlib
 import numpy as np
-import xarray as xr
 from nbs_bl.devices import DeadbandEpicsMotor, DeadbandMixin
 
 
@@ -176,6 +175,8 @@ class EnPos(PseudoPositioner):
         self.gap_fit[8][:] = [7.13593e-09, 4.69949e-13, 0, 0, 0, 0, 0, 0, 0, 0]
         self.gap_fit[9][:] = [-1.74622e-11, 0, 0, 0, 0, 0, 0, 0, 0, 0]
 
+        import xarray as xr
+
         self.polphase = xr.load_dataarray(configpath / "polphase.nc")
         self.phasepol = xr.DataArray(
             data=self.polphase.pol,
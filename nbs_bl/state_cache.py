@@ -0,0 +1,229 @@
+"""
+Cache of the configuration that was last sent to each device.
+
+Scans configure their detectors before they start, e.g. with
+``set_exposure`` and ``set_roi``, even if the previous scan left them in
+the same state. The RunEngine's ``call_obj`` command records every
+configuration call that succeeds, so that plans can skip calls that would
+not change anything. Only calls made through the RunEngine are recorded,
+so after configuring a device directly, call :meth:`DeviceStateCache.forget`.
+
+The exposure time is checked against the ``exposure_time`` signal of a
+device, if it has one. ROIs have no common readback, so the state of a
+device is forgotten whenever one of its signals disconnects, e.g. when its
+IOC restarts and loses the ROIs.
+"""
+
+import threading
+
+
+class DeviceStateCache:
+    """
+    Configuration state of devices, as set by known configuration methods.
+
+    The known methods are ``set_exposure(time)``, ``set_roi(label, llim,
+    ulim)``, ``clear_roi(label)`` and ``clear_all_rois()``. Calls of their
+    ``start_`` variants, which return a Status, are recorded like them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Device and its state, by id of the device
+        self._states = {}
+
+    def _state(self, obj):
+        entry = self._states.get(id(obj), None)
+        if entry is None or entry[0] is not obj:
+            return None
+        return entry[1]
+
+    def _watch_connection(self, obj):
+        """Subscribe to the signals of obj, to forget it when they disconnect."""
+
+        def disconnected(*args, connected=True, **kwargs):
+            if not connected:
+                self.forget(obj)
+
+        if hasattr(obj, "walk_signals"):
+            signals = [walk.item for walk in obj.walk_signals(include_lazy=False)]
+        else:
+            signals = [obj]
+        subscriptions = []
+        for signal in signals:
+            sub_meta = getattr(signal, "SUB_META", None)
+            if sub_meta is None or sub_meta not in signal.subscriptions:
+                continue
+            cid = signal.subscribe(disconnected, event_type=sub_meta, run=False)
+            subscriptions.append((signal, cid))
+        return subscriptions
+
+    def _remove(self, key):
+        obj, state, subscriptions = self._states.pop(key)
+        for signal, cid in subscriptions:
+            signal.unsubscribe(cid)
+
+    def get_state(self, obj):
+        """
+        Get the recorded state of a device.
+
+        Parameters
+        ----------
+        obj : object
+            The device
+
+        Returns
+        -------
+        dict
+            Copy of the state, empty if nothing was recorded
+        """
+        with self._lock:
+            return dict(self._state(obj) or {})
+
+    def record_call(self, obj, method, args=(), kwargs={}):
+        """
+        Record a configuration call that succeeded.
+
+        Parameters
+        ----------
+        obj : object
+            The device that was called
+        method : str
+            Name of the method. Unknown methods are ignored
+        args : tuple, optional
+            Positional arguments of the call
+        kwargs : dict, optional
+            Keyword arguments of the call
+        """
+        if method.startswith("start_"):
+            method = method[len("start_") :]
+        with self._lock:
+            if method not in (
+                "set_exposure",
+                "set_roi",
+                "clear_roi",
+                "clear_all_rois",
+            ):
+                return
+            state = self._state(obj)
+            if state is None:
+                state = {}
+                if id(obj) in self._states:
+                    self._remove(id(obj))
+                self._states[id(obj)] = (obj, state, self._watch_connection(obj))
+            if method == "set_exposure":
+                state["exposure"] = args[0] if args else kwargs.get("exp_time")
+            elif method == "set_roi":
+                label, llim, ulim = args[:3]
+                state.setdefault("rois", {})[label] = (llim, ulim)
+            elif method == "clear_roi":
+                state.setdefault("rois", {})[args[0]] = None
+            elif method == "clear_all_rois":
+                state["rois"] = {}
+                state["rois_cleared"] = True
+
+    def is_current(self, obj, method, *args):
+        """
+        Check whether a configuration call would leave the device unchanged.
+
+        Parameters
+        ----------
+        obj : object
+            The device to call
+        method : str
+            Name of the method
+        *args
+            Positional arguments of the call
+
+        Returns
+        -------
+        bool
+            True if the recorded state shows that the call is redundant.
+            False for unknown methods, or devices without a recorded state
+        """
+        with self._lock:
+            state = self._state(obj)
+            if state is None:
+                return False
+            rois = state.get("rois", {})
+            cleared = state.get("rois_cleared", False)
+            if method == "set_exposure":
+                if state.get("exposure", None) != args[0]:
+                    return False
+                # Detectors with an exposure signal are checked directly
+                signal = getattr(obj, "exposure_time", None)
+                if signal is not None and hasattr(signal, "get"):
+                    try:
+                        return signal.get() == args[0]
+                    except Exception:
+                        return False
+                return True
+            elif method == "set_roi":
+                label, llim, ulim = args[:3]
+                return rois.get(label, None) == (llim, ulim)
+            elif method == "clear_roi":
+                label = args[0]
+                if label in rois:
+                    return rois[label] is None
+                return cleared
+            elif method == "clear_all_rois":
+                return cleared and all(roi is None for roi in rois.values())
+            return False
+
+    def forget(self, obj=None):
+        """
+        Forget the recorded state of a device, or of all devices.
+
+        Parameters
+        ----------
+        obj : object, optional
+            The device to forget. If None, forget all devices
+        """
+        with self._lock:
+            if obj is None:
+                keys = list(self._states)
+            elif self._state(obj) is not None:
+                keys = [id(obj)]
+            else:
+                keys = []
+            for key in keys:
+                self._remove(key)
+
+
+def _same_position(position, target, tolerance):
+    if isinstance(target, dict):
+        return all(
+            _same_position(getattr(position, key), value, tolerance)
+            for key, value in target.items()
+        )
+    if isinstance(target, (list, tuple)):
+        return len(position) == len(target) and all(
+            _same_position(p, t, tolerance) for p, t in zip(position, target)
+        )
+    return abs(position - target) <= tolerance
+
+
+def is_at_position(obj, target, tolerance=0):
+    """
+    Check whether a positioner is already within tolerance of a target.
+
+    Parameters
+    ----------
+    obj : object
+        The positioner. Objects without a ``position`` are never at a target
+    target : float, sequence or dict
+        The target position. Sequences are compared with the axes of the
+        position in order, dicts by axis name
+    tolerance : float, optional
+        Largest difference between position and target, for each axis
+
+    Returns
+    -------
+    bool
+    """
+    try:
+        return bool(_same_position(obj.position, target, tolerance))
+    except Exception:
+        return False
+
+
+GLOBAL_STATE_CACHE = DeviceStateCache()
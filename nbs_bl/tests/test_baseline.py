@@ -0,0 +1,185 @@
+from bluesky import Msg, RunEngine
+from bluesky.plans import count
+from ophyd.sim import SynAxis, SynGauss
+from nbs_bl.baseline import (
+    BaselineSupplementalData,
+    get_baseline_reference,
+    get_monitored_readable,
+    release_monitored,
+    reset_baseline_reference,
+)
+
+
+def run_with_baseline(sd, plan):
+    RE = RunEngine(call_returns_result=True)
+    RE.preprocessors.append(sd)
+    docs = []
+    RE(plan, lambda name, doc: docs.append((name, doc)))
+    return docs
+
+
+def baseline_events(docs, stream="baseline"):
+    descriptors = [
+        doc["uid"]
+        for name, doc in docs
+        if name == "descriptor" and doc["name"] == stream
+    ]
+    return [
+        doc
+        for name, doc in docs
+        if name == "event" and doc["descriptor"] in descriptors
+    ]
+
+
+def test_monitored_baseline_reads_cached_values():
+    motor = SynAxis(name="motor")
+    det_motor = SynAxis(name="det_motor")
+    det = SynGauss("det", det_motor, "det_motor", 0, 1)
+    reads = []
+    readback_read = motor.readback.read
+
+    def counting_read():
+        reads.append(1)
+        return readback_read()
+
+    motor.readback.read = counting_read
+
+    monitored = get_monitored_readable(motor)
+    assert get_monitored_readable(motor) is monitored
+    assert monitored.unmonitored == []
+
+    motor.set(2).wait()
+    sd = BaselineSupplementalData(baseline=[motor], monitor_baseline=True)
+    docs = run_with_baseline(sd, count([det]))
+    events = baseline_events(docs)
+    assert [e["data"]["motor"] for e in events] == [2, 2]
+    assert reads == []
+
+    # Values that change between runs are picked up by the monitor
+    motor.set(3).wait()
+    docs = run_with_baseline(sd, count([det]))
+    assert [e["data"]["motor"] for e in baseline_events(docs)] == [3, 3]
+    assert reads == []
+
+    release_monitored(motor)
+    assert get_monitored_readable(motor) is not monitored
+    release_monitored(motor)
+
+
+def test_unmonitored_baseline_triggers_and_reads():
+    motor = SynAxis(name="motor")
+    det = SynGauss("det", motor, "motor", 0, 1)
+    motor.set(1).wait()
+    sd = BaselineSupplementalData(baseline=[motor])
+    docs = run_with_baseline(sd, count([det]))
+    assert [e["data"]["motor"] for e in baseline_events(docs)] == [1, 1]
+
+
+def test_change_only_baseline_records_changes():
+    reset_baseline_reference()
+    m1 = SynAxis(name="m1")
+    m2 = SynAxis(name="m2")
+    det_motor = SynAxis(name="det_motor")
+    det = SynGauss("det", det_motor, "det_motor", 0, 1)
+    sd = BaselineSupplementalData(baseline=[m1, m2], change_only_baseline=True)
+
+    docs = run_with_baseline(sd, count([det]))
+    start = docs[0][1]
+    assert start["baseline_references"] == {"baseline": None}
+    events = baseline_events(docs)
+    assert len(events) == 2
+    assert set(events[0]["data"]) == {"m1", "m1_setpoint", "m2", "m2_setpoint"}
+    assert get_baseline_reference("baseline").uid == start["uid"]
+    full_uid = start["uid"]
+
+    # Nothing moved, so there is no baseline stream
+    docs = run_with_baseline(sd, count([det]))
+    assert docs[0][1]["baseline_references"] == {"baseline": full_uid}
+    assert baseline_events(docs) == []
+
+    # Only the moved motor is recorded, at open and close
+    m2.set(1).wait()
+    docs = run_with_baseline(sd, count([det]))
+    assert docs[0][1]["baseline_references"] == {"baseline": full_uid}
+    events = baseline_events(docs)
+    assert [e["data"] for e in events] == [{"m2": 1, "m2_setpoint": 1}] * 2
+
+    # A different set of baseline devices starts over with a full baseline
+    sd.baseline.append(det_motor)
+    docs = run_with_baseline(sd, count([det]))
+    assert docs[0][1]["baseline_references"] == {"baseline": None}
+    assert len(baseline_events(docs)[0]["data"]) == 6
+
+
+def test_change_only_baseline_tolerances_and_restart():
+    reset_baseline_reference()
+    m1 = SynAxis(name="m1")
+    m2 = SynAxis(name="m2")
+    m3 = SynAxis(name="m3")
+    det = SynGauss("det", m1, "m1", 0, 1)
+    sd = BaselineSupplementalData(
+        baseline=[m1, m2, m3],
+        change_only_baseline=True,
+        baseline_tolerances={"m1": 0.1},
+    )
+    docs = run_with_baseline(sd, count([det]))
+    full_uid = docs[0][1]["uid"]
+
+    # A change within the tolerance of m1 is not recorded
+    m1.set(0.05).wait()
+    docs = run_with_baseline(sd, count([det]))
+    assert docs[0][1]["baseline_references"] == {"baseline": full_uid}
+    assert baseline_events(docs) == []
+
+    m1.set(0.5).wait()
+    docs = run_with_baseline(sd, count([det]))
+    assert [e["data"] for e in baseline_events(docs)] == [
+        {"m1": 0.5, "m1_setpoint": 0.5}
+    ] * 2
+
+    # Without the reference, e.g. after a restart, the baseline is full again
+    reset_baseline_reference()
+    docs = run_with_baseline(sd, count([det]))
+    assert docs[0][1]["baseline_references"] == {"baseline": None}
+    assert len(baseline_events(docs)[0]["data"]) == 6
+
+
+def test_monitored_baseline_takes_devices_as_runs_open():
+    motor = SynAxis(name="late_motor")
+    det = SynGauss("det", motor, "late_motor", 0, 1)
+    motor.set(4).wait()
+    sd = BaselineSupplementalData(baseline=[], monitor_baseline=True)
+
+    def plan():
+        yield Msg("null")
+        # Like a deferred device that is registered once the plan started
+        sd.baseline.append(motor)
+        return (yield from count([det]))
+
+    docs = run_with_baseline(sd, plan())
+    assert [e["data"]["late_motor"] for e in baseline_events(docs)] == [4, 4]
+    release_monitored(motor)
+
+
+def test_monitored_baseline_reads_only_unmonitored_keys():
+    motor = SynAxis(name="motor")
+
+    def cannot_subscribe(*args, **kwargs):
+        raise RuntimeError("no monitor")
+
+    motor.setpoint.subscribe = cannot_subscribe
+    reads = []
+    motor_read = motor.read
+
+    def counting_read():
+        reads.append(1)
+        return motor_read()
+
+    motor.read = counting_read
+    motor.set(2).wait()
+    monitored = get_monitored_readable(motor)
+    assert monitored.unmonitored == ["motor_setpoint"]
+    readings = monitored.read()
+    assert readings["motor"]["value"] == 2 and readings["motor_setpoint"]["value"] == 2
+    assert reads == []
+    release_monitored(motor)
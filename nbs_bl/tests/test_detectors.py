@@ -0,0 +1,215 @@
+import contextlib
+import io
+import threading
+import time
+import numpy as np
+import pytest
+from bluesky import RunEngine
+from bluesky.plans import count
+from ophyd import Component as Cpt, Signal
+from nbs_bl.devices.detectors import RawSampleHandler, SampleBuffer, ScalarBase
+from nbs_bl.plans.plan_stubs import set_exposure
+from nbs_bl.run_engine import load_RE_commands
+from nbs_bl.state_cache import GLOBAL_STATE_CACHE
+
+
+class SimScalar(ScalarBase):
+    target = Cpt(Signal, value=0, kind="omitted")
+
+
+def test_ring_buffer_keeps_latest_samples():
+    buffer = SampleBuffer(capacity=4, columns=2)
+    for n in range(3):
+        buffer.append(n, 10 * n)
+    mark = buffer.mark()
+    for n in range(3, 7):
+        buffer.append(n, 10 * n)
+    assert len(buffer) == 4
+    assert buffer.since()[:, 0].tolist() == [3, 4, 5, 6]
+    assert buffer.since(mark)[:, 1].tolist() == [30, 40, 50, 60]
+    assert buffer.since(5)[:, 0].tolist() == [5, 6]
+    # Samples 1 and 2 were overwritten
+    with pytest.warns(RuntimeWarning, match="2 samples since the mark"):
+        assert buffer.since(1)[:, 0].tolist() == [3, 4, 5, 6]
+
+    buffer.reserve(6)
+    buffer.append(7, 70)
+    assert buffer.capacity == 6
+    assert buffer.since()[:, 0].tolist() == [3, 4, 5, 6, 7]
+
+    buffer.clear()
+    assert len(buffer) == 0 and buffer.since().shape == (0, 2)
+
+
+def test_growing_buffer_keeps_all_samples():
+    buffer = SampleBuffer(capacity=2, columns=1, grow=True)
+    for n in range(9):
+        buffer.append(n)
+    assert buffer.capacity == 16
+    assert buffer.since(0)[:, 0].tolist() == list(range(9))
+
+
+def test_scalar_statistics_from_monitored_samples():
+    det = SimScalar(name="det", rescale=2)
+    det.exposure_time.put(0.2)
+    det.stage()
+    try:
+        stop = threading.Event()
+
+        def publish():
+            n = 0
+            while not stop.is_set():
+                det.target.put(n % 2)
+                n += 1
+                time.sleep(0.001)
+
+        thread = threading.Thread(target=publish, daemon=True)
+        thread.start()
+        det.trigger().wait(timeout=5)
+        stop.set()
+        thread.join()
+    finally:
+        det.unstage()
+    npts = det.npts.get()
+    assert npts > 10
+    assert abs(det.mean.get() - 1) < 0.2
+    assert det.sum.get() == np.sum(det._secret_buffer[0])
+    assert len(det._secret_time_buffer[0]) == npts
+
+
+def test_scalar_flyer_collects_every_sample(tmp_path):
+    det = SimScalar(name="det", raw_directory=str(tmp_path), flyer_chunk=256)
+    det.kickoff().wait()
+    for n in range(3000):
+        det.target.put(float(n))
+    # Only one chunk of samples is held in memory, the rest is spilled
+    assert det._flyer_samples.capacity == 256
+    assert len(det._flyer_samples) < 256
+    det.complete().wait()
+    events = list(det.collect())
+    assert [e["data"]["det"] for e in events] == list(range(3000))
+    assert list(det.collect()) == []
+    assert len(det._flyer_samples) == 0 and det._flyer_spill is None
+
+
+def test_timestamp_window_finishes_on_first_late_sample():
+    det = SimScalar(name="det", acquire_mode="timestamp", window_timeout=2)
+    det.exposure_time.put(0.2)
+    det.stage()
+    try:
+        # The clock of the IOC is far behind the host clock
+        ioc_start = time.time() - 100
+        det.target.put(100, timestamp=ioc_start - 1)
+        start = time.time()
+        status = det.trigger()
+        for n in range(5):
+            det.target.put(1, timestamp=ioc_start + 0.01 + 0.02 * n)
+        assert not status.done
+        time.sleep(0.25)
+        assert not status.done
+        det.target.put(100, timestamp=ioc_start + 0.3)
+        status.wait(timeout=1)
+        assert time.time() - start < 0.5
+        assert det.npts.get() == 5
+        assert det.mean.get() == 1
+
+        # Without any sample, the trigger times out
+        det.window_timeout = 0.1
+        start = time.time()
+        det.trigger().wait(timeout=2)
+        assert 0.3 <= time.time() - start < 1
+        assert det.npts.get() == 0
+    finally:
+        det.unstage()
+    # The worker stops when the detector is unstaged
+    time.sleep(0.1)
+    assert not [t for t in threading.enumerate() if "_window_worker" in t.name]
+
+
+def test_raw_samples_are_spilled_to_disk(tmp_path):
+    det = SimScalar(name="det", raw_directory=str(tmp_path), raw_memory_points=2)
+    det.exposure_time.put(0.05)
+    stop = threading.Event()
+
+    def publish():
+        n = 0
+        while not stop.is_set():
+            det.target.put(float(n))
+            n += 1
+            time.sleep(0.002)
+
+    thread = threading.Thread(target=publish, daemon=True)
+    thread.start()
+    docs = []
+    try:
+        RunEngine()(count([det], num=3), lambda name, doc: docs.append((name, doc)))
+    finally:
+        stop.set()
+        thread.join()
+
+    names = [name for name, doc in docs]
+    assert names.count("resource") == 1 and names.count("datum") == 3
+    resource = docs[names.index("resource")][1]
+    assert resource["spec"] == "NBS_RAW_NPY"
+    assert resource["run_start"] == docs[0][1]["uid"]
+    descriptor = docs[names.index("descriptor")][1]
+    assert descriptor["data_keys"]["det_raw"]["external"] == "FILESTORE:"
+    datums = {doc["datum_id"]: doc for name, doc in docs if name == "datum"}
+    events = [doc for name, doc in docs if name == "event"]
+    assert [e["data"]["det_raw"] in datums for e in events] == [True] * 3
+
+    # The file is complete once the detector is unstaged
+    handler = RawSampleHandler(str(tmp_path / resource["resource_path"]))
+    raw = [handler(**datums[e["data"]["det_raw"]]["datum_kwargs"]) for e in events]
+    assert all(len(r) > 0 for r in raw)
+    assert np.array_equal(raw[-1][:, 0], det._secret_buffer[-1])
+    assert len(det._secret_buffer) == 2
+    assert descriptor["data_keys"]["det_raw"]["shape"] == [None, 2]
+
+
+def test_raw_reading_is_not_stale(tmp_path):
+    det = SimScalar(name="det", raw_directory=str(tmp_path))
+    det.exposure_time.put(0.05)
+    det.stage()
+    try:
+        # Before the first trigger, the raw field refers to no samples
+        assert set(det.read()) == set(det.describe())
+        det.target.put(1.0)
+        status = det.trigger()
+        det.target.put(2.0)
+        status.wait(timeout=2)
+        first = det.read()["det_raw"]["value"]
+        second = det.read()["det_raw"]["value"]
+        assert first != second
+        datums = {
+            doc["datum_id"]: doc["datum_kwargs"]
+            for name, doc in det.collect_asset_docs()
+            if name == "datum"
+        }
+    finally:
+        det.unstage()
+    assert datums[second]["start"] == datums[second]["stop"]
+    assert datums[first]["stop"] > datums[first]["start"]
+
+
+def test_set_exposure_blocks_and_plans_start_it():
+    det = SimScalar(name="det")
+    # Called directly, the exposure is set when the call returns
+    assert det.set_exposure(0.5) is None
+    assert det.exposure_time.get() == 0.5
+
+    calls = []
+    start_set_exposure = det.start_set_exposure
+
+    def counting_start(exp_time):
+        calls.append(exp_time)
+        return start_set_exposure(exp_time)
+
+    det.start_set_exposure = counting_start
+    RE = RunEngine()
+    load_RE_commands(RE)
+    with contextlib.redirect_stdout(io.StringIO()):
+        RE(set_exposure(2, extra_dets=[det]))
+    assert calls == [2] and det.exposure_time.get() == 2
+    assert GLOBAL_STATE_CACHE.get_state(det) == {"exposure": 2}
+    GLOBAL_STATE_CACHE.forget()
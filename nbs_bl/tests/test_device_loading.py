@@ -0,0 +1,340 @@
+import threading
+import time
+import pytest
+from nbs_bl.hw import (
+    loadDeviceWave,
+    instantiateDevicesParallel,
+    waitForConnections,
+)
+from nbs_bl.device_graph import DeviceGraph
+
+
+class FakeDevice:
+    def __init__(self, name, connected=True):
+        self.name = name
+        self.connected = connected
+        self.thread = threading.current_thread().name
+
+    def wait_for_connection(self, timeout=None):
+        if not self.connected:
+            raise TimeoutError(f"{self.name} not connected")
+
+
+def fake_instantiate(device_key, info, namespace=None, **kwargs):
+    time.sleep(info.get("delay", 0))
+    if info.get("fail", False):
+        raise ValueError(f"Could not create {device_key}")
+    device = FakeDevice(device_key, connected=info.get("connected", True))
+    if namespace is not None:
+        namespace[device_key] = device
+    return device
+
+
+@pytest.fixture()
+def config():
+    return {
+        "m1": {"_target": "fake", "_group": "motors", "delay": 0.2},
+        "m2": {"_target": "fake", "_group": "motors", "delay": 0.2},
+        "d1": {"_target": "fake", "_group": "detectors", "_role": "intensity_detector"},
+        "bad": {"_target": "fake", "fail": True},
+        "offline": {"_target": "fake", "connected": False},
+        "later": {"_target": "fake", "_load_order": 2},
+        "deferred": {"_target": "fake", "_defer_loading": True},
+        "m1_alias": {"_alias": "m1", "_group": "misc"},
+    }
+
+
+def test_instantiate_parallel_runs_concurrently(config):
+    start = time.monotonic()
+    devices, errors = instantiateDevicesParallel(
+        config, ["m1", "m2"], fake_instantiate, max_workers=2
+    )
+    assert time.monotonic() - start < 0.35
+    assert set(devices) == {"m1", "m2"}
+    assert not errors
+
+
+def test_load_wave_reports_failures(config):
+    ns = {}
+    devices, groups, roles, failures = loadDeviceWave(
+        config, ["m1", "m2", "d1", "bad", "offline"], fake_instantiate, namespace=ns
+    )
+    assert set(devices) == {"m1", "m2", "d1", "offline"}
+    assert set(failures) == {"bad"}
+    assert isinstance(failures["bad"], ValueError)
+    assert groups["motors"] == ["m1", "m2"]
+    assert roles == {"intensity_detector": "d1"}
+    assert ns["m1"] is devices["m1"]
+
+    devices, groups, _, _ = loadDeviceWave(
+        config, ["m1_alias"], fake_instantiate, namespace=ns, available=devices
+    )
+    assert devices["m1_alias"] is ns["m1"]
+    assert groups == {"misc": ["m1_alias"]}
+
+
+def test_graph_waves(config):
+    graph = DeviceGraph(config)
+    assert graph.deferred == {"deferred"}
+    waves = graph.waves()
+    assert waves[0] == ["m1", "m2", "d1", "bad", "offline"]
+    # Aliases in earlier load passes are available to later passes
+    assert waves[1:] == [["m1_alias"], ["later"]]
+
+
+def test_graph_depends_on():
+    config = {
+        "manipr": {"_target": "fake"},
+        "energy": {"_target": "fake", "_depends_on": "manipr", "_load_order": 2},
+        "mono": {"_target": "fake", "_load_order": 2},
+        "slow": {"_target": "fake", "_load_order": 3, "_depends_on": []},
+        "ref": {"_target": "fake", "_defer_loading": True},
+        "ref_axis": {"_alias": "ref.x"},
+        "uses_ref": {"_target": "fake", "_depends_on": ["ref"]},
+    }
+    graph = DeviceGraph(config)
+    assert graph.deferred == {"ref", "ref_axis", "uses_ref"}
+    assert graph.waves() == [["manipr", "slow"], ["energy", "mono"]]
+    assert graph.dependency_closure(["uses_ref"]) == {"uses_ref", "ref"}
+
+
+def test_graph_cycle():
+    config = {
+        "a": {"_target": "fake", "_depends_on": "b"},
+        "b": {"_target": "fake", "_depends_on": "a"},
+    }
+    with pytest.raises(ValueError):
+        DeviceGraph(config)
+
+
+def test_wait_for_connections_shares_timeout():
+    devices = {"a": FakeDevice("a"), "b": FakeDevice("b", connected=False)}
+    errors = waitForConnections(devices, timeout=0.1)
+    assert list(errors) == ["b"]
+
+
+def test_lazy_device_materializes_on_use():
+    from bluesky import Msg
+    from nbs_bl.lazy import LazyDevice, materialize_lazy_devices_wrapper
+
+    created = []
+
+    def loader(placeholder):
+        device = FakeDevice("real")
+        created.append(device)
+        return device
+
+    lazy = LazyDevice("real", "real", loader)
+    assert lazy.name == "real"
+    assert not created
+
+    def plan():
+        yield Msg("read", lazy)
+
+    msgs = list(materialize_lazy_devices_wrapper(plan()))
+    assert msgs[0].obj is created[0]
+    assert lazy.materialized
+    assert lazy.connected and len(created) == 1
+
+
+def test_config_cache_invalidated_by_changes(tmp_path, monkeypatch, config):
+    from nbs_bl.config_cache import load_compiled_config, save_compiled_config
+
+    monkeypatch.setenv("NBS_BL_CACHE_DIR", str(tmp_path / "cache"))
+    settings_file = tmp_path / "beamline.toml"
+    device_file = tmp_path / "devices.toml"
+    settings_file.write_text("[settings]\n")
+    device_file.write_text("[m1]\n")
+
+    assert load_compiled_config(str(settings_file)) is None
+    save_compiled_config(
+        str(settings_file),
+        [str(settings_file), str(device_file)],
+        device_graph=DeviceGraph(config),
+    )
+    compiled = load_compiled_config(str(settings_file))
+    graph = DeviceGraph(config)
+    assert compiled["device_graph"].waves() == graph.waves()
+    assert compiled["device_graph"].dependents == graph.dependents
+    # The cache is plain JSON
+    (cache_file,) = (tmp_path / "cache").iterdir()
+    assert cache_file.suffix == ".json"
+
+    device_file.write_text("[m2]\n")
+    assert load_compiled_config(str(settings_file)) is None
+
+
+def load_beamline(startup_dir, ns):
+    from nbs_bl.beamline import BeamlineModel
+
+    (startup_dir / "beamline.toml").write_text(
+        "[settings]\nconfig_cache = false\n"
+        "[settings.device_loading]\nconnection_timeout = 0\n"
+    )
+    bl = BeamlineModel()
+    bl.load_beamline(str(startup_dir), ns)
+    return bl
+
+
+def test_config_cache_not_read_when_disabled(tmp_path, monkeypatch):
+    import nbs_bl.beamline
+
+    def load_compiled_config(settings_file):
+        raise AssertionError("The configuration cache was read")
+
+    monkeypatch.setattr(nbs_bl.beamline, "load_compiled_config", load_compiled_config)
+    (tmp_path / "devices.toml").write_text(
+        '[m1]\n_target = "ophyd.sim.SynAxis"\nname = "m1"\n'
+    )
+    bl = load_beamline(tmp_path, {})
+    assert "m1" in bl.devices
+
+
+def test_config_cache_hit_skips_parsing(tmp_path, monkeypatch):
+    import nbs_bl.beamline
+    from nbs_bl.beamline import BeamlineModel
+
+    monkeypatch.setenv("NBS_BL_CACHE_DIR", str(tmp_path / "cache"))
+    startup_dir = tmp_path / "startup"
+    startup_dir.mkdir()
+    (startup_dir / "beamline.toml").write_text(
+        "[settings]\n[settings.device_loading]\nconnection_timeout = 0\n"
+    )
+    (startup_dir / "devices.toml").write_text(
+        '[m1]\n_target = "ophyd.sim.SynAxis"\nname = "m1"\n'
+    )
+    BeamlineModel().load_beamline(str(startup_dir), {})
+
+    def load(f):
+        raise AssertionError(f"{f.name} was parsed")
+
+    monkeypatch.setattr(nbs_bl.beamline.tomllib, "load", load)
+    bl = BeamlineModel()
+    bl.load_beamline(str(startup_dir), {})
+    assert "m1" in bl.devices
+    assert bl.settings["device_loading"]["connection_timeout"] == 0
+    # The cached graph describes the same configuration that reloads compare to
+    assert bl.device_graph.config["m1"] is bl.config["devices"]["m1"]
+
+
+def test_device_module_import_failures_are_reported(tmp_path, capsys):
+    (tmp_path / "devices.toml").write_text(
+        '[broken]\n_target = "nbs_bl.no_such_module.Device"\nname = "broken"\n'
+    )
+    bl = load_beamline(tmp_path, {})
+    out = capsys.readouterr().out
+    assert "Device module import failures" in out
+    assert "nbs_bl.no_such_module" in out
+    assert "broken" in bl.load_failures
+
+
+def test_device_module_imports_are_profiled_separately(tmp_path):
+    from nbs_bl.beamline import BeamlineModel
+    from nbs_bl.profiling import GLOBAL_STARTUP_PROFILE
+
+    (tmp_path / "beamline.toml").write_text(
+        "[settings]\nconfig_cache = false\n"
+        "[settings.device_loading]\nconnection_timeout = 0\n"
+        "[settings.profiling]\nstartup = true\n"
+    )
+    (tmp_path / "devices.toml").write_text(
+        '[m1]\n_target = "ophyd.sim.SynAxis"\nname = "m1"\n'
+    )
+    enabled = GLOBAL_STARTUP_PROFILE.enabled
+    GLOBAL_STARTUP_PROFILE.reset()
+    try:
+        BeamlineModel().load_beamline(str(tmp_path), {})
+        items = GLOBAL_STARTUP_PROFILE.items
+        assert list(items["device_modules"]) == ["ophyd.sim"]
+        assert "startup_modules" not in items
+    finally:
+        GLOBAL_STARTUP_PROFILE.reset(enabled)
+
+
+def test_reload_configuration_only_reloads_changes(tmp_path):
+    devices_toml = """
+[m1]
+_target = "ophyd.sim.SynAxis"
+_group = "motors"
+name = "m1"
+delay = {delay}
+
+[m1_readback]
+_alias = "m1.readback"
+_group = "signals"
+
+[{other}]
+_target = "ophyd.sim.SynAxis"
+_group = "motors"
+name = "{other}"
+"""
+    device_file = tmp_path / "devices.toml"
+    device_file.write_text(devices_toml.format(delay=0, other="m2"))
+    ns = {}
+    bl = load_beamline(tmp_path, ns)
+    m1 = bl.devices["m1"]
+    m2 = bl.devices["m2"]
+
+    device_file.write_text(devices_toml.format(delay=0.1, other="m2"))
+    summary = bl.reload_configuration(ns=ns)
+    assert summary["changed"] == ["m1"]
+    assert summary["reloaded"] == ["m1", "m1_readback"]
+    assert bl.devices["m1"] is not m1
+    assert bl.motors.get("m1") is bl.devices["m1"]
+    assert bl.devices["m1_readback"] is bl.devices["m1"].readback
+    assert ns["m1"] is bl.devices["m1"]
+    assert bl.devices["m2"] is m2
+
+    device_file.write_text(devices_toml.format(delay=0.1, other="m3"))
+    summary = bl.reload_configuration(ns=ns)
+    assert summary["added"] == ["m3"]
+    assert summary["removed"] == ["m2"]
+    assert "m2" not in bl.devices and "m2" not in bl.motors.devices
+    assert "m3" in bl.motors.devices
+
+
+def test_load_deferred_device_loads_only_its_closure(tmp_path):
+    (tmp_path / "devices.toml").write_text(
+        """
+[m1]
+_target = "ophyd.sim.SynAxis"
+name = "m1"
+
+[slow]
+_target = "ophyd.sim.SynAxis"
+_defer_loading = true
+name = "slow"
+
+[slow_readback]
+_alias = "slow.readback"
+
+[other]
+_target = "ophyd.sim.SynAxis"
+_defer_loading = true
+name = "other"
+"""
+    )
+    ns = {}
+    bl = load_beamline(tmp_path, ns)
+    assert bl.get_deferred_devices() == {"slow", "slow_readback", "other"}
+
+    bl.load_deferred_device("slow_readback", ns)
+    assert bl.get_deferred_devices() == {"other"}
+    assert bl.devices["slow_readback"] is bl.devices["slow"].readback
+
+    bl.defer_device("slow", ns)
+    assert bl.get_deferred_devices() == {"slow", "slow_readback", "other"}
+    assert "slow" not in bl.devices and "slow" not in ns
+
+    queue = [{"name": "tes_scan", "args": ["m1", "slow.user_setpoint", 1, 2]}]
+    assert bl.find_deferred_devices(queue) == ["slow"]
+    bl.preconnect_deferred_devices(queue, ns).join()
+    # Connected in the background, but only registered between plans
+    assert bl.get_deferred_devices() == {"slow", "slow_readback", "other"}
+    assert "slow" not in bl.devices and "slow" not in ns
+    preconnected = bl._preconnected["slow"]
+    assert bl.register_preconnected_devices() == ["slow"]
+    assert bl.get_deferred_devices() == {"other"}
+    assert bl.devices["slow"] is preconnected
+    assert ns["slow"] is preconnected
+    assert bl.devices["slow_readback"] is preconnected.readback
@@ -0,0 +1,150 @@
+import contextlib
+import io
+import time
+import pytest
+from bluesky.plans import list_scan, scan
+from ophyd import Device, Signal, Component as Cpt
+from bluesky.plan_stubs import rd
+from ophyd.sim import SynAxis
+from nbs_bl.beamline import GLOBAL_BEAMLINE
+from nbs_bl.plans.dry_run import dry_run, _default_dry_run
+from nbs_bl.plans.plan_stubs import call_obj
+
+
+class ExposureDetector(Device):
+    exposure_time = Cpt(Signal, value=0.5, kind="config")
+    value = Cpt(Signal, value=1, kind="hinted")
+
+
+def settings(**kwargs):
+    return dict(_default_dry_run, **kwargs)
+
+
+def test_dry_run_uses_velocity_and_exposure():
+    motor = SynAxis(name="motor")
+    motor.velocity.put(2)
+    motor.acceleration.put(0.5)
+    det = ExposureDetector(name="det")
+
+    # 11 points 1 apart: 10 moves of 1/2 + 0.5 s, 11 exposures of 0.5 s
+    result = dry_run(
+        scan,
+        [det],
+        motor,
+        0,
+        10,
+        11,
+        settings=settings(devices={"motor": {"position": 0}}),
+    )
+    assert result["duration"] == pytest.approx(10 * 1.0 + 11 * 0.5)
+    assert result["by_kind"]["move"] == pytest.approx(10.0)
+    assert result["by_kind"]["trigger"] == pytest.approx(5.5)
+    assert result["phases"] == {"run": pytest.approx(15.5)}
+    assert result["by_device"] == {
+        "motor": pytest.approx(10.0),
+        "det": pytest.approx(5.5),
+    }
+    # The real motor did not move
+    assert motor.position == 0
+
+
+def test_dry_run_of_nbs_scan_follows_set_exposure():
+    with contextlib.redirect_stdout(io.StringIO()):
+        from nbs_bl.plans.scans import nbs_scan
+
+    motor = SynAxis(name="motor")
+    det = ExposureDetector(name="det")
+    det.set_exposure = lambda t: None
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = dry_run(
+            nbs_scan,
+            motor,
+            0,
+            100,
+            101,
+            extra_dets=[det],
+            dwell=2,
+            settings=settings(devices={"motor": {"move_time": 0.25}}),
+        )
+    assert time.perf_counter() - start < 1
+    assert result["by_kind"]["trigger"] == pytest.approx(101 * 2)
+    assert result["by_kind"]["move"] == pytest.approx(101 * 0.25)
+
+
+def test_dry_run_does_not_touch_the_beamline():
+    motor = SynAxis(name="motor")
+    det = ExposureDetector(name="det")
+    calls = []
+    det.get_position = lambda: calls.append("get_position")
+    GLOBAL_BEAMLINE.detectors.add("dry_run_det", det, activate=False)
+    readings = []
+
+    def plan():
+        GLOBAL_BEAMLINE.detectors.activate("dry_run_det")
+        yield from call_obj(det, "get_position")
+        readings.append((yield from rd(motor)))
+        readings.append((yield from rd(det)))
+
+    try:
+        dry_run(plan, settings=settings(read_value=3.0))
+        assert det not in GLOBAL_BEAMLINE.detectors.active
+        assert GLOBAL_BEAMLINE.detectors.status["dry_run_det"] == "inactive"
+    finally:
+        GLOBAL_BEAMLINE.detectors.remove("dry_run_det")
+    assert calls == []
+    # Positioners read their position, other devices read_value
+    assert readings == [0.0, 3.0]
+
+
+def test_dry_run_restores_active_detectors():
+    detectors = GLOBAL_BEAMLINE.detectors
+    dets = {key: ExposureDetector(name=key) for key in ("dry_a", "dry_b", "dry_c")}
+    for key, det in dets.items():
+        detectors.add(key, det, activate=key != "dry_c")
+    before = list(detectors.active)
+
+    def plan():
+        detectors.deactivate("dry_a")
+        detectors.activate("dry_c")
+        detectors.activate("dry_a")
+        yield from rd(dets["dry_a"])
+
+    try:
+        dry_run(plan, settings=settings())
+        assert detectors.active == before
+        assert [detectors.get_key(d) for d in detectors.active] == list(
+            detectors._active_keys
+        )
+        assert detectors.status["dry_c"] == "inactive"
+    finally:
+        for key in dets:
+            detectors.remove(key)
+
+
+class ControlSignal(Signal):
+    """Signal whose get would ask the control system."""
+
+    def get(self, **kwargs):
+        raise AssertionError("The dry run asked the control system")
+
+
+class ControlMotor(SynAxis):
+    velocity = Cpt(ControlSignal, value=2, kind="config")
+
+
+def test_dry_run_moves_from_cached_position():
+    motor = ControlMotor(name="motor")
+    motor.acceleration.put(0)
+
+    def move_to_10():
+        result = dry_run(list_scan, [], motor, [10], settings=settings())
+        return result["by_kind"]["move"]
+
+    # The velocity is the value the signal holds, the start the motor position
+    assert move_to_10() == pytest.approx(5.0)
+    motor.set(8).wait()
+    assert move_to_10() == pytest.approx(1.0)
+    # The real motor did not move
+    assert motor.position == 8
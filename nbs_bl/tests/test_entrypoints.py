@@ -0,0 +1,54 @@
+import json
+import os
+import sys
+from nbs_bl.entrypoints import EntryPointRegistry, _path_key
+
+
+def test_registry_discovers_once_and_persists(tmp_path, monkeypatch):
+    monkeypatch.setenv("NBS_BL_CACHE_DIR", str(tmp_path))
+    calls = []
+
+    def discover():
+        calls.append(1)
+        return {"nbs_bl.plan_loaders": [("test", "json:loads"), ("other", "json:dumps")]}
+
+    registry = EntryPointRegistry()
+    monkeypatch.setattr(registry, "_discover", discover)
+    assert [ep.name for ep in registry.select("nbs_bl.plan_loaders")] == [
+        "test",
+        "other",
+    ]
+    (ep,) = registry.select("nbs_bl.plan_loaders", "test")
+    assert registry.load(ep) is json.loads
+    assert registry.select("nbs_bl.suspenders") == []
+    assert len(calls) == 1
+
+    registry = EntryPointRegistry()
+    monkeypatch.setattr(registry, "_discover", discover)
+    (ep,) = registry.select("nbs_bl.plan_loaders", "other")
+    assert registry.load(ep) is json.dumps
+    assert len(calls) == 1
+
+
+def test_registry_without_persistence(tmp_path, monkeypatch):
+    monkeypatch.setenv("NBS_BL_CACHE_DIR", str(tmp_path))
+    registry = EntryPointRegistry(persist=False)
+    registry.select("nbs_bl.plan_loaders")
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_path_key_tracks_distribution_metadata(tmp_path, monkeypatch):
+    monkeypatch.setattr(sys, "path", [str(tmp_path)])
+    entry_points = tmp_path / "pkg-1.0.dist-info" / "entry_points.txt"
+    entry_points.parent.mkdir()
+    entry_points.write_text("[nbs_bl.plan_loaders]\n")
+    os.utime(tmp_path, ns=(0, 0))
+    key = _path_key()
+    assert _path_key() == key
+
+    # An in-place rewrite changes neither sys.path entry nor metadata directory
+    entry_points.write_text("[nbs_bl.plan_loaders]\ntest = json:loads\n")
+    os.utime(entry_points, ns=(10**9, 10**9))
+    os.utime(entry_points.parent, ns=(0, 0))
+    os.utime(tmp_path, ns=(0, 0))
+    assert _path_key() != key
@@ -0,0 +1,101 @@
+from nbs_bl.hw import HardwareGroup, DetectorGroup
+from nbs_bl.beamline import BeamlineModel
+from ophyd.sim import SynAxis, SynGauss
+
+
+def make_detectors(n):
+    motor = SynAxis(name="motor")
+    detectors = DetectorGroup("test_detectors")
+    for i in range(n):
+        detectors.add(f"det{i}", SynGauss(f"det{i}", motor, "motor", 0, 1))
+    return detectors
+
+
+def test_get_key_uses_identity_index():
+    group = HardwareGroup("test_motors")
+    m1 = SynAxis(name="m1")
+    m2 = SynAxis(name="m2")
+    group.add("m1", m1)
+    group.add("m2", m2)
+    assert group.get_key(m2) == "m2"
+
+    m3 = SynAxis(name="m3")
+    group.replace("m2", m3)
+    assert group.get_key(m3) == "m2"
+    try:
+        group.get_key(m2)
+        assert False, "Replaced device should not be found"
+    except KeyError:
+        pass
+
+    group.remove(m1)
+    assert "m1" not in group.devices
+
+
+def test_activate_deactivate_keeps_order():
+    detectors = make_detectors(5)
+    assert [d.name for d in detectors.active] == [f"det{i}" for i in range(5)]
+
+    detectors.deactivate("det1")
+    detectors.deactivate("det1")
+    detectors.activate(detectors.get("det1"))
+    detectors.activate("det1")
+    assert [d.name for d in detectors.active] == [
+        "det0",
+        "det2",
+        "det3",
+        "det4",
+        "det1",
+    ]
+
+    detectors.disable("det3")
+    detectors.activate("det3")
+    assert "det3" not in [d.name for d in detectors.active]
+    assert list(detectors.get_plot_hints()["auxiliary"]) == [
+        "det0",
+        "det2",
+        "det4",
+        "det1",
+    ]
+
+
+def test_active_follows_active_keys():
+    detectors = make_detectors(4)
+    detectors.add_set("pair", ["det1", "det2"])
+    detectors.deactivate_set("pair")
+    assert [d.name for d in detectors.active] == ["det0", "det3"]
+    assert list(detectors._active_keys) == ["det0", "det3"]
+    assert detectors.status["det1"] == "inactive"
+
+    new_det = SynGauss("new_det3", SynAxis(name="motor"), "motor", 0, 1)
+    detectors.replace("det3", new_det)
+    assert detectors.active[1] is new_det
+    detectors.remove("det0")
+    assert detectors.active == [new_det]
+    assert list(detectors._active_keys) == ["det3"]
+
+
+def test_get_device_cache_follows_replacement():
+    bl = BeamlineModel()
+    motor = SynAxis(name="motor")
+    bl.devices["motor"] = motor
+    assert bl.get_device("motor.readback") is motor.readback
+    assert bl.get_device("motor.readback", False) is motor
+
+    new_motor = SynAxis(name="motor")
+    bl.devices["motor"] = new_motor
+    assert bl.get_device("motor.readback") is new_motor.readback
+
+
+def test_unregister_device_drops_cached_names():
+    bl = BeamlineModel()
+    motor = SynAxis(name="motor")
+    other = SynAxis(name="other")
+    bl.devices["motor"] = motor
+    bl.devices["other"] = other
+    bl.get_device("motor.readback")
+    bl.get_device("motor", False)
+    bl.get_device("other.readback")
+
+    bl._unregister_device("motor")
+    assert [key[0] for key in bl._device_cache] == ["other.readback"]
@@ -0,0 +1,15 @@
+"""
+Import-time tests for nbs_bl.
+
+The import-time benchmark is in benchmarks/import_time.py.
+"""
+
+from nbs_bl.profiling import import_times
+
+# Modules that should only be imported by the functions that use them
+HEAVY_MODULES = ["pandas", "xarray", "scipy", "pkg_resources", "bluesky_live"]
+
+
+def test_plans_import_skips_heavy_modules():
+    times = import_times("nbs_bl.plans")
+    assert [m for m in HEAVY_MODULES if m in times] == []
@@ -0,0 +1,137 @@
+import contextlib
+import gc
+import io
+import threading
+import time
+import pytest
+from bluesky import RunEngine
+from bluesky.utils import RunEngineInterrupted
+from ophyd import Device
+from ophyd.status import DeviceStatus
+from nbs_bl.run_engine import load_RE_commands
+from nbs_bl.state_cache import GLOBAL_STATE_CACHE
+from nbs_bl.plans.plan_stubs import call_obj, set_exposure
+
+
+class SlowDetector(Device):
+    def __init__(self, *args, delay=0.3, fail=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.delay = delay
+        self.fail = fail
+        self.exposure = None
+
+    def set_exposure(self, exp_time):
+        status = DeviceStatus(self)
+
+        def finish():
+            if self.fail:
+                status.set_exception(RuntimeError("exposure rejected"))
+            else:
+                self.exposure = exp_time
+                status.set_finished()
+
+        threading.Timer(self.delay, finish).start()
+        return status
+
+
+def test_set_exposure_configures_detectors_concurrently():
+    RE = RunEngine(call_returns_result=True)
+    load_RE_commands(RE)
+    dets = [SlowDetector(name=f"det{n}") for n in range(4)]
+    start = time.monotonic()
+    with contextlib.redirect_stdout(io.StringIO()):
+        RE(set_exposure(2, extra_dets=dets))
+    assert time.monotonic() - start < 0.9
+    assert [d.exposure for d in dets] == [2] * 4
+    assert GLOBAL_STATE_CACHE.get_state(dets[0]) == {"exposure": 2}
+    GLOBAL_STATE_CACHE.forget()
+
+
+def test_set_exposure_reports_each_failed_detector():
+    RE = RunEngine(call_returns_result=True)
+    load_RE_commands(RE)
+    good = SlowDetector(name="good")
+    bad1 = SlowDetector(name="bad1", fail=True)
+    bad2 = SlowDetector(name="bad2", fail=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        with pytest.warns(RuntimeWarning) as record:
+            RE(set_exposure(3, extra_dets=[bad1, good, bad2]))
+    message = str(record[0].message)
+    assert "bad1" in message and "bad2" in message and "good" not in message
+    assert good.exposure == 3
+    assert GLOBAL_STATE_CACHE.get_state(bad1) == {}
+    GLOBAL_STATE_CACHE.forget()
+
+
+class BlockingDevice(Device):
+    stopped = False
+
+    def block(self, delay):
+        time.sleep(delay)
+        return delay
+
+    def stop(self, *, success=False):
+        self.stopped = True
+
+
+def test_call_obj_does_not_block_event_loop():
+    RE = RunEngine(call_returns_result=True)
+    load_RE_commands(RE, call_workers=2)
+    device = BlockingDevice(name="device")
+    start = time.monotonic()
+    ticks = []
+
+    def tick():
+        ticks.append(time.monotonic() - start)
+
+    RE.loop.call_soon_threadsafe(RE.loop.call_later, 0.1, tick)
+    result = RE(call_obj(device, "block", 0.5))
+    assert result.plan_result == 0.5
+    assert ticks and ticks[0] < 0.4
+
+
+def test_call_obj_awaits_status():
+    RE = RunEngine(call_returns_result=True)
+    load_RE_commands(RE)
+    det = SlowDetector(name="det", delay=0.2)
+    RE(call_obj(det, "set_exposure", 4, await_status=True))
+    assert det.exposure == 4
+
+    bad = SlowDetector(name="bad", delay=0.1, fail=True)
+    with pytest.raises(RuntimeError, match="exposure rejected"):
+        RE(call_obj(bad, "set_exposure", 4, await_status=True))
+    GLOBAL_STATE_CACHE.forget()
+
+
+def test_call_obj_is_not_stopped_by_pause():
+    RE = RunEngine(call_returns_result=True)
+    load_RE_commands(RE, call_workers=1)
+    device = BlockingDevice(name="device")
+    threading.Timer(0.1, RE.request_pause).start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        with pytest.warns(RuntimeWarning, match="may still be running"):
+            with pytest.raises(RunEngineInterrupted):
+                RE(call_obj(device, "block", 0.5))
+        assert not device.stopped
+        RE.abort()
+
+
+def test_call_obj_stops_device_when_halted():
+    RE = RunEngine(call_returns_result=True)
+    load_RE_commands(RE, call_workers=1)
+    device = BlockingDevice(name="device")
+    threading.Timer(0.1, RE.halt).start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        with pytest.warns(RuntimeWarning, match="stopping device"):
+            with pytest.raises(RunEngineInterrupted):
+                RE(call_obj(device, "block", 0.5))
+    assert device.stopped
+
+
+def test_call_obj_executor_shuts_down_with_run_engine():
+    RE = RunEngine(call_returns_result=True)
+    load_RE_commands(RE, call_workers=1)
+    executor = RE._command_registry["call_obj"].keywords["executor"]
+    del RE
+    gc.collect()
+    assert executor._shutdown
@@ -0,0 +1,45 @@
+import inspect
+from nbs_bl.plans.preprocessors import plan_md_decorator
+
+
+@plan_md_decorator
+def inner_plan(x, *positions, dwell=1, md=None, plan_level=0, **kwargs):
+    local_variable = x
+    return md
+
+
+@plan_md_decorator
+def outer_plan(sample, md=None, plan_level=0):
+    total = 0
+    return md, inner_plan(3, 4, 5, md=md, plan_level=plan_level, extra="e")
+
+
+def test_plan_md_records_bound_arguments():
+    outer_md, inner_md = outer_plan("s1", md={"scan": {"id": 1}})
+    assert outer_md["master_plan"] == "outer_plan"
+    assert inner_md["batch_uid"] == outer_md["batch_uid"]
+    assert [h["plan_name"] for h in outer_md["plan_history"]] == ["outer_plan"]
+    assert [h["plan_level"] for h in inner_md["plan_history"]] == [0, 1]
+    assert inner_md["plan_history"][0]["arguments"] == {
+        "sample": "s1",
+        "plan_level": 0,
+    }
+    assert inner_md["plan_history"][1]["arguments"] == {
+        "x": 3,
+        "positions": [4, 5],
+        "dwell": 1,
+        "plan_level": 0,
+        "extra": "e",
+    }
+    # Values of md are shared, not copied
+    assert inner_md["scan"] is outer_md["scan"]
+
+
+def test_plan_md_falls_back_when_signature_does_not_bind():
+    def plan(*args, md=None, plan_level=0, **kwargs):
+        return md
+
+    # A signature that does not match the plan, like one set by a decorator
+    plan.__signature__ = inspect.signature(lambda x, md=None, plan_level=0: None)
+    md = plan_md_decorator(plan)(1, y=2)
+    assert md["plan_history"][0]["arguments"] == {"plan_level": 0, "y": 2}
@@ -0,0 +1,144 @@
+import contextlib
+import io
+import json
+import time
+import pytest
+from bluesky import RunEngine
+from bluesky.plans import count, scan
+from ophyd.sim import SynAxis, SynGauss
+from nbs_bl.profiling import MessageProfiler, StartupProfiler
+
+
+def test_message_profiler_attributes_time_to_devices():
+    motor = SynAxis(name="motor", delay=0.05)
+    det = SynGauss("det", motor, "motor", 0, 1)
+    profiler = MessageProfiler()
+    RE = RunEngine(call_returns_result=True)
+    RE.preprocessors.append(profiler)
+    docs = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        RE(scan([det], motor, 0, 1, 3), lambda name, doc: docs.append((name, doc)))
+
+    report = profiler.last_report
+    assert report["uid"] == docs[0][1]["uid"]
+    assert report["messages"]["set"]["motor"]["count"] == 3
+    assert report["messages"]["trigger"]["det"]["count"] == 3
+    # Moves are waited on, so the waits are attributed to the motor
+    assert report["messages"]["wait"]["motor"]["time"] > 0.1
+    assert report["classes"]["motor"] == "SynAxis"
+
+    (descriptor,) = [
+        doc for name, doc in docs if name == "descriptor" and doc["name"] == "profile"
+    ]
+    (event,) = [
+        doc
+        for name, doc in docs
+        if name == "event" and doc["descriptor"] == descriptor["uid"]
+    ]
+    assert event["data"]["wait:motor"] == report["messages"]["wait"]["motor"]["time"]
+    assert event["data"]["total"] >= event["data"]["wait:motor"]
+    assert docs[-1][0] == "stop"
+
+
+def test_message_profiler_keeps_error_of_failed_run():
+    motor = SynAxis(name="motor")
+    det = SynGauss("det", motor, "motor", 0, 1)
+
+    def read():
+        raise RuntimeError("detector read failed")
+
+    det.read = read
+    profiler = MessageProfiler()
+    RE = RunEngine(call_returns_result=True)
+    RE.preprocessors.append(profiler)
+    docs = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        with pytest.raises(RuntimeError, match="detector read failed"):
+            RE(count([det]), lambda name, doc: docs.append((name, doc)))
+
+    # The timings are still reported, but not recorded in the failed run
+    assert profiler.last_report["uid"] == docs[0][1]["uid"]
+    assert not [
+        doc for name, doc in docs if name == "descriptor" and doc["name"] == "profile"
+    ]
+    name, stop = docs[-1]
+    assert name == "stop"
+    assert stop["exit_status"] == "fail"
+    assert "detector read failed" in stop["reason"]
+
+
+def test_message_profiler_forgets_runs_closed_by_run_engine():
+    from bluesky import Msg
+    from bluesky.utils import RunEngineInterrupted
+
+    profiler = MessageProfiler(print_summary=False)
+    RE = RunEngine(call_returns_result=True)
+    RE.preprocessors.append(profiler)
+
+    def failing():
+        yield Msg("open_run")
+        raise RuntimeError("plan failed")
+
+    with pytest.raises(RuntimeError, match="plan failed"):
+        RE(failing())
+    assert profiler._runs == {}
+
+    def pausing():
+        yield Msg("open_run")
+        yield Msg("checkpoint")
+        yield Msg("pause")
+        yield Msg("close_run")
+
+    with pytest.raises(RunEngineInterrupted):
+        RE(pausing())
+    assert len(profiler._runs) == 1
+    RE.abort()
+    assert profiler._runs == {}
+
+
+def test_startup_profiler_records_phases_and_items(tmp_path):
+    profiler = StartupProfiler()
+    with profiler.phase("load_beamline"):
+        with profiler.phase("devices"):
+            with profiler.item("devices", "fast"):
+                pass
+            with profiler.item("devices", "slow"):
+                time.sleep(0.02)
+    with profiler.phase("load_plans"):
+        pass
+
+    report = profiler.report()
+    assert [p["name"] for p in report["phases"]] == [
+        "load_beamline",
+        "load_beamline.devices",
+        "load_plans",
+    ]
+    assert report["phases"][0]["duration"] >= report["phases"][1]["duration"] >= 0.02
+    # Items are sorted from slowest to fastest
+    assert list(report["items"]["devices"]) == ["slow", "fast"]
+
+    report_file = tmp_path / "profile.json"
+    profiler.write_report(str(report_file))
+    assert json.loads(report_file.read_text())["items"]["devices"].keys() == {
+        "slow",
+        "fast",
+    }
+
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        profiler.print_summary(n=1)
+    assert "load_beamline.devices" in out.getvalue()
+    assert "slow" in out.getvalue() and "fast" not in out.getvalue()
+
+
+def test_startup_profiler_skips_timing_when_disabled():
+    profiler = StartupProfiler(enabled=False)
+    with profiler.phase("load_beamline"):
+        with profiler.item("devices", "m1"):
+            pass
+    assert profiler.phases == [] and profiler.items == {}
+
+    profiler.reset()
+    with profiler.phase("load_beamline"):
+        pass
+    assert len(profiler.phases) == 1
@@ -0,0 +1,140 @@
+import contextlib
+import io
+import pytest
+from bluesky import RunEngine
+from bluesky.plans import count
+from ophyd.device import Staged
+from ophyd import Component as Cpt, Signal
+from ophyd.sim import SynAxis, SynGauss
+from nbs_bl.devices.detectors import ScalarBase
+from nbs_bl.plans.groups import repeat
+from nbs_bl.plans.pipeline import setup_step
+
+setups = []
+
+
+@setup_step
+def count_setup(*args, md=None, **kwargs):
+    setups.append(1)
+    return args, dict(kwargs, md=dict(md or {}, setup=True))
+
+
+def make_detector():
+    motor = SynAxis(name="motor")
+    det = SynGauss("det", motor, "motor", 0, 1)
+    det.stages = []
+    det_stage = det.stage
+
+    def counting_stage():
+        det.stages.append(1)
+        return det_stage()
+
+    det.stage = counting_stage
+    return det
+
+
+@repeat
+@count_setup
+def counting(dets, num=1, md=None):
+    return (yield from count(dets, num=num, md=md))
+
+
+def run(plan):
+    RE = RunEngine(call_returns_result=True)
+    docs = []
+    result = RE(plan, lambda name, doc: docs.append((name, doc)))
+    return result.plan_result, docs
+
+
+def test_full_repeat_runs_setup_each_time():
+    setups.clear()
+    det = make_detector()
+    uids, docs = run(counting([det], repeat=3))
+    assert len(uids) == 3
+    assert len(setups) == 3
+    assert len(det.stages) == 3
+    starts = [doc for name, doc in docs if name == "start"]
+    assert [s["repeat"]["index"] for s in starts] == [0, 1, 2]
+
+
+def test_runs_repeat_shares_setup_and_staging():
+    setups.clear()
+    det = make_detector()
+    uids, docs = run(counting([det], num=2, repeat=3, repeat_mode="runs"))
+    assert len(set(uids)) == 3
+    assert len(setups) == 1
+    assert len(det.stages) == 1
+    assert det._staged == Staged.no
+    starts = [doc for name, doc in docs if name == "start"]
+    assert [s["repeat"]["index"] for s in starts] == [0, 1, 2]
+    assert all(s["setup"] and s["repeat"]["mode"] == "runs" for s in starts)
+    assert len([name for name, doc in docs if name == "stop"]) == 3
+
+
+def test_single_run_repeat_records_repeat_index():
+    setups.clear()
+    det = make_detector()
+    uids, docs = run(counting([det], num=2, repeat=3, repeat_mode="single_run"))
+    assert len(set(uids)) == 1
+    assert len(setups) == 1
+    assert len(det.stages) == 1
+    names = [name for name, doc in docs]
+    assert names.count("start") == 1 and names.count("stop") == 1
+    assert docs[-1][1]["exit_status"] == "success"
+    events = [doc for name, doc in docs if name == "event"]
+    assert [e["data"]["repeat_index"] for e in events] == [0, 0, 1, 1, 2, 2]
+    assert [e["seq_num"] for e in events] == [1, 2, 3, 4, 5, 6]
+
+
+def stream_names(docs):
+    streams = {doc["uid"]: doc["name"] for name, doc in docs if name == "descriptor"}
+    events = [streams[doc["descriptor"]] for name, doc in docs if name == "event"]
+    return list(streams.values()), events
+
+
+@pytest.mark.parametrize("change_only", [False, True])
+def test_single_run_repeat_of_nbs_scan_records_one_baseline(change_only):
+    with contextlib.redirect_stdout(io.StringIO()):
+        from nbs_bl.plans.scan_decorators import (
+            nbs_base_scan_decorator,
+            staged_baseline_wrapper,
+        )
+
+    baseline_motor = SynAxis(name="baseline_motor")
+
+    def baseline_count(detectors, num=1, md=None):
+        plan = count(detectors, num=num, md=md)
+        return (
+            yield from staged_baseline_wrapper(
+                plan, [baseline_motor], change_only=change_only
+            )
+        )
+
+    nbs_baseline_count = nbs_base_scan_decorator(baseline_count)
+    det = make_detector()
+    with contextlib.redirect_stdout(io.StringIO()):
+        uids, docs = run(
+            nbs_baseline_count(
+                extra_dets=[det], num=2, repeat=3, repeat_mode="single_run"
+            )
+        )
+    assert len(set(uids)) == 1
+    descriptors, events = stream_names(docs)
+    assert descriptors == ["staged_baseline", "primary"]
+    assert events == ["staged_baseline"] + ["primary"] * 6 + ["staged_baseline"]
+
+
+class SimScalar(ScalarBase):
+    target = Cpt(Signal, value=0, kind="omitted")
+
+
+def test_runs_repeat_starts_a_resource_per_run(tmp_path):
+    det = SimScalar(name="det", raw_directory=str(tmp_path))
+    det.exposure_time.put(0.01)
+    uids, docs = run(counting([det], repeat=2, repeat_mode="runs"))
+    resources = [doc for name, doc in docs if name == "resource"]
+    assert [r["run_start"] for r in resources] == uids
+    run_of_resource = {r["uid"]: r["run_start"] for r in resources}
+    datums = [doc for name, doc in docs if name == "datum"]
+    assert len(datums) == 2
+    assert [run_of_resource[d["resource"]] for d in datums] == uids
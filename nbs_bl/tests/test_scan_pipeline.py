@@ -0,0 +1,145 @@
+"""
+Tests for the scan pipeline.
+
+The message throughput benchmark is in benchmarks/scan_pipeline.py.
+"""
+
+import contextlib
+import inspect
+import io
+import pytest
+from bluesky import Msg
+from bluesky.plan_stubs import mv
+from ophyd.sim import SynAxis
+from nbs_bl.plans import pipeline
+from nbs_bl.plans.pipeline import setup_step, set_move_stage_policy
+from nbs_bl.plans.plan_stubs import sampleholder_move_sample
+
+
+@setup_step
+def add_a(*args, a=1, md=None, **kwargs):
+    """
+    Parameters
+    ----------
+    a : int, optional
+        Added to md
+    """
+    yield Msg("null")
+    return args, dict(kwargs, md=dict(md or {}, a=a))
+
+
+@setup_step
+def add_b(*args, b=2, md=None, **kwargs):
+    return args, dict(kwargs, md=dict(md or {}, b=b))
+
+
+def plan(x, md=None):
+    """
+    Parameters
+    ----------
+    x : int
+        Returned by the plan
+    """
+    yield Msg("open_run", **md)
+    return x
+
+
+def test_setup_steps_compose_into_one_pipeline():
+    wrapped = add_a(add_b(plan))
+    _, steps, target = wrapped._pipeline
+    assert target is plan
+    assert len(steps) == 2
+    assert set(inspect.signature(wrapped).parameters) == {"x", "a", "b", "md"}
+    assert "a : int" in wrapped.__doc__ and "x : int" in wrapped.__doc__
+
+    gen = wrapped(5, a=3)
+    assert next(gen) == Msg("null")
+    assert gen.send(None) == Msg("open_run", a=3, b=2)
+    with pytest.raises(StopIteration) as finished:
+        gen.send(None)
+    assert finished.value.value == 5
+
+
+x_motor = SynAxis(name="x_motor")
+y_motor = SynAxis(name="y_motor")
+z_motor = SynAxis(name="z_motor")
+
+
+@setup_step(moves=True)
+def move_x(*args, x=None, **kwargs):
+    if x is not None:
+        yield from mv(x_motor, x)
+    return args, kwargs
+
+
+@setup_step(moves=True)
+def move_yz(*args, y=None, z=None, **kwargs):
+    if y is not None:
+        yield from mv(y_motor, y)
+    if z is not None:
+        yield from mv(z_motor, z)
+    return args, kwargs
+
+
+def test_setup_moves_are_combined_in_stages():
+    wrapped = add_b(move_x(move_yz(plan)))
+    policy = pipeline._move_stage_policy
+    try:
+        set_move_stage_policy(lambda: lambda obj: 1 if obj is z_motor else 0)
+        msgs = list(wrapped(0, x=1, y=2, z=3))
+    finally:
+        set_move_stage_policy(policy)
+    assert [(m.command, m.obj) for m in msgs] == [
+        ("set", x_motor),
+        ("set", y_motor),
+        ("wait", None),
+        ("set", z_motor),
+        ("wait", None),
+        ("open_run", None),
+    ]
+    groups = [m.kwargs["group"] for m in msgs[:5]]
+    assert groups[0] == groups[1] == groups[2]
+    assert groups[3] == groups[4] != groups[0]
+
+    # Without a stage function, every move is waited for
+    try:
+        set_move_stage_policy(None)
+        msgs = list(wrapped(0, x=1, y=2, z=3))
+    finally:
+        set_move_stage_policy(policy)
+    assert [m.command for m in msgs].count("wait") == 3
+
+
+class SampleHolder(SynAxis):
+    def get_sample_position(self, sample_id):
+        return sample_id
+
+
+holder = SampleHolder(name="holder")
+
+
+@setup_step(moves=True)
+def move_sample(*args, sample=None, **kwargs):
+    yield from sampleholder_move_sample(holder, sample)
+    return args, kwargs
+
+
+def test_sample_move_reports_done_only_when_moved():
+    from bluesky import RunEngine
+    from nbs_bl.run_engine import load_RE_commands
+
+    RE = RunEngine(call_returns_result=True)
+    load_RE_commands(RE)
+    wrapped = move_sample(add_b(plan))
+    policy = pipeline._move_stage_policy
+    for stage, done in [(None, True), (lambda: lambda obj: 0, False)]:
+        out = io.StringIO()
+        try:
+            set_move_stage_policy(stage)
+            with contextlib.redirect_stdout(out):
+                RE(wrapped(0, sample=2))
+        finally:
+            set_move_stage_policy(policy)
+        assert holder.position == 2
+        assert ("Done Moving" in out.getvalue()) == done
+        holder.set(0).wait()
@@ -0,0 +1,149 @@
+import contextlib
+import io
+import pytest
+from bluesky import RunEngine
+from ophyd import Device, Signal, Component as Cpt
+from ophyd.sim import SynAxis
+from nbs_bl.beamline import GLOBAL_BEAMLINE
+from nbs_bl.run_engine import load_RE_commands
+from nbs_bl.state_cache import DeviceStateCache, GLOBAL_STATE_CACHE, is_at_position
+from nbs_bl.plans.plan_stubs import set_exposure, move_if_changed
+
+
+class ConfigurableDetector(Device):
+    exposure_time = Cpt(Signal, value=1, kind="config")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = []
+
+    def set_exposure(self, exp_time):
+        self.calls.append(exp_time)
+        self.exposure_time.set(exp_time).wait()
+
+
+def test_state_cache_tracks_rois():
+    cache = DeviceStateCache()
+    det = object()
+    assert not cache.is_current(det, "clear_roi", "pfy")
+    cache.record_call(det, "clear_all_rois")
+    assert cache.is_current(det, "clear_roi", "pfy")
+    assert cache.is_current(det, "clear_all_rois")
+    cache.record_call(det, "set_roi", ("pfy", 200, 300))
+    assert cache.is_current(det, "set_roi", "pfy", 200, 300)
+    assert not cache.is_current(det, "set_roi", "pfy", 200, 310)
+    assert not cache.is_current(det, "clear_roi", "pfy")
+    assert not cache.is_current(det, "clear_all_rois")
+    cache.record_call(det, "clear_roi", ("pfy",))
+    assert cache.is_current(det, "clear_roi", "pfy")
+    cache.forget(det)
+    assert not cache.is_current(det, "clear_roi", "pfy")
+
+
+def test_state_cache_forgets_disconnected_devices():
+    cache = DeviceStateCache()
+    det = ConfigurableDetector(name="det")
+    cache.record_call(det, "set_roi", ("pfy", 200, 300))
+    signal = det.exposure_time
+    # Metadata updates of a connected signal keep the state
+    signal._run_subs(sub_type=signal.SUB_META, **signal.metadata)
+    assert cache.is_current(det, "set_roi", "pfy", 200, 300)
+
+    # Like an EpicsSignal whose IOC went away
+    signal._run_subs(sub_type=signal.SUB_META, **dict(signal.metadata, connected=False))
+    assert not cache.is_current(det, "set_roi", "pfy", 200, 300)
+    assert cache.get_state(det) == {}
+
+
+def test_is_at_position():
+    motor = SynAxis(name="motor")
+    motor.set(1).wait()
+    assert is_at_position(motor, 1.05, 0.1)
+    assert not is_at_position(motor, 1.5, 0.1)
+    assert not is_at_position(object(), 1)
+
+
+def test_unchanged_setup_is_skipped():
+    RE = RunEngine(call_returns_result=True)
+    load_RE_commands(RE)
+    det = ConfigurableDetector(name="det")
+    motor = SynAxis(name="motor")
+    GLOBAL_BEAMLINE.settings["setup"] = {
+        "skip_unchanged": True,
+        "tolerances": {"motor": 0.1},
+    }
+    moves = []
+    motor_set = motor.set
+
+    def counting_set(value):
+        moves.append(value)
+        return motor_set(value)
+
+    motor.set = counting_set
+    try:
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            RE(set_exposure(2, extra_dets=[det]))
+            RE(set_exposure(2, extra_dets=[det]))
+            RE(move_if_changed(motor, 1))
+            RE(move_if_changed(motor, 1.05))
+        assert det.calls == [2]
+        assert "Skipping unchanged set_exposure(2) for det" in out.getvalue()
+        assert "Skipping move of motor" in out.getvalue()
+        assert moves == [1]
+
+        # A change behind the cache's back is noticed for exposure signals
+        det.exposure_time.put(5)
+        with contextlib.redirect_stdout(io.StringIO()):
+            RE(set_exposure(2, extra_dets=[det]))
+        assert det.calls == [2, 2]
+    finally:
+        GLOBAL_BEAMLINE.settings.pop("setup", None)
+        GLOBAL_STATE_CACHE.forget()
+
+
+def test_setup_tolerance_by_role():
+    RE = RunEngine(call_returns_result=True)
+    load_RE_commands(RE)
+    motor = SynAxis(name="en")
+    motor.set(1).wait()
+    GLOBAL_BEAMLINE.settings["setup"] = {
+        "skip_unchanged": True,
+        "tolerances": {"energy": 0.1},
+    }
+    energy = getattr(GLOBAL_BEAMLINE, "energy", None)
+    GLOBAL_BEAMLINE.energy = motor
+    try:
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            RE(move_if_changed(motor, 1.05))
+        assert "Skipping move of en" in out.getvalue()
+        assert motor.position == 1
+    finally:
+        GLOBAL_BEAMLINE.energy = energy
+        GLOBAL_BEAMLINE.settings.pop("setup", None)
+
+
+class FailingDetector(ConfigurableDetector):
+    fail = True
+
+    def set_exposure(self, exp_time):
+        if self.fail:
+            raise RuntimeError("exposure rejected")
+        super().set_exposure(exp_time)
+
+
+def test_failed_configuration_is_not_current():
+    RE = RunEngine(call_returns_result=True)
+    load_RE_commands(RE)
+    det = FailingDetector(name="det")
+    GLOBAL_BEAMLINE.settings["setup"] = {"skip_unchanged": True}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            with pytest.warns(RuntimeWarning, match="exposure rejected"):
+                RE(set_exposure(2, extra_dets=[det]))
+            assert not GLOBAL_STATE_CACHE.is_current(det, "set_exposure", 2)
+            det.fail = False
+            RE(set_exposure(2, extra_dets=[det]))
+        assert det.calls == [2]
+    finally:
+        GLOBAL_BEAMLINE.settings.pop("setup", None)
+        GLOBAL_STATE_CACHE.forget()
@@ -0,0 +1,43 @@
+import inspect
+from nbs_bl.utils import merge_func
+
+
+def plan(a, b=1):
+    """
+    A plan.
+
+    Parameters
+    ----------
+    a : int
+        First parameter
+    b : int, optional
+        Second parameter
+    """
+    yield
+
+
+def add_flag(func):
+    @merge_func(func)
+    def wrapper(*args, flag=False, **kwargs):
+        """
+        A wrapped plan.
+
+        Parameters
+        ----------
+        flag : bool, optional
+            Added by a decorator
+        """
+        yield from func(*args, **kwargs)
+
+    return wrapper
+
+
+def test_stacked_merge_func_merges_docstrings():
+    wrapped = add_flag(add_flag(plan))
+    assert inspect.isgeneratorfunction(wrapped)
+    assert list(inspect.signature(wrapped).parameters) == ["a", "b", "flag"]
+    doc = wrapped.__doc__
+    assert doc.strip().startswith("A wrapped plan.")
+    for param in ["a : int", "b : int, optional", "flag : bool, optional"]:
+        assert doc.count(param) == 1
+    assert doc.index("a : int") < doc.index("b : int") < doc.index("flag : bool")
@@ -1,8 +1,6 @@
 import collections
 import inspect
-from functools import update_wrapper
-from numpydoc.docscrape import NumpyDocString, Parameter
-import copy
+from functools import update_wrapper, lru_cache
 
 
 def iterfy(x):
@@ -121,13 +119,33 @@ def merge_docstrings(doc1, doc2, omit_params=[], param_order=None):
     str
         The merged docstring.
     """
-    # Parse the docstrings
-    if doc1 is None:
-        doc1 = ""
-    if doc2 is None:
-        doc2 = ""
-    parsed_doc1 = NumpyDocString(doc1)
-    parsed_doc2 = NumpyDocString(doc2)
+    merged_doc = _merge_parsed_docstrings(
+        _parse_docstring(doc1 or ""),
+        _parse_docstring(doc2 or ""),
+        omit_params,
+        param_order,
+    )
+    return str(merged_doc)
+
+
+@lru_cache(maxsize=None)
+def _parse_docstring(doc):
+    """Parse a docstring once. The result is shared, and must not be modified."""
+    from numpydoc.docscrape import NumpyDocString
+
+    return NumpyDocString(doc)
+
+
+def _get_parsed_docstring(func):
+    """Parse the docstring of func, reusing the structure from merge_func if it is current."""
+    parsed = getattr(func, "__parsed_doc__", None)
+    if parsed is not None and parsed[0] is func.__doc__:
+        return parsed[1]
+    return _parse_docstring(func.__doc__ or "")
+
+
+def _merge_parsed_docstrings(parsed_doc1, parsed_doc2, omit_params=[], param_order=None):
+    from numpydoc.docscrape import NumpyDocString, Parameter
 
     # Merge the parameters
     params1 = {name: (typ, desc) for name, typ, desc in parsed_doc1["Parameters"]}
@@ -152,14 +170,14 @@ def merge_docstrings(doc1, doc2, omit_params=[], param_order=None):
     else:
         merged_params.sort(key=lambda param: "**" in param.name)
 
-    # Create a copy of the first parsed docstring
-    merged_doc = copy.deepcopy(parsed_doc1)
+    # Create a shallow copy of the first parsed docstring, the sections are not modified
+    merged_doc = NumpyDocString("")
+    for section in parsed_doc1:
+        merged_doc[section] = parsed_doc1[section]
 
     # Update the 'Parameters' section of the copied docstring
     merged_doc["Parameters"] = merged_params
-
-    # Convert the merged docstring back to a string
-    return str(merged_doc)
+    return merged_doc
 
 
 def sort_params(params):
@@ -218,10 +236,17 @@ def merge_func(
         ]
         sort_params(combined_params)
         param_order = [param.name for param in combined_params]
-        merged_docstring = merge_docstrings(
-            wrapper.__doc__, func.__doc__, omit_params, param_order
+        # Merge the parsed docstrings, so that stacked decorators do not
+        # re-parse the rendered docstring of every layer
+        merged_doc = _merge_parsed_docstrings(
+            _parse_docstring(wrapper.__doc__ or ""),
+            _get_parsed_docstring(func),
+            omit_params,
+            param_order,
         )
+        merged_docstring = str(merged_doc)
         wrapper.__doc__ = merged_docstring
+        wrapper.__parsed_doc__ = (merged_docstring, merged_doc)
         # Create a new signature with the merged parameters
         new_sig = sig_wrapper.replace(parameters=combined_params)
 